@@ -1,2 +1,19 @@
-from . import extensions, install_torch, utauplugin2score  # noqa: F401
-# enunu2nnsvs は torch を要求してしまうので個別import必須にする。
+from . import (  # noqa: F401
+    cache,
+    chunking,
+    extensions,
+    install_torch,
+    pcm_stream,
+    pipeline,
+    region_render,
+    render_queue,
+    table,
+    tracing,
+    utauplugin2score,
+    wav_buffer,
+    wav_gain,
+    workspace,
+)
+# enunu2nnsvs と revocode は torch を、feature_store は h5py を要求してしまうので
+# 個別import必須にする。
+# diagnostics は python -m で実行するときに二重に読み込まれないように個別importにする。
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+複数のセグメントの推論を1つのミニバッチにまとめて実行する。
+
+BatchedModel はモデルのプロキシで、複数のスレッドから呼ばれた inference() を
+ゼロ埋めして1つのバッチにまとめ、モデルを1回だけ実行して結果を分配する。
+登録されているスレッドがすべて inference() で待っている状態になったらバッチを実行するので、
+タイムアウトで待つことはない。
+
+最初のバッチだけは1系列ずつの推論とも比べて、結果が一致しない場合 (パディングの影響を受ける
+モデルの場合) はバッチ処理をやめて1系列ずつ推論する。
+"""
+
+import logging
+import threading
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# バッチ処理と1系列ずつの推論の結果の差の許容値
+BATCH_TOLERANCE = 1e-4
+
+
+def _split_output(output, lengths: list[int]):
+    """バッチの出力を系列ごとに分ける。分けられない形の場合は None を返す。"""
+    if isinstance(output, torch.Tensor):
+        if output.dim() < 2 or output.shape[0] != len(lengths):
+            return None
+        return [output[i : i + 1, :length] for i, length in enumerate(lengths)]
+    if isinstance(output, (tuple, list)):
+        parts = [_split_output(x, lengths) for x in output]
+        if any(part is None for part in parts):
+            return None
+        return [type(output)(part[i] for part in parts) for i in range(len(lengths))]
+    return None
+
+
+def _max_difference(a, b) -> float:
+    """2つの出力の差の最大値を返す。"""
+    if isinstance(a, torch.Tensor):
+        if a.shape != b.shape:
+            return float('inf')
+        return float((a.float() - b.float()).abs().max()) if a.numel() > 0 else 0.0
+    return max((_max_difference(x, y) for x, y in zip(a, b)), default=0.0)
+
+
+class BatchedModel:
+    """複数のスレッドからの inference() をまとめて実行するモデルのプロキシ。
+
+    inference() 以外の属性はもとのモデルのものを返す。
+
+    Args:
+        model (torch.nn.Module): もとのモデル
+        name (str): ログに表示する名前
+    """
+
+    def __init__(self, model, name: str = 'model'):
+        self.model = model
+        self.name = name
+        self.enabled = True
+        self.verified = False
+        self._condition = threading.Condition()
+        self._n_workers = 0
+        self._pending: list[dict] = []
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def add_workers(self, n_workers: int):
+        """n_workers 個のスレッドがバッチに参加することを、スレッドを開始する前に登録する。
+
+        各スレッドは推論が終わったら remove_worker() を呼ぶこと。
+        """
+        with self._condition:
+            self._n_workers += n_workers
+
+    def remove_worker(self):
+        """バッチに参加するスレッドの登録を1つ解除する。"""
+        with self._condition:
+            self._n_workers -= 1
+            self._flush_if_ready()
+
+    def inference(self, x, lengths=None, *args, **kwargs):
+        """推論する。登録されたスレッドから呼ばれた場合は、ほかのスレッドの入力とまとめる。"""
+        if not self.enabled or args or kwargs or x.dim() != 3 or x.shape[0] != 1:
+            return self.model.inference(x, lengths, *args, **kwargs)
+        request = {'x': x, 'done': False, 'output': None, 'error': None}
+        with self._condition:
+            if self._n_workers > 1:
+                self._pending.append(request)
+                self._flush_if_ready()
+                while not request['done']:
+                    self._condition.wait()
+                if request['error'] is not None:
+                    raise request['error']
+                return request['output']
+        return self.model.inference(x, lengths)
+
+    def _flush_if_ready(self):
+        """すべてのスレッドが待っていればバッチを実行する。ロックを取得してから呼ぶこと。"""
+        if not self._pending or len(self._pending) < self._n_workers:
+            return
+        requests, self._pending = self._pending, []
+        try:
+            with torch.no_grad():
+                outputs = self._run_batch([request['x'] for request in requests])
+            for request, output in zip(requests, outputs):
+                request['output'] = output
+        except Exception as e:  # noqa: BLE001
+            for request in requests:
+                request['error'] = e
+        for request in requests:
+            request['done'] = True
+        self._condition.notify_all()
+
+    def _run_batch(self, inputs: list) -> list:
+        """入力をゼロ埋めしてまとめて推論し、系列ごとの出力を返す。"""
+        if len(inputs) == 1:
+            return [self.model.inference(inputs[0], [inputs[0].shape[1]])]
+        lengths = [x.shape[1] for x in inputs]
+        order = sorted(range(len(inputs)), key=lambda i: lengths[i], reverse=True)
+        # pack_padded_sequence を使うモデルのために長い順に並べる
+        sorted_lengths = [lengths[i] for i in order]
+        batch = inputs[0].new_zeros((len(inputs), max(lengths), inputs[0].shape[2]))
+        for row, i in enumerate(order):
+            batch[row, : lengths[i]] = inputs[i][0]
+        split = _split_output(self.model.inference(batch, sorted_lengths), sorted_lengths)
+        if split is None:
+            logger.warning('%s does not support batched inference.', self.name)
+            self.enabled = False
+            return [self.model.inference(x, [x.shape[1]]) for x in inputs]
+        outputs = [None] * len(inputs)
+        for row, i in enumerate(order):
+            outputs[i] = split[row]
+        # 最初のバッチは1系列ずつの推論と比べる
+        if not self.verified:
+            singles = [self.model.inference(x, [x.shape[1]]) for x in inputs]
+            difference = max(_max_difference(a, b) for a, b in zip(outputs, singles))
+            self.verified = True
+            if difference > BATCH_TOLERANCE:
+                logger.warning(
+                    '%s: batched output differs from unbatched one by %s. Disabled batching.',
+                    self.name,
+                    difference,
+                )
+                self.enabled = False
+                return singles
+            logger.info('%s: batched inference is enabled (max diff %s).', self.name, difference)
+        return outputs
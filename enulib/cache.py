@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+ENUNUのキャッシュフォルダを扱う関数とか
+
+キャッシュは ENUNU のフォルダ内の .cache に保存する。
+環境変数 ENUNU_CACHE_DIR を指定するとその場所に保存する。
+"""
+
+import hashlib
+import shutil
+from os import environ, listdir, makedirs, remove
+from os.path import abspath, dirname, getmtime, isdir, join
+
+CACHE_DIR = environ.get('ENUNU_CACHE_DIR', join(dirname(dirname(abspath(__file__))), '.cache'))
+
+
+def get_cache_dir(*names: str) -> str:
+    """キャッシュフォルダのパスを返す。なければ作る。"""
+    path = join(CACHE_DIR, *names)
+    makedirs(path, exist_ok=True)
+    return path
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ファイルの内容のハッシュ値 (SHA-256) を返す。"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def hash_strings(*values: str) -> str:
+    """文字列の並びのハッシュ値 (SHA-256) を返す。"""
+    sha256 = hashlib.sha256()
+    for value in values:
+        sha256.update(value.encode('utf-8'))
+        sha256.update(b'\0')
+    return sha256.hexdigest()
+
+
+def prune(path: str, max_entries: int):
+    """キャッシュフォルダ内の項目数が max_entries を超えたら、古いものから削除する。"""
+    entries = [join(path, name) for name in listdir(path)]
+    if len(entries) <= max_entries:
+        return
+    entries.sort(key=getmtime)
+    for entry in entries[: len(entries) - max_entries]:
+        if isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            try:
+                remove(entry)
+            except OSError:
+                pass
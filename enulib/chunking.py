@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+休符で区切れない長いフレーズを、前後に文脈を付けた短い区間(チャンク)に分けて推論するための関数。
+
+各チャンクは「推論に使う区間 (start ~ end)」と、
+その中で実際に出力に使う「中心区間 (core_start ~ core_end)」をもつ。
+隣り合うチャンクの境界では crossfade フレーム分だけ線形にクロスフェードする。
+
+誤差について:
+    文脈 (overlap_frames) がモデルの受容野より長ければ、クロスフェード区間の外側は
+    分割しない場合と数値誤差の範囲で一致する。受容野に上限がないRNN系のモデルでは
+    分割しない場合と結果が変わり、その差は測定していない。
+    WORLD ボコーダは励振パルスの位相がチャンクごとに変わるので、波形は標本単位では一致しない。
+    そのため enunu.py では分割推論を既定で無効にしている。
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Chunk(NamedTuple):
+    """チャンクの範囲 (フレーム単位)。
+
+    first, last はラベルを分割する場合の音素番号 (last は含まない)。
+    """
+
+    start: int
+    core_start: int
+    core_end: int
+    end: int
+    first: int = 0
+    last: int = 0
+
+
+def plan_label_chunks(
+    phoneme_frames: list[int], chunk_frames: int, overlap_frames: int
+) -> list[Chunk]:
+    """音素の境界で区切るようにチャンクを決める。
+
+    Args:
+        phoneme_frames (list[int]): 各音素のフレーム数
+        chunk_frames (int): 中心区間の長さの目安 (フレーム数)
+        overlap_frames (int): 前後に付ける文脈の長さの最小値 (フレーム数)
+    """
+    bounds = np.concatenate([[0], np.cumsum(phoneme_frames, dtype=np.int64)])
+    n_phonemes = len(phoneme_frames)
+    total = int(bounds[-1])
+    if total <= chunk_frames:
+        return [Chunk(0, 0, total, total, 0, n_phonemes)]
+
+    # 中心区間の境界を、目標フレームに最も近い音素境界にする
+    cut_indices = [0]
+    while bounds[cut_indices[-1]] + chunk_frames < total:
+        target = bounds[cut_indices[-1]] + chunk_frames
+        idx = int(np.searchsorted(bounds, target))
+        if idx > cut_indices[-1] + 1 and target - bounds[idx - 1] < bounds[idx] - target:
+            idx -= 1
+        cut_indices.append(max(idx, cut_indices[-1] + 1))
+    if cut_indices[-1] != n_phonemes:
+        cut_indices.append(n_phonemes)
+
+    chunks = []
+    for core_first, core_last in zip(cut_indices[:-1], cut_indices[1:]):
+        # 文脈が overlap_frames 以上になるまで前後に音素を広げる
+        first = core_first
+        while first > 0 and bounds[core_first] - bounds[first] < overlap_frames:
+            first -= 1
+        last = core_last
+        while last < n_phonemes and bounds[last] - bounds[core_last] < overlap_frames:
+            last += 1
+        chunks.append(
+            Chunk(
+                int(bounds[first]),
+                int(bounds[core_first]),
+                int(bounds[core_last]),
+                int(bounds[last]),
+                first,
+                last,
+            )
+        )
+    return chunks
+
+
+def plan_frame_chunks(n_frames: int, chunk_frames: int, overlap_frames: int) -> list[Chunk]:
+    """フレーム単位で等間隔にチャンクを決める。"""
+    if n_frames <= chunk_frames:
+        return [Chunk(0, 0, n_frames, n_frames)]
+    chunks = []
+    for core_start in range(0, n_frames, chunk_frames):
+        core_end = min(core_start + chunk_frames, n_frames)
+        chunks.append(
+            Chunk(
+                max(core_start - overlap_frames, 0),
+                core_start,
+                core_end,
+                min(core_end + overlap_frames, n_frames),
+            )
+        )
+    return chunks
+
+
+def crossfade_chunks(
+    pieces: list[np.ndarray], chunks: list[Chunk], crossfade: int, scale: int = 1
+) -> np.ndarray:
+    """チャンクごとの推論結果をクロスフェードしながらつなげる。
+
+    Args:
+        pieces (list[np.ndarray]): チャンクごとの推論結果。先頭がチャンクの start に対応する。
+        chunks (list[Chunk]): チャンクの範囲
+        crossfade (int): クロスフェードする長さ (フレーム数)。境界を中心にかける。
+        scale (int): 1フレームあたりの要素数。波形の場合はホップサイズ (サンプル数)。
+    """
+    total = max(chunk.start * scale + len(piece) for piece, chunk in zip(pieces, chunks))
+    out = np.zeros((total, *pieces[0].shape[1:]), dtype=np.result_type(*pieces))
+    weight_sum = np.zeros(total)
+    half = crossfade * scale // 2
+
+    for idx, (piece, chunk) in enumerate(zip(pieces, chunks)):
+        offset = chunk.start * scale
+        t = np.arange(offset, offset + len(piece))
+        weight = np.ones(len(piece))
+        # 前のチャンクとの境界でフェードイン
+        if idx > 0:
+            boundary = chunk.core_start * scale
+            if half > 0:
+                fade = np.clip((t - boundary + half + 0.5) / (2 * half), 0, 1)
+            else:
+                fade = (t >= boundary).astype(np.float64)
+            weight = np.minimum(weight, fade)
+        # 次のチャンクとの境界でフェードアウト
+        if idx < len(pieces) - 1:
+            boundary = chunk.core_end * scale
+            if half > 0:
+                fade = np.clip((boundary + half - t - 0.5) / (2 * half), 0, 1)
+            else:
+                fade = (t < boundary).astype(np.float64)
+            weight = np.minimum(weight, fade)
+        out[offset : offset + len(piece)] += piece * weight.reshape(-1, *[1] * (piece.ndim - 1))
+        weight_sum[offset : offset + len(piece)] += weight
+
+    # 文脈の長さが足りずに重みの合計が1にならない箇所を補正する
+    nonzero = weight_sum > 0
+    out[nonzero] /= weight_sum[nonzero].reshape(-1, *[1] * (out.ndim - 1))
+    return out
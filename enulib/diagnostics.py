@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+ENUNU の起動が遅い原因を調べるための診断コマンド。
+
+1. enunu.py と同じモジュールを新しいプロセスで `-X importtime` 付きで import して、
+   モジュールごとの import 時間をツリーにまとめる。
+2. find_spec('torch') の時間を測る。
+3. 音源フォルダを指定した場合は、enunu.py の読み込み、モデルフォルダの検索、
+   設定ファイルとテーブルの読み込み、エンジンの構築の時間を測る。
+   enunu.py は PyTorch がないと import 時にインストールを始めるので、
+   PyTorch がない環境ではこの測定を飛ばす。
+
+使用例:
+    python -m enulib.diagnostics
+    python -m enulib.diagnostics path/to/voice_dir --json diagnostics.json
+"""
+
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from importlib.util import find_spec
+from os.path import dirname, join
+
+# enunu.py が起動時に import するモジュール (enunu.py の import 文と同じ順番)
+STARTUP_IMPORTS = (
+    'colored_traceback.auto',
+    'tkinter',
+    'tkinter.filedialog',
+    'tqdm.contrib.logging',
+    'numpy',
+    'utaupy',
+    'yaml',
+    'nnmnkwii.io.hts',
+    'scipy.io.wavfile',
+    'tqdm.auto',
+    'enulib',
+    'torch',
+    'nnsvs',
+    'nnsvs.svs',
+    'enulib.batching',
+    'enulib.enunu2nnsvs',
+)
+# -X importtime の出力の行
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$')
+# enunu.py があるフォルダ
+ENUNU_DIR = dirname(dirname(__file__))
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """
+    `-X importtime` の出力を、モジュールのツリーにする。
+
+    出力は子のモジュールが親より先に並ぶ (帰りがけ順) ので、
+    深さごとにまだ親が決まっていないモジュールを溜めておき、親の行でまとめて子にする。
+
+    Returns:
+        list[dict]: 最上位のモジュールのリスト。
+            各要素は {'name', 'self_ms', 'cumulative_ms', 'children'}
+    """
+    pending: dict[int, list[dict]] = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = (len(indent) - 1) // 2
+        node = {
+            'name': name,
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000,
+            'children': pending.pop(depth + 1, []),
+        }
+        pending.setdefault(depth, []).append(node)
+    return pending.get(0, [])
+
+
+def measure_imports(modules=STARTUP_IMPORTS) -> list[dict]:
+    """
+    新しいプロセスで modules を順番に import して、import 時間のツリーを返す。
+    import できないモジュールは飛ばす。
+    同梱の embeddable Python では -c でもカレントディレクトリが sys.path に入らないので、
+    enulib を import できるように ENUNU_DIR を sys.path に追加してから import する。
+    """
+    code = f'import sys\nsys.path.insert(0, {ENUNU_DIR!r})\n' + '\n'.join(
+        f'try:\n    import {module}\nexcept Exception:\n    pass' for module in modules
+    )
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ENUNU_DIR,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return parse_importtime(result.stderr)
+
+
+def flatten(nodes: list[dict]) -> list[dict]:
+    """ツリーのすべてのモジュールをリストにする。"""
+    flat = []
+    for node in nodes:
+        flat.append(node)
+        flat.extend(flatten(node['children']))
+    return flat
+
+
+def format_tree(nodes: list[dict], max_depth: int, min_ms: float, depth: int = 0) -> list[str]:
+    """import 時間のツリーを、累積時間の長い順に文字列の行にする。"""
+    lines = []
+    for node in sorted(nodes, key=lambda x: x['cumulative_ms'], reverse=True):
+        if node['cumulative_ms'] < min_ms:
+            continue
+        lines.append(
+            f'{node["cumulative_ms"]:10.1f} ms {node["self_ms"]:9.1f} ms  '
+            + '  ' * depth
+            + node['name']
+        )
+        if depth + 1 < max_depth:
+            lines += format_tree(node['children'], max_depth, min_ms, depth + 1)
+    return lines
+
+
+@contextmanager
+def timed(phases: dict, name: str):
+    """ブロックの実行時間 (ms) を phases[name] に記録する。"""
+    t_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = (time.perf_counter() - t_start) * 1000
+
+
+def measure_engine(voice_dir: str, phases: dict, device=None) -> bool:
+    """
+    enunu.py を読み込んで、モデルの検索からエンジンの構築までの時間を測る。
+
+    enunu.py は PyTorch が見つからないと import 時に PyTorch をインストールするので、
+    診断で環境を変えないように、PyTorch がないときは何もせずに False を返す。
+    """
+    if find_spec('torch') is None:
+        return False
+    sys.path.insert(0, ENUNU_DIR)
+    with timed(phases, 'import enunu (in-process)'):
+        import enunu  # noqa: PLC0415
+    with timed(phases, 'find_model_dir'):
+        model_dir = enunu.find_model_dir(voice_dir)
+    with timed(phases, 'load config.yaml'):
+        with open(join(model_dir, 'config.yaml'), encoding='utf-8') as f:
+            enunu.yaml.safe_load(f)
+    from . import table  # noqa: PLC0415
+
+    with timed(phases, 'find_table + load_table'):
+        table.load_table(table.find_table(model_dir))
+    with timed(phases, 'ENUNU() construction'):
+        enunu.ENUNU(model_dir, device=device)
+    return True
+
+
+def get_parser():
+    parser = ArgumentParser(description='Measure what makes ENUNU slow to start')
+    parser.add_argument(
+        'voice_dir',
+        type=str,
+        nargs='?',
+        help='UTAU voice directory with an ENUNU model (skip engine timings if omitted)',
+    )
+    parser.add_argument('--json', type=str, default=None, help='Save the report as JSON')
+    parser.add_argument('--device', type=str, default=None, help='cuda or cpu')
+    parser.add_argument('--depth', type=int, default=3, help='Depth of the import tree')
+    parser.add_argument(
+        '--min_ms', type=float, default=5.0, help='Hide imports faster than this (ms)'
+    )
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest modules')
+    return parser
+
+
+def main(voice_dir=None, path_json=None, device=None, depth=3, min_ms=5.0, top=15):
+    phases = {}
+    skipped = []
+    print('Measuring imports with -X importtime ...')
+    with timed(phases, 'imports (subprocess)'):
+        imports = measure_imports()
+    with timed(phases, "find_spec('torch')"):
+        find_spec('torch')
+    if voice_dir is not None:
+        print('Measuring model discovery and engine construction ...')
+        if not measure_engine(voice_dir.strip('"'), phases, device=device):
+            skipped.append('engine')
+            print('PyTorch is not installed. Skipped the engine timings.')
+
+    print('\n# Startup phases')
+    for name, ms in sorted(phases.items(), key=lambda x: x[1], reverse=True):
+        print(f'{ms:10.1f} ms  {name}')
+
+    print('\n# Import tree (cumulative / self)')
+    for line in format_tree(imports, depth, min_ms):
+        print(line)
+
+    print(f'\n# Slowest {top} modules by self time')
+    for node in sorted(flatten(imports), key=lambda x: x['self_ms'], reverse=True)[:top]:
+        print(f'{node["self_ms"]:10.1f} ms  {node["name"]}')
+
+    if path_json is not None:
+        report = {
+            'python': sys.version,
+            'platform': platform.platform(),
+            'phases_ms': phases,
+            'skipped': skipped,
+            'imports': imports,
+        }
+        with open(path_json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f'\nSaved {path_json}')
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args(sys.argv[1:])
+    main(
+        args.voice_dir,
+        path_json=args.json,
+        device=args.device,
+        depth=args.depth,
+        min_ms=args.min_ms,
+        top=args.top,
+    )
@@ -4,6 +4,8 @@ import argparse
 import os
 import shutil
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import joblib
@@ -22,6 +24,9 @@ def get_parser():
     parser.add_argument('enunu_dir', type=str, help="ENUNU's model dir")
     parser.add_argument('out_dir', type=str, help='Output dir')
     parser.add_argument('--verbose', type=int, default=100, help='Verbose level')
+    parser.add_argument(
+        '--jobs', type=int, default=3, help='Number of files converted in parallel'
+    )
     return parser
 
 
@@ -36,6 +41,7 @@ def _scaler2numpy(input_file, out_dir, logger):
         np.save(mean_path, scaler.mean_, allow_pickle=False)
         np.save(scale_path, scaler.scale_, allow_pickle=False)
         np.save(var_path, scaler.var_, allow_pickle=False)
+        return [mean_path, scale_path, var_path]
     elif isinstance(scaler, MinMaxScaler):
         logger.info(f'Converting {input_file} min/max npy files')
         min_path = out_dir / (input_file.stem + '_min.npy')
@@ -43,12 +49,29 @@ def _scaler2numpy(input_file, out_dir, logger):
 
         np.save(min_path, scaler.min_, allow_pickle=False)
         np.save(scale_path, scaler.scale_, allow_pickle=False)
+        return [min_path, scale_path]
     else:
         raise ValueError(f'Unknown scaler type: {type(scaler)}')
 
 
+def _load_checkpoint(input_file, logger):
+    """Load a checkpoint memory-mapped if possible
+
+    With mmap=True, tensor storages stay in the file until they are accessed,
+    so optimizer and scheduler states are dropped without being read into memory.
+    Checkpoints in the legacy (non-zip) format or older torch fall back to a full load.
+    """
+    try:
+        return torch.load(
+            input_file, map_location=torch.device('cpu'), weights_only=False, mmap=True
+        )
+    except (RuntimeError, TypeError) as e:
+        logger.info(f'Loading {input_file} without mmap ({e})')
+        return torch.load(input_file, map_location=torch.device('cpu'), weights_only=False)
+
+
 def _save_checkpoint(input_file, output_file, logger):
-    checkpoint = torch.load(input_file, map_location=torch.device('cpu'), weights_only=False)
+    checkpoint = _load_checkpoint(input_file, logger)
     size = os.path.getsize(input_file)
     logger.info(f'Processisng: {input_file}')
     logger.info(f'File size (before): {size / 1024 / 1024:.3f} MB')
@@ -66,17 +89,51 @@ def _save_checkpoint(input_file, output_file, logger):
     torch.save(checkpoint, output_file)
     size = os.path.getsize(output_file)
     logger.info(f'File size (after): {size / 1024 / 1024:.3f} MB')
+    return [output_file]
+
+
+def _run_timed(func, input_file, *args):
+    """Run a conversion function and return a report entry for the input file"""
+    start = time.perf_counter()
+    outputs = func(input_file, *args)
+    return {
+        'file': str(input_file),
+        'size_before': os.path.getsize(input_file),
+        'size_after': sum(os.path.getsize(path) for path in outputs),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _log_report(reports, elapsed, logger):
+    """Log the per-file size and time report"""
+    logger.info('Conversion report:')
+    for report in reports:
+        logger.info(
+            f'  {report["file"]}: {report["size_before"] / 1024 / 1024:.3f} MB'
+            f' -> {report["size_after"] / 1024 / 1024:.3f} MB'
+            f' ({report["seconds"]:.2f} s)'
+        )
+    total_before = sum(report['size_before'] for report in reports)
+    total_after = sum(report['size_after'] for report in reports)
+    logger.info(
+        f'  Total: {total_before / 1024 / 1024:.3f} MB -> {total_after / 1024 / 1024:.3f} MB'
+        f' ({elapsed:.2f} s, sum of files: {sum(r["seconds"] for r in reports):.2f} s)'
+    )
 
 
-def main(enunu_dir, out_dir, verbose=100):
+def main(enunu_dir, out_dir, verbose=100, jobs=3):
     """Run the main function
 
     NOTE: This function is used by https://github.com/oatsu-gh/SimpleEnunu.
     So we need to be careful about the changes.
     It would be probably better to move this functionality to under the nnsvs
     directory.
+
+    The checkpoints and scalers of timelag, duration and acoustic models are converted
+    with ``jobs`` threads. Use ``jobs=1`` to convert them one after another.
     """
     logger = getLogger(verbose=verbose)
+    start = time.perf_counter()
     enunu_dir = Path(enunu_dir)
     out_dir = Path(out_dir)
     out_dir.mkdir(exist_ok=True, parents=True)
@@ -92,6 +149,7 @@ def main(enunu_dir, out_dir, verbose=100):
     # Models
     model_dir = enunu_dir / enuconfig.model_dir
     assert model_dir.exists()
+    tasks = []
     for typ in ['timelag', 'duration', 'acoustic']:
         model_config = model_dir / typ / 'model.yaml'
         assert model_config.exists()
@@ -99,11 +157,17 @@ def main(enunu_dir, out_dir, verbose=100):
         assert checkpoint.exists()
 
         shutil.copyfile(model_config, out_dir / f'{typ}_model.yaml')
-        _save_checkpoint(checkpoint, out_dir / f'{typ}_model.pth', logger)
+        tasks.append((_save_checkpoint, checkpoint, out_dir / f'{typ}_model.pth', logger))
 
         for inout in ['in', 'out']:
             scaler_path = enunu_dir / enuconfig.stats_dir / f'{inout}_{typ}_scaler.joblib'
-            _scaler2numpy(scaler_path, out_dir, logger)
+            tasks.append((_scaler2numpy, scaler_path, out_dir, logger))
+
+    # Loading and saving checkpoints is mostly I/O and (de)serialization in torch,
+    # so threads are enough to overlap the three models.
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        reports = list(executor.map(lambda task: _run_timed(*task), tasks))
+    _log_report(reports, time.perf_counter() - start, logger)
 
     # Config
     s = f"""# Global configs
@@ -140,4 +204,4 @@ please set `use_world_codec: true` in the config.yaml
 
 if __name__ == '__main__':
     args = get_parser().parse_args(sys.argv[1:])
-    main(args.enunu_dir, args.out_dir, args.verbose)
+    main(args.enunu_dir, args.out_dir, args.verbose, jobs=args.jobs)
@@ -2,16 +2,36 @@
 # Copyright (c) 2022 oatsu
 """
 ENUNUで外部ツールを呼び出すときに必要な関数とか
+
+拡張機能の Python スクリプトは、トップレベルに以下の宣言を書ける。(実行せずに ast で読み取る)
+
+- ENUNU_READS, ENUNU_WRITES: ENUNU から渡されるファイルのうち、読み取るものと書き換えるもの。
+  名前はコマンドライン引数と同じ ('ust', 'f0', 'full_timing' など)。
+  衝突しない拡張機能は同時に実行する。宣言がない場合はすべてのファイルを読み書きするものとみなす。
+- ENUNU_CACHEABLE: ENUNU から渡されるファイルだけを読み書きし、入力が同じなら結果も同じになる場合に
+  True にすると、前回と入力が同じときは実行せずに前回の出力を復元する。
+- ENUNU_OPTIONAL: 下書きモードで省略してよい場合に True にする。
 """
 
+import ast
+import shutil
 import subprocess
-from os import getcwd
-from os.path import abspath, dirname, exists, isfile, splitext
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from os import cpu_count, getcwd, replace
+from os.path import abspath, basename, dirname, exists, getmtime, isdir, isfile, join, splitext
+from tempfile import mkdtemp
 from sys import executable
-from typing import Union
+from typing import NamedTuple, Union
 
 import utaupy
 
+from . import cache, tracing
+
+# 拡張機能の実行結果のキャッシュとして残す最大件数
+EXTENSION_CACHE_MAX_ENTRIES = 512
+
 
 def merge_mono_time_change_to_full(path_mono_lab, path_full_lab):
     """モノラベルの時刻でフルラベルの時刻を上書きする。
@@ -75,18 +95,21 @@ def str_has_been_changed(s_old: str, s_new: str):
     return s_old.strip() != s_new.strip()
 
 
-def parse_extension_path(path) -> Union[str, None]:
+def parse_extension_path(path, voice_dir=None) -> Union[str, None]:
     """拡張機能のパス中のエイリアスを置換する。
 
     Following aliases are available
       - '%e' (the directory enunu.py exists in)
       - '%v' (the directory voicebank and enuconfig.yaml exists in)
       - '%u' (the directory utau.exe exists in)
+
+    voice_dir を指定しない場合はカレントディレクトリを音源フォルダとみなす。
     """
     if path is None:
         return None
     # 各種パスを取得
-    voice_dir = getcwd()
+    if voice_dir is None:
+        voice_dir = getcwd()
     enunu_dir = dirname(dirname(__file__))
     utau_dir = utaupy.utau.utau_root()
     # 置換
@@ -128,4 +151,197 @@ def run_extension(path=None, **kwargs):
         args.insert(0, abspath(executable))
 
     # 拡張機能を呼び出す。
-    subprocess.run(args, cwd=dirname(path.strip('\'"')), check=True)
+    with tracing.span('run_extension', extension=basename(path.strip('\'"'))):
+        subprocess.run(args, cwd=dirname(path.strip('\'"')), check=True)
+
+
+class ExtensionIO(NamedTuple):
+    """拡張機能が読み取るファイルと書き換えるファイルの種類 (run_extension の引数名)。"""
+
+    reads: frozenset
+    writes: frozenset
+
+
+@lru_cache(maxsize=None)
+def _read_extension_declarations(path: str, mtime: float) -> dict:
+    """拡張機能のスクリプトのトップレベルにある ENUNU_ で始まる定数を読み取る。
+
+    拡張機能は別プロセスで実行するので、importせずに構文解析だけする。
+    mtime はスクリプトが更新されたときにキャッシュを使わないようにするための引数。
+    """
+    del mtime
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    declarations = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1:
+            continue
+        target = node.targets[0]
+        if not isinstance(target, ast.Name) or not target.id.startswith('ENUNU_'):
+            continue
+        try:
+            declarations[target.id] = ast.literal_eval(node.value)
+        except ValueError:
+            continue
+    return declarations
+
+
+def read_extension_declarations(path) -> dict:
+    """拡張機能のスクリプトで宣言されている ENUNU_ で始まる定数を辞書で返す。
+
+    Pythonスクリプトでない場合や、ファイルが見つからない場合は空の辞書を返す。
+    """
+    path = parse_extension_path(path).strip('\'"')
+    if splitext(path)[1] != '.py' or not isfile(path):
+        return {}
+    return _read_extension_declarations(abspath(path), getmtime(path))
+
+
+def is_optional_extension(path) -> bool:
+    """拡張機能が下書きモードで省略できるかどうかを返す。
+
+    拡張機能のスクリプトに ENUNU_OPTIONAL = True と宣言しておくと省略できるものとみなす。
+    """
+    return bool(read_extension_declarations(path).get('ENUNU_OPTIONAL', False))
+
+
+def get_extension_io(
+    path, artifacts: Iterable[str], linked_artifacts: Iterable[Iterable[str]] = ()
+) -> ExtensionIO:
+    """拡張機能が読み書きするファイルの種類を取得する。
+
+    拡張機能のスクリプトに以下のように宣言しておくと、その宣言を使う。
+        ENUNU_READS = ['mono_timing']
+        ENUNU_WRITES = ['mono_timing']
+    宣言がない場合は、渡されるすべてのファイルを読み書きするものとみなす。
+    linked_artifacts に含まれるファイルのどれかを書き換える場合は、
+    同じグループのファイルもすべて書き換えるものとみなす。(例: モノラベルとフルラベルの同期)
+    """
+    artifacts = frozenset(artifacts)
+    declarations = read_extension_declarations(path)
+    reads = declarations.get('ENUNU_READS')
+    writes = declarations.get('ENUNU_WRITES')
+    reads = artifacts if reads is None else frozenset(reads) & artifacts
+    writes = artifacts if writes is None else frozenset(writes) & artifacts
+    for group in linked_artifacts:
+        if writes & frozenset(group):
+            writes = writes | (frozenset(group) & artifacts)
+    return ExtensionIO(reads, writes)
+
+
+def build_dependency_graph(io_list: list[ExtensionIO]) -> list[set[int]]:
+    """各拡張機能が、それより前に実行する必要がある拡張機能の番号の集合を返す。
+
+    読み書きするファイルが衝突する場合は、指定された順番どおりに実行する。
+    """
+    dependencies = []
+    for i, io_i in enumerate(io_list):
+        dependencies.append(
+            {
+                j
+                for j, io_j in enumerate(io_list[:i])
+                if io_j.writes & (io_i.reads | io_i.writes) or io_j.reads & io_i.writes
+            }
+        )
+    return dependencies
+
+
+def run_extensions(
+    path_list: list[str],
+    runner: Callable[[str, ExtensionIO], None],
+    artifacts: Iterable[str],
+    linked_artifacts: Iterable[Iterable[str]] = (),
+    max_workers: int | None = None,
+):
+    """複数の拡張機能を、依存関係を守りながら並列に実行する。
+
+    読み書きするファイルが衝突しない拡張機能どうしは同時に実行し、
+    衝突する拡張機能どうしは path_list の順番で実行する。
+
+    Args:
+        path_list (list[str]): 拡張機能のパスのリスト
+        runner (Callable): runner(path, extension_io) で拡張機能を1つ実行する関数
+        artifacts (Iterable[str]): 拡張機能に渡すファイルの種類 (run_extension の引数名)
+        linked_artifacts (Iterable[Iterable[str]]): 一緒に書き換わるファイルの種類のグループ
+        max_workers (int): 同時に実行する拡張機能の最大数。None のときはCPUのコア数。
+    """
+    artifacts = list(artifacts)
+    linked_artifacts = [list(group) for group in linked_artifacts]
+    io_list = [get_extension_io(path, artifacts, linked_artifacts) for path in path_list]
+    dependencies = build_dependency_graph(io_list)
+    if max_workers is None:
+        max_workers = cpu_count() or 1
+
+    pending = list(range(len(path_list)))
+    finished: set[int] = set()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        running = {}
+        while pending or running:
+            # 依存している拡張機能がすべて終わったものを実行する
+            for idx in [idx for idx in pending if dependencies[idx] <= finished]:
+                pending.remove(idx)
+                future = executor.submit(runner, path_list[idx], io_list[idx])
+                running[future] = idx
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = running.pop(future)
+                # 失敗した場合は新しい拡張機能を実行せずに例外を送出する
+                future.result()
+                finished.add(idx)
+
+
+def get_extension_cache_key(path, extension_io: ExtensionIO, **kwargs) -> str | None:
+    """拡張機能の実行結果のキャッシュのキーを計算する。
+
+    拡張機能のファイルの内容と、渡すファイルの種類と、読み書きするファイルの内容から決める。
+    キャッシュは拡張機能が ENUNU_CACHEABLE = True を宣言している場合だけ使い、
+    それ以外 (宣言がない場合や、Pythonスクリプトでない場合) は None を返す。
+    """
+    declarations = read_extension_declarations(path)
+    if declarations.get('ENUNU_CACHEABLE') is not True:
+        return None
+    path = parse_extension_path(path).strip('\'"')
+    values = [cache.hash_file(path), ','.join(key for key, v in kwargs.items() if v is not None)]
+    for name in sorted(extension_io.reads | extension_io.writes):
+        path_artifact = kwargs[name]
+        values.append(name)
+        values.append(cache.hash_file(path_artifact) if isfile(path_artifact) else '-')
+    return cache.hash_strings(*values)
+
+
+def run_extension_cached(path, extension_io: ExtensionIO, **kwargs):
+    """拡張機能を呼び出す。同じ入力で実行したことがある場合は、前回の出力ファイルを復元する。
+
+    出力ファイルは extension_io.writes に含まれるファイル。
+    ENUNU_CACHEABLE = True を宣言していない拡張機能 (実行するたびに結果が変わるものや、
+    ENUNUから渡されるファイル以外を読み書きするもの、exe などの宣言できないもの) は毎回実行する。
+    """
+    key = get_extension_cache_key(path, extension_io, **kwargs)
+    if key is None:
+        run_extension(path, **kwargs)
+        return
+    cache_dir = cache.get_cache_dir('extensions')
+    entry_dir = join(cache_dir, key)
+
+    # キャッシュがあれば出力ファイルを復元する
+    if isdir(entry_dir):
+        with tracing.span('restore_extension_cache', extension=basename(path.strip('\'"'))):
+            for name in extension_io.writes:
+                if isfile(join(entry_dir, name)):
+                    shutil.copyfile(join(entry_dir, name), kwargs[name])
+        print(f'Restored cached result of {basename(path)}')
+        return
+
+    run_extension(path, **kwargs)
+
+    # 一時フォルダに出力ファイルを保存してから、名前を変えてキャッシュとして登録する
+    temp_dir = mkdtemp(prefix='.temp-', dir=cache_dir)
+    try:
+        for name in extension_io.writes:
+            if isfile(kwargs[name]):
+                shutil.copyfile(kwargs[name], join(temp_dir, name))
+        replace(temp_dir, entry_dir)
+    except OSError:
+        # 並列実行などで同じキャッシュがすでに登録されている場合
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    cache.prune(cache_dir, EXTENSION_CACHE_MAX_ENTRIES)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+合成に使った音響特徴量をセグメントごとにHDF5ファイルに保存する。
+
+保存したファイルを enulib.revocode で読み込むと、タイミングモデルや音響モデルを使わずに
+ボコーダだけでもう一度合成できる。
+
+ファイルの構造:
+    / (attrs: sample_rate, frame_period, feature_type, post_filter_type, model_dir, ...)
+    /segments/00000/ (attrs: frame_offset, n_frames)
+        mgc, lf0, vuv, bap    : ボコーダに渡した特徴量 (拡張機能で編集したあとのもの)
+        variants/<post_filter>/mgc, bap
+                              : ほかのポストフィルタを使った場合のスペクトル特徴量
+                                (f0 と vuv は上のものを共通で使う)
+"""
+
+import h5py
+import numpy as np
+
+# 特徴量の種類ごとのストリームの名前
+STREAM_NAMES = {
+    'world': ('mgc', 'lf0', 'vuv', 'bap'),
+    'melf0': ('mel', 'lf0', 'vuv'),
+}
+# ポストフィルタで変わらないストリーム
+PITCH_STREAMS = ('lf0', 'vuv')
+
+
+def get_stream_names(feature_type: str, n_streams: int) -> tuple[str, ...]:
+    """ストリームの名前を返す。知らない特徴量の種類の場合は stream_0, stream_1, ... にする。"""
+    names = STREAM_NAMES.get(feature_type)
+    if names is None or len(names) != n_streams:
+        names = tuple(f'stream_{idx}' for idx in range(n_streams))
+    return names
+
+
+class FeatureStoreWriter:
+    """合成中のセグメントの音響特徴量を順番にHDF5ファイルに書き込むクラス。
+
+    Args:
+        path (str): 出力するHDF5ファイルのパス
+        feature_type (str): 特徴量の種類 ('world' or 'melf0')
+        attrs: ファイルに記録する属性 (sample_rate, frame_period など)
+    """
+
+    def __init__(self, path: str, feature_type: str, **attrs):
+        self.f = h5py.File(path, 'w')
+        self.feature_type = feature_type
+        self.f.attrs['feature_type'] = feature_type
+        for key, value in attrs.items():
+            self.f.attrs[key] = '' if value is None else value
+        self.segments = self.f.create_group('segments')
+        self.frame_offset = 0
+
+    def add_segment(self, multistream_features, variants: dict | None = None):
+        """セグメントの特徴量を追加する。
+
+        Args:
+            multistream_features (tuple): ボコーダに渡した特徴量
+            variants (dict): ポストフィルタの種類 → そのポストフィルタを使った特徴量
+        """
+        names = get_stream_names(self.feature_type, len(multistream_features))
+        group = self.segments.create_group(f'{len(self.segments):05d}')
+        n_frames = len(multistream_features[0])
+        group.attrs['frame_offset'] = self.frame_offset
+        group.attrs['n_frames'] = n_frames
+        for name, stream in zip(names, multistream_features):
+            group.create_dataset(name, data=np.asarray(stream), chunks=True)
+        for post_filter_type, features in (variants or {}).items():
+            variant = group.create_group(f'variants/{post_filter_type}')
+            for name, stream in zip(names, features):
+                if name not in PITCH_STREAMS:
+                    variant.create_dataset(name, data=np.asarray(stream), chunks=True)
+        self.frame_offset += n_frames
+        self.f.flush()
+
+    def close(self):
+        """ファイルを閉じる。"""
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_feature_store(path: str, post_filter_type: str | None = None):
+    """HDF5ファイルから、ファイルの属性とセグメントごとの特徴量を読み取る。
+
+    Args:
+        path (str): HDF5ファイルのパス
+        post_filter_type (str): 使うポストフィルタ。None の場合や、合成時と同じ場合は
+            ボコーダに渡した特徴量をそのまま返す。
+
+    Returns:
+        attrs (dict): ファイルの属性
+        segments (list[tuple]): セグメントごとの特徴量
+    """
+    with h5py.File(path, 'r') as f:
+        attrs = dict(f.attrs)
+        if post_filter_type == attrs.get('post_filter_type'):
+            post_filter_type = None
+        segments = []
+        for key in sorted(f['segments']):
+            group = f['segments'][key]
+            names = get_stream_names(attrs['feature_type'], len(group) - ('variants' in group))
+            variant = None
+            if post_filter_type is not None:
+                if f'variants/{post_filter_type}' not in group:
+                    raise KeyError(
+                        f'Post-filter {post_filter_type} is not stored for segment {key}.'
+                    )
+                variant = group[f'variants/{post_filter_type}']
+            features = []
+            for name in names:
+                if variant is not None and name in variant:
+                    features.append(variant[name][()])
+                else:
+                    features.append(group[name][()])
+            segments.append(tuple(features))
+    return attrs, segments
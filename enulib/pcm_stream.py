@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+合成した波形をファイルに保存せずに、生のPCMとして標準出力や名前付きパイプに書き出す。
+
+出力の先頭には以下の16バイトのヘッダーを付け、そのあとにPCMを続ける。
+(すべてリトルエンディアン)
+
+    magic (4 bytes)        : b'ENPC'
+    version (uint16)       : 1
+    format tag (uint16)    : 1 = 整数PCM, 3 = 浮動小数点 (WAVのフォーマットタグと同じ)
+    sample rate (uint32)   : サンプリング周波数
+    channels (uint16)      : チャンネル数 (ENUNUは常に1)
+    bits per sample (uint16): 16 (int16) または 32 (float32)
+
+合成が終わったセグメントから順に書き出すので、受け取る側は合成の完了を待たずに処理を始められる。
+"""
+
+import logging
+import os
+import struct
+import sys
+
+import numpy as np
+
+PCM_MAGIC = b'ENPC'
+PCM_HEADER_VERSION = 1
+PCM_HEADER = struct.Struct('<4sHHIHH')
+# 出力形式 → (フォーマットタグ, ビット数, numpy の dtype)
+PCM_FORMATS = {
+    'float32': (3, 32, '<f4'),
+    'int16': (1, 16, '<i2'),
+}
+
+
+# take_stdout() で取り上げたもとの標準出力
+_stdout_pcm = None
+
+
+def stdout_requested(argv: list[str]) -> bool:
+    """コマンドライン引数で --pcm_out - (標準出力へのPCM出力) が指定されているかどうか。"""
+    for i, arg in enumerate(argv):
+        if arg == '--pcm_out=-' or (arg == '--pcm_out' and argv[i + 1 : i + 2] == ['-']):
+            return True
+    return False
+
+
+def take_stdout():
+    """標準出力をPCM出力専用にして、そのファイルオブジェクトを返す。
+
+    ログや print、拡張機能のサブプロセスの出力がPCMに混ざらないように、
+    もとの標準出力 (fd 1) を複製してから、fd 1、sys.stdout、標準出力に書いている
+    logging のハンドラーを標準エラー出力に向け直す。
+    何かが書き出される前に呼ぶ必要があるので、ヘッダーより先に呼んでおく。2回目以降は同じものを返す。
+    """
+    global _stdout_pcm  # noqa: PLW0603
+    if _stdout_pcm is not None:
+        return _stdout_pcm
+    old_stdout = sys.stdout
+    old_stdout.flush()
+    fd = os.dup(old_stdout.fileno())
+    os.dup2(sys.stderr.fileno(), old_stdout.fileno())
+    if sys.platform == 'win32':
+        import msvcrt  # pylint: disable=import-outside-toplevel
+
+        msvcrt.setmode(fd, os.O_BINARY)
+    sys.stdout = sys.stderr
+    loggers = [logging.getLogger()] + [
+        x for x in logging.Logger.manager.loggerDict.values() if isinstance(x, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in logger.handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is old_stdout:
+                handler.setStream(sys.stderr)
+    _stdout_pcm = os.fdopen(fd, 'wb', buffering=0)
+    return _stdout_pcm
+
+
+class PcmStreamWriter:
+    """ヘッダー付きの生PCMを書き出すクラス。
+
+    Args:
+        path (str): 出力先のパス。'-' のときは標準出力。名前付きパイプも指定できる。
+            標準出力のときは、先に take_stdout() を呼んでおくとそれまでの出力も混ざらない。
+        sample_rate (int): サンプリング周波数
+        pcm_format (str): 'float32' or 'int16'
+    """
+
+    def __init__(self, path: str, sample_rate: int, pcm_format: str = 'float32'):
+        if pcm_format not in PCM_FORMATS:
+            raise ValueError(f'Unknown PCM format: {pcm_format}')
+        self.format_tag, self.bits, self.dtype = PCM_FORMATS[pcm_format]
+        self.sample_rate = sample_rate
+        self.n_samples = 0
+        if path == '-':
+            self.f = take_stdout()
+        else:
+            self.f = open(path, 'wb', buffering=0)  # noqa: SIM115
+        self.f.write(
+            PCM_HEADER.pack(
+                PCM_MAGIC,
+                PCM_HEADER_VERSION,
+                self.format_tag,
+                sample_rate,
+                1,
+                self.bits,
+            )
+        )
+
+    def write(self, wav: np.ndarray):
+        """-1 ~ 1 の範囲の波形を書き出す。"""
+        if self.format_tag == 1:
+            wav = np.clip(np.rint(wav * 32767), -32768, 32767)
+        self.f.write(np.ascontiguousarray(wav, dtype=self.dtype).tobytes())
+        self.n_samples += len(wav)
+
+    def close(self):
+        """出力先を閉じる。"""
+        if not self.f.closed:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+セグメントごとの処理を、段 (stage) ごとのスレッドで流れ作業にする。
+
+たとえば音響モデル → 音響特徴量の編集 → ボコーダ の3段にすると、
+セグメント N をボコーダで合成している間にセグメント N+1 の音響特徴量を推定できる。
+
+- 段の間は大きさの決まったキューでつなぐので、前の段が先に進みすぎてメモリを使いすぎることはない。
+- 各段は1つのスレッドで入力を順番に処理するので、出力の順番は入力と同じになる。
+- どこかの段で例外が発生したら、すべての段を止めてその例外を呼び出し元で送出する。
+
+使用例:
+    wavs = run_pipeline(range(n_segments), [predict, edit, vocode], queue_size=2)
+"""
+
+import queue
+import threading
+
+# 入力が終わったことを次の段に知らせるための値
+_END = object()
+# 止めるかどうかを確認する間隔 (秒)
+_POLL_INTERVAL = 0.1
+
+
+def run_pipeline(items, stages: list, queue_size: int = 2, threaded: bool = True) -> list:
+    """items の各要素を stages の関数に順番に通して、最後の段の戻り値のリストを返す。
+
+    Args:
+        items (Iterable): 最初の段に渡す入力
+        stages (list[callable]): 各段の関数。前の段の戻り値を受け取る。
+        queue_size (int): 段の間のキューに溜めておける数
+        threaded (bool): False のときは、スレッドを使わずに1つずつ順番に全段を通す。
+
+    最後の段は呼び出し元のスレッドで実行し、それ以外の段はそれぞれ別のスレッドで実行する。
+    """
+    if not threaded or len(stages) <= 1:
+        results = []
+        for item in items:
+            for stage in stages:
+                item = stage(item)
+            results.append(item)
+        return results
+
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages[:-1]]
+
+    def put(q: queue.Queue, item) -> bool:
+        """キューに入れる。止められた場合は False を返す。"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def get(q: queue.Queue):
+        """キューから取り出す。止められた場合は _END を返す。"""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+
+    def run_stage(idx: int, stage):
+        source = items if idx == 0 else iter(lambda: get(queues[idx - 1]), _END)
+        try:
+            for item in source:
+                if stop.is_set() or not put(queues[idx], stage(item)):
+                    return
+            put(queues[idx], _END)
+        except BaseException as e:  # noqa: BLE001
+            errors.append(e)
+            stop.set()
+
+    threads = [
+        threading.Thread(
+            target=run_stage, args=(idx, stage), name=f'enunu-stage-{idx}', daemon=True
+        )
+        for idx, stage in enumerate(stages[:-1])
+    ]
+    for thread in threads:
+        thread.start()
+    results = []
+    try:
+        for item in iter(lambda: get(queues[-1]), _END):
+            results.append(stages[-1](item))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return results
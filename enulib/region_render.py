@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+前回の合成結果をキャッシュしておき、楽譜が変わった部分だけを合成し直して差し替える。
+
+1. 前回のフルラベルと今回のフルラベルを先頭と末尾から比べて、変更された音素の範囲を求める。
+2. タイミングモデルと音響モデルが前後の文脈を見られるように、
+   変更範囲を前後の休符 (pau, sil) まで広げる。
+3. その範囲だけを ENUNU.svs() で合成する。
+4. 前後の休符の中央で、前回の波形と線形にクロスフェードしてつなぐ。
+   つなぎ目の位置は楽譜の時刻ではなく、タイミングモデルで補正した時刻で決める。
+
+変更範囲より後ろのノートの時刻がずれた場合は、前回の波形をそのぶんずらしてつなぐ。
+合成する範囲が曲の大部分になる場合は、曲全体を合成し直す。
+
+フルラベルに表れない入力 (モデル、拡張機能、ラベルに変換されないUSTの項目) は
+キャッシュのキーに含めるので、それらが変わった場合は曲全体を合成し直す。
+UST、タイミング、音響特徴量を編集する拡張機能は曲全体のファイルを前提にしているので、
+それらを使う場合は部分的な合成を使わないこと。 (get_region_blocking_extensions)
+"""
+
+import json
+import logging
+import re
+from os import replace
+from os.path import exists, isfile, join
+
+import numpy as np
+
+from . import cache, extensions
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの形式を変えたときに古いキャッシュを使わないようにするための番号
+REGION_CACHE_VERSION = 2
+REGION_CACHE_MAX_ENTRIES = 16
+# 区切りに使う休符の音素
+REST_PHONEMES = ('pau', 'sil')
+# 休符の中でクロスフェードする長さの最大値 (秒)
+CROSSFADE_SEC = 0.05
+# 合成し直す音素がこの割合を超えたら曲全体を合成する
+MAX_REGION_RATIO = 0.5
+# 曲の一部だけを渡すと結果が変わってしまう拡張機能の種類
+REGION_BLOCKING_EXTENSIONS = ('ust_editor', 'timing_editor', 'acoustic_editor')
+# フルラベルに変換されるUSTのノートの項目
+SCORE_NOTE_KEYS = ('Tag', 'Lyric', 'Length', 'NoteNum', 'Tempo', 'Flags', '$TimeSignatures')
+
+
+def get_phoneme(context: str) -> str:
+    """フルコンテキストラベルから音素名を取り出す。"""
+    match = re.search(r'-(.+?)\+', context)
+    return match.group(1) if match else context
+
+
+def labels_to_list(labels) -> list[tuple[int, int, str]]:
+    """HTSLabelFile を (開始時刻, 終了時刻, コンテキスト) のリストにする。"""
+    return [
+        (int(start), int(end), context)
+        for start, end, context in zip(labels.start_times, labels.end_times, labels.contexts)
+    ]
+
+
+def timings_to_list(labels) -> list[tuple[int, int, str]]:
+    """タイミング補正後のラベルを、(開始時刻, 終了時刻, コンテキスト) のリストにする。
+
+    時刻は波形の先頭を0とする。
+    """
+    phonemes = labels_to_list(labels)
+    offset = phonemes[0][0] if phonemes else 0
+    return [(start - offset, end - offset, context) for start, end, context in phonemes]
+
+
+def get_ust_state(plugin) -> str:
+    """フルラベルに変換されないUSTの項目 (ビブラートやベロシティなど) を表す文字列を返す。
+
+    ノートの順番も含めるので、ノートを追加したり削除したりした場合も変わる。
+    """
+    return cache.hash_strings(
+        repr(sorted(plugin.setting.items())),
+        *(
+            repr(sorted((k, v) for k, v in note.items() if k not in SCORE_NOTE_KEYS))
+            for note in plugin.notes
+        ),
+    )
+
+
+def get_extension_state(path_list: list[str]) -> str:
+    """拡張機能のパスとファイルの内容を表す文字列を返す。"""
+    values = []
+    for path in path_list:
+        path_extension = extensions.parse_extension_path(path).strip('\'"')
+        values.append(path_extension)
+        values.append(cache.hash_file(path_extension) if isfile(path_extension) else '-')
+    return cache.hash_strings(*values)
+
+
+def get_region_blocking_extensions(engine) -> list[str]:
+    """部分的な合成と一緒に使えない拡張機能のパスのリストを返す。"""
+    return [
+        path for key in REGION_BLOCKING_EXTENSIONS for path in engine.get_extension_path_list(key)
+    ]
+
+
+def get_cache_key(*values: str) -> str:
+    """曲とモデルと拡張機能とUSTの状態と合成設定からキャッシュのキーを作る。"""
+    return cache.hash_strings(str(REGION_CACHE_VERSION), *values)
+
+
+def load_cached_render(key: str):
+    """前回の合成結果 (音素のリスト, タイミング補正後の音素のリスト, 波形, サンプリング周波数)
+    を読み取る。なければ None。
+    """
+    cache_dir = cache.get_cache_dir('regions')
+    path_meta = join(cache_dir, f'{key}.json')
+    path_wav = join(cache_dir, f'{key}.npy')
+    if not (exists(path_meta) and exists(path_wav)):
+        return None
+    try:
+        with open(path_meta, encoding='utf-8') as f:
+            meta = json.load(f)
+        wav = np.load(path_wav)
+    except (OSError, ValueError):
+        logger.warning('Failed to load cached render: %s', key)
+        return None
+    phonemes = [tuple(phoneme) for phoneme in meta['labels']]
+    timings = [tuple(phoneme) for phoneme in meta['timings']]
+    return phonemes, timings, wav, meta['sample_rate']
+
+
+def save_cached_render(
+    key: str, phonemes: list, timings: list, wav: np.ndarray, sample_rate: int
+):
+    """合成結果をキャッシュに保存する。
+
+    timings は波形の先頭を0とした、タイミング補正後の音素のリスト。
+    """
+    cache_dir = cache.get_cache_dir('regions')
+    # 読み込み途中のファイルを上書きしないように、一時ファイルに書いてから置き換える
+    with open(join(cache_dir, f'{key}.npy.tmp'), 'wb') as f:
+        np.save(f, np.asarray(wav, dtype=np.float32))
+    with open(join(cache_dir, f'{key}.json.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(
+            {'sample_rate': sample_rate, 'labels': phonemes, 'timings': timings},
+            f,
+            ensure_ascii=False,
+        )
+    replace(join(cache_dir, f'{key}.npy.tmp'), join(cache_dir, f'{key}.npy'))
+    replace(join(cache_dir, f'{key}.json.tmp'), join(cache_dir, f'{key}.json'))
+    cache.prune(cache_dir, REGION_CACHE_MAX_ENTRIES * 2)
+
+
+def find_changed_range(old: list, new: list) -> tuple[int, int] | None:
+    """コンテキストが変わった音素の範囲を返す。
+
+    Returns:
+        (first, n_suffix): 新しいラベルの first 番目から末尾の n_suffix 個の手前までが
+            変更範囲。変更がなければ None。
+    """
+    n_prefix = 0
+    for old_phoneme, new_phoneme in zip(old, new):
+        # 前半は時刻も一致していなければならない
+        if old_phoneme != new_phoneme:
+            break
+        n_prefix += 1
+    if n_prefix == len(old) == len(new):
+        return None
+    n_suffix = 0
+    max_suffix = min(len(old), len(new)) - n_prefix
+    while (
+        n_suffix < max_suffix
+        and old[len(old) - 1 - n_suffix][2] == new[len(new) - 1 - n_suffix][2]
+        # 後半は時刻がずれていてもよいが、音素の長さは一致していなければならない
+        and old[len(old) - 1 - n_suffix][1] - old[len(old) - 1 - n_suffix][0]
+        == new[len(new) - 1 - n_suffix][1] - new[len(new) - 1 - n_suffix][0]
+    ):
+        n_suffix += 1
+    return n_prefix, n_suffix
+
+
+def expand_to_rests(phonemes: list, first: int, last: int) -> tuple[int, int]:
+    """変更範囲 first ~ last (last を含む) を、前後の休符まで広げる。
+
+    変更範囲の外側にある休符を選ぶので、前後の休符そのものは変更されていない。
+    休符が見つからない場合は曲の先頭か末尾までにする。
+    """
+    start = first - 1
+    while start > 0 and get_phoneme(phonemes[start][2]) not in REST_PHONEMES:
+        start -= 1
+    end = last + 1
+    while end < len(phonemes) - 1 and get_phoneme(phonemes[end][2]) not in REST_PHONEMES:
+        end += 1
+    return max(start, 0), min(end, len(phonemes) - 1)
+
+
+def _to_samples(time_100ns: int, sample_rate: int) -> int:
+    """HTSラベルの時刻 (100ns単位) をサンプル数にする。"""
+    return int(round(time_100ns * 1e-7 * sample_rate))
+
+
+def _splice_point(phonemes: list, idx: int, sample_rate: int, is_start: bool) -> tuple[int, int]:
+    """つなぎ目の位置とクロスフェードの半分の長さ (サンプル数) を返す。
+
+    休符のときは休符の中央でつなぐ。休符でないとき (曲の先頭か末尾) はその端でつなぐ。
+    """
+    start, end, context = phonemes[idx]
+    if get_phoneme(context) not in REST_PHONEMES:
+        return _to_samples(start if is_start else end, sample_rate), 0
+    half = min(
+        _to_samples((end - start) // 2, sample_rate), int(CROSSFADE_SEC * sample_rate / 2)
+    )
+    return _to_samples((start + end) // 2, sample_rate), half
+
+
+def splice(
+    old_wav: np.ndarray,
+    region_wav: np.ndarray,
+    region_offset: int,
+    start: tuple[int, int],
+    end_new: tuple[int, int],
+    end_old: int,
+) -> np.ndarray:
+    """前回の波形の一部を、合成し直した波形で差し替える。
+
+    Args:
+        old_wav (np.ndarray): 前回の波形
+        region_wav (np.ndarray): 合成し直した範囲の波形
+        region_offset (int): region_wav の先頭の、新しい波形での位置
+        start (tuple[int, int]): 差し替えを始める位置と、クロスフェードの半分の長さ
+        end_new (tuple[int, int]): 差し替えを終える新しい波形での位置と、
+            クロスフェードの半分の長さ
+        end_old (int): 差し替えを終える位置に対応する、前回の波形での位置
+    """
+    p0, half0 = start
+    p1, half1 = end_new
+    n_total = p1 + max(len(old_wav) - end_old, 0)
+    # 合成し直した範囲の波形を新しい波形の位置に合わせる (足りない部分は無音にする)
+    region = np.zeros(n_total, dtype=np.float32)
+    n_region = min(len(region_wav), n_total - region_offset)
+    region[region_offset : region_offset + n_region] = region_wav[:n_region]
+    # 前回の波形を新しい波形の位置に合わせる
+    old = np.zeros(n_total, dtype=np.float32)
+    old[: min(p0 + half0, len(old_wav))] = old_wav[: min(p0 + half0, len(old_wav))]
+    tail = old_wav[max(end_old - half1, 0) :]
+    old[p1 - half1 : p1 - half1 + len(tail)] = tail[: n_total - (p1 - half1)]
+
+    # 差し替える範囲の重み (前回の波形の重みは 1 - weight)
+    t = np.arange(n_total)
+    weight = np.ones(n_total)
+    if half0 > 0:
+        weight = np.minimum(weight, np.clip((t - p0 + half0 + 0.5) / (2 * half0), 0, 1))
+    else:
+        weight = np.minimum(weight, (t >= p0).astype(np.float64))
+    if half1 > 0:
+        weight = np.minimum(weight, np.clip((p1 + half1 - t - 0.5) / (2 * half1), 0, 1))
+    else:
+        weight = np.minimum(weight, (t < p1).astype(np.float64))
+    return (region * weight + old * (1 - weight)).astype(np.float32)
+
+
+def _to_time(n_samples: int, sample_rate: int) -> int:
+    """サンプル数をHTSラベルの時刻 (100ns単位) にする。"""
+    return int(round(n_samples / sample_rate * 1e7))
+
+
+def _shift(phonemes: list, offset: int) -> list:
+    """音素のリストの時刻を offset (100ns単位) だけずらす。"""
+    return [(start + offset, end + offset, context) for start, end, context in phonemes]
+
+
+def _render_region(engine, labels, new, cached, changed, start_idx, end_idx, svs_kwargs):
+    """new の start_idx ~ end_idx の音素だけを合成し直して、前回の波形につなぐ。
+
+    Returns:
+        (wav, sample_rate, timings): 曲全体の波形と、タイミング補正後の音素のリスト。
+            合成した範囲の音素数がタイミング補正の前後で変わった場合は None。
+    """
+    old, old_timings, old_wav, _ = cached
+    n_prefix, n_suffix = changed
+    # 合成する範囲だけを取り出して、先頭の時刻を0にする
+    offset = new[start_idx][0]
+    sliced = engine.slice_labels(labels, start_idx, end_idx + 1)
+    sliced.start_times = [t - offset for t in sliced.start_times]
+    sliced.end_times = [t - offset for t in sliced.end_times]
+    region_wav, sample_rate = engine.svs(sliced, **svs_kwargs)
+    region_timings = timings_to_list(engine.last_timing_labels)
+    if len(region_timings) != end_idx - start_idx + 1:
+        return None
+
+    # 始まりの休符が変更されていない部分にあれば、前回と今回の同じ休符の中央どうしを合わせる。
+    # 曲の先頭から合成し直した場合は、前回の波形を使わない。
+    if start_idx < n_prefix:
+        p0, half_old = _splice_point(old_timings, start_idx, sample_rate, is_start=True)
+        r0, half_region = _splice_point(region_timings, 0, sample_rate, is_start=True)
+        half0 = min(half_old, half_region)
+        region_offset = p0 - r0
+        if region_offset < 0:
+            # 合成し直した休符のほうが長い場合は、はみ出す先頭を切り捨てる
+            region_wav = region_wav[-region_offset:]
+            region_timings = _shift(region_timings, -_to_time(-region_offset, sample_rate))
+            region_offset = 0
+    else:
+        p0, half0, region_offset = 0, 0, 0
+
+    # 終わりの休符が変更されていない部分にあれば、前回と今回の同じ休符の中央でつなぐ。
+    # 曲の末尾まで合成し直した場合は、前回の波形の末尾につなぐ。
+    if end_idx >= len(new) - n_suffix:
+        end_idx_old = end_idx - (len(new) - len(old))
+        end_old, half_old = _splice_point(old_timings, end_idx_old, sample_rate, is_start=False)
+        r1, half_region = _splice_point(
+            region_timings, len(region_timings) - 1, sample_rate, is_start=False
+        )
+        p1, half1 = region_offset + r1, min(half_old, half_region)
+        suffix = _shift(old_timings[end_idx_old + 1 :], _to_time(p1 - end_old, sample_rate))
+    else:
+        p1, half1, end_old = region_offset + len(region_wav), 0, len(old_wav)
+        suffix = []
+
+    wav = splice(old_wav, region_wav, region_offset, (p0, half0), (p1, half1), end_old)
+    timings = (
+        old_timings[:start_idx]
+        + _shift(region_timings, _to_time(region_offset, sample_rate))
+        + suffix
+    )
+    return wav, sample_rate, timings
+
+
+def render(engine, labels, key: str, **svs_kwargs) -> tuple[np.ndarray, int]:
+    """前回の合成結果から変わった部分だけを合成し直して、曲全体の波形を返す。
+
+    Args:
+        engine (ENUNU): 合成に使うエンジン。svs() のあとに last_timing_labels に
+            タイミング補正後のラベルが入っていること。
+        labels (nnmnkwii.io.hts.HTSLabelFile): 曲全体のフルラベル
+        key (str): 前回の合成結果を探すためのキー (get_cache_key で作る)
+        svs_kwargs: ENUNU.svs() に渡す引数
+    """
+    new = labels_to_list(labels)
+    cached = load_cached_render(key)
+    if cached is not None:
+        old, _, old_wav, sample_rate = cached
+        changed = find_changed_range(old, new)
+        if changed is None:
+            logger.info('Score is not changed. Using the cached waveform.')
+            return old_wav, sample_rate
+        n_prefix, n_suffix = changed
+        first = min(n_prefix, len(new) - 1)
+        last = max(len(new) - 1 - n_suffix, first)
+        start_idx, end_idx = expand_to_rests(new, first, last)
+        if (end_idx - start_idx + 1) / len(new) <= MAX_REGION_RATIO:
+            logger.info(
+                'Rendering phonemes %s-%s of %s (changed: %s-%s)',
+                start_idx,
+                end_idx,
+                len(new),
+                first,
+                last,
+            )
+            result = _render_region(
+                engine, labels, new, cached, changed, start_idx, end_idx, svs_kwargs
+            )
+            if result is not None:
+                wav, sample_rate, timings = result
+                save_cached_render(key, new, timings, wav, sample_rate)
+                return wav, sample_rate
+            logger.info('Timing labels do not match the score. Rendering the whole song.')
+        else:
+            logger.info('Too many phonemes are changed. Rendering the whole song.')
+
+    wav, sample_rate = engine.svs(labels, **svs_kwargs)
+    save_cached_render(key, new, timings_to_list(engine.last_timing_labels), wav, sample_rate)
+    return wav, sample_rate
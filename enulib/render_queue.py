@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+ENUNU.svs() をキューに入れて順番に実行する。
+
+- 優先度の小さいジョブから実行する。(試聴用のプレビューを書き出しより先にする)
+- 同じラベルと設定のジョブが実行待ちか実行中の場合は、1回の計算の結果を共有する。
+- ジョブはキャンセルできる。実行中の合成は、セグメントごとの各段 (音響モデル、
+  音響特徴量の編集、ボコーダ) の前にキャンセルを確認して止まる。
+  ENUNU.svs() の batch_size が 2 以上の場合、まとめて推論している音響モデルは途中で止まらない。
+- group を指定すると、同じ group の古いジョブは新しいジョブで置き換えられてキャンセルされる。
+  置き換えられた計算をほかの group のジョブも待っている場合は、計算は止めずに
+  古い group のジョブだけを切り離す。
+
+使用例:
+    queue = RenderQueue(engine)
+    handle = queue.submit(labels, priority=PRIORITY_INTERACTIVE, group='preview')
+    wav, sample_rate = handle.result()
+"""
+
+import heapq
+import logging
+import threading
+from itertools import count
+
+from .cache import hash_strings
+
+logger = logging.getLogger(__name__)
+
+# 試聴用のプレビュー
+PRIORITY_INTERACTIVE = 0
+# WAVの書き出し
+PRIORITY_BATCH = 10
+
+
+class RenderCancelled(Exception):
+    """ジョブがキャンセルされたときの例外"""
+
+
+def check_cancelled(cancel_event: threading.Event | None):
+    """キャンセルされていたら RenderCancelled を送出する。"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise RenderCancelled('Rendering was cancelled.')
+
+
+def get_job_key(labels, svs_kwargs: dict) -> str:
+    """同じ合成かどうかを判定するためのキーを返す。"""
+    return hash_strings(
+        str(labels),
+        *(f'{key}={value!r}' for key, value in sorted(svs_kwargs.items())),
+    )
+
+
+class _Computation:
+    """キューの中の1回分の合成。同じ内容のジョブはこれを共有する。"""
+
+    def __init__(self, key, labels, svs_kwargs, priority):
+        self.key = key
+        self.labels = labels
+        self.svs_kwargs = svs_kwargs
+        self.priority = priority
+        # 結果を待っているジョブのハンドル
+        self.handles: list[RenderHandle] = []
+        self.running = False
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.result = None
+        self.exception = None
+
+    def finish(self, result=None, exception=None):
+        """計算結果を設定して、待っているジョブに知らせる。
+
+        RenderQueue のロックを取得してから呼ぶこと。
+        """
+        self.result = result
+        self.exception = exception
+        self.done_event.set()
+        for handle in self.handles:
+            handle._done_event.set()
+
+
+class RenderHandle:
+    """submit() で返すジョブのハンドル。"""
+
+    def __init__(self, queue: 'RenderQueue', computation: _Computation, group=None):
+        self._queue = queue
+        self._computation = computation
+        self.group = group
+        self.cancelled = False
+        # 計算が終わったときか、このジョブがキャンセルされたときにセットする
+        self._done_event = threading.Event()
+
+    def cancel(self):
+        """このジョブをキャンセルする。
+
+        同じ計算を共有しているほかのジョブがすべてキャンセルされた場合だけ、計算を止める。
+        """
+        self._queue._release(self)
+
+    def done(self) -> bool:
+        """ジョブが終わったかどうかを返す。"""
+        return self._done_event.is_set()
+
+    def result(self, timeout: float | None = None):
+        """合成結果 (wav, sample_rate) を返す。終わるまで待つ。
+
+        Raises:
+            RenderCancelled: ジョブがキャンセルされた場合
+            TimeoutError: timeout 秒以内に終わらなかった場合
+        """
+        if not self._done_event.wait(timeout):
+            raise TimeoutError('Rendering did not finish in time.')
+        if self.cancelled:
+            raise RenderCancelled('Rendering was cancelled.')
+        if self._computation.exception is not None:
+            raise self._computation.exception
+        return self._computation.result
+
+
+class RenderQueue:
+    """ENUNU.svs() を1つのスレッドで順番に実行するキュー。
+
+    Args:
+        engine (ENUNU): 合成に使うエンジン
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap: list[tuple[int, int, _Computation]] = []
+        self._seq = count()
+        # 実行待ちか実行中の計算 (キー → 計算)
+        self._active: dict[str, _Computation] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name='enunu-render', daemon=True)
+        self._thread.start()
+
+    def submit(self, labels, priority: int = PRIORITY_BATCH, group=None, **svs_kwargs):
+        """合成ジョブを追加して、そのハンドルを返す。
+
+        Args:
+            labels (nnmnkwii.io.hts.HTSLabelFile): フルラベル
+            priority (int): 優先度。小さいほど先に実行する。
+            group (hashable): 同じ group の古いジョブをキャンセルする場合に指定する。
+            svs_kwargs: ENUNU.svs() に渡す引数
+        """
+        key = get_job_key(labels, svs_kwargs)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('RenderQueue is already shut down.')
+            # 同じ group の古いジョブを置き換える
+            if group is not None:
+                for other in list(self._active.values()):
+                    if other.key == key:
+                        continue
+                    for handle in [h for h in other.handles if h.group == group]:
+                        logger.info('Superseded render job: %s', other.key[:8])
+                        self._release_locked(handle)
+            computation = self._active.get(key)
+            if computation is None:
+                computation = _Computation(key, labels, svs_kwargs, priority)
+                self._active[key] = computation
+                heapq.heappush(self._heap, (priority, next(self._seq), computation))
+            elif priority < computation.priority and not computation.running:
+                # 優先度の高いジョブと合流した場合は、実行待ちの順番を繰り上げる
+                computation.priority = priority
+                heapq.heappush(self._heap, (priority, next(self._seq), computation))
+            handle = RenderHandle(self, computation, group)
+            computation.handles.append(handle)
+            self._wakeup.notify()
+        return handle
+
+    def shutdown(self, cancel_pending: bool = False):
+        """キューを閉じて、実行中のジョブの終了を待つ。"""
+        with self._lock:
+            self._closed = True
+            if cancel_pending:
+                for computation in list(self._active.values()):
+                    self._cancel_computation(computation)
+            self._wakeup.notify()
+        self._thread.join()
+
+    def _release(self, handle: RenderHandle):
+        """ジョブのハンドルをキャンセルする。"""
+        with self._lock:
+            self._release_locked(handle)
+
+    def _release_locked(self, handle: RenderHandle):
+        """ジョブのハンドルを計算から切り離す。ロックを取得してから呼ぶこと。
+
+        計算を待っているハンドルがなくなった場合は、計算もキャンセルする。
+        """
+        computation = handle._computation
+        if handle.cancelled or computation.done_event.is_set():
+            return
+        handle.cancelled = True
+        computation.handles.remove(handle)
+        handle._done_event.set()
+        if not computation.handles:
+            self._cancel_computation(computation)
+
+    def _cancel_computation(self, computation: _Computation):
+        """計算をキャンセルする。ロックを取得してから呼ぶこと。"""
+        computation.cancel_event.set()
+        if self._active.get(computation.key) is computation:
+            del self._active[computation.key]
+        # 実行待ちの計算はここで終わらせる。実行中の計算は ENUNU.svs() の中で止まる。
+        if not computation.running:
+            computation.finish(exception=RenderCancelled('Rendering was cancelled.'))
+
+    def _next_computation(self) -> _Computation | None:
+        """次に実行する計算を取り出す。キューが閉じられて空になったら None を返す。"""
+        with self._lock:
+            while True:
+                while self._heap:
+                    priority, _, computation = heapq.heappop(self._heap)
+                    # キャンセル済みのものと、優先度を繰り上げる前の古いエントリは飛ばす
+                    if computation.cancel_event.is_set() or computation.running:
+                        continue
+                    if priority != computation.priority:
+                        continue
+                    computation.running = True
+                    return computation
+                if self._closed:
+                    return None
+                self._wakeup.wait()
+
+    def _worker(self):
+        while True:
+            computation = self._next_computation()
+            if computation is None:
+                return
+            result, exception = None, None
+            try:
+                result = self.engine.svs(
+                    computation.labels,
+                    cancel_event=computation.cancel_event,
+                    **computation.svs_kwargs,
+                )
+            except Exception as e:  # noqa: BLE001
+                exception = e
+            # 同じキーの submit() が終わった計算に合流しないように、
+            # _active から外すのと待っているジョブに知らせるのをロックの中でまとめて行う
+            with self._lock:
+                if self._active.get(computation.key) is computation:
+                    del self._active[computation.key]
+                computation.finish(result=result, exception=exception)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+ENUNU.svs(feature_store=...) で保存した音響特徴量から、ボコーダだけを使って合成し直す。
+
+タイミングモデルと音響モデルは読み込まないので、ボコーダやポストフィルタ、
+vuv の閾値を変えて聴き比べるときにボコーダの処理時間しかかからない。
+
+使用例:
+    python -m enulib.revocode song.h5 song_usfgan.wav --vocoder_type usfgan
+    python -m enulib.revocode song.h5 song_world.wav --vocoder_type world --post_filter none
+"""
+
+import argparse
+import sys
+from os.path import exists, join
+
+import numpy as np
+import torch
+from nnsvs.gen import postprocess_waveform, predict_waveform
+from nnsvs.logger import getLogger
+from nnsvs.usfgan import USFGANWrapper
+from nnsvs.util import load_vocoder
+from omegaconf import OmegaConf
+from scipy.io import wavfile
+
+from .feature_store import read_feature_store
+from .wav_gain import adjust_wav_gain_for_float32
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Re-vocode acoustic features saved by ENUNU without running other models',
+    )
+    parser.add_argument('feature_store', type=str, help='HDF5 file saved by ENUNU')
+    parser.add_argument('out_wav', type=str, help='Output WAV file')
+    parser.add_argument(
+        '--vocoder_type',
+        type=str,
+        default=None,
+        choices=['world', 'pwg', 'usfgan', 'auto'],
+        help='Vocoder type (default: the one used for the render)',
+    )
+    parser.add_argument(
+        '--vuv_threshold', type=float, default=None, help='Threshold for V/UV decision'
+    )
+    parser.add_argument(
+        '--post_filter',
+        type=str,
+        default=None,
+        help='Post-filter type saved with feature_store_post_filters',
+    )
+    parser.add_argument('--model_dir', type=str, default=None, help='NNSVS model directory')
+    parser.add_argument('--device', type=str, default=None, help='cuda or cpu')
+    parser.add_argument('--verbose', type=int, default=100, help='Verbose level')
+    return parser
+
+
+def load_vocoder_only(model_dir: str, device):
+    """モデルフォルダからボコーダだけを読み込む。ボコーダがない場合は None を返す。"""
+    path_vocoder = join(model_dir, 'vocoder_model.pth')
+    if not exists(path_vocoder):
+        return None, None, None
+    acoustic_config = OmegaConf.load(join(model_dir, 'acoustic_model.yaml'))
+    return load_vocoder(path_vocoder, device, acoustic_config)
+
+
+def resolve_vocoder_type(vocoder, feature_type: str) -> str:
+    """vocoder_type='auto' のときに使うボコーダを、SPSVS.predict_waveform と同じ方法で決める。"""
+    if vocoder is None:
+        if feature_type == 'melf0':
+            raise FileNotFoundError('Neural vocoder is required for melf0 features.')
+        return 'world'
+    return 'usfgan' if isinstance(vocoder, USFGANWrapper) else 'pwg'
+
+
+def revocode(
+    path_feature_store: str,
+    vocoder_type: str | None = None,
+    vuv_threshold: float | None = None,
+    post_filter_type: str | None = None,
+    model_dir: str | None = None,
+    device=None,
+    logger=None,
+) -> tuple[np.ndarray, int]:
+    """保存した音響特徴量からボコーダで波形を生成する。
+
+    ENUNU本体と同じように、ボコーダの出力には ENUNU.svs() と同じ後処理
+    (バンドパスフィルタ) をする。
+
+    Returns:
+        wav (np.ndarray): 波形 (float32、音量は学習データのビット深度のまま)
+        sample_rate (int): サンプリング周波数
+    """
+    attrs, segments = read_feature_store(path_feature_store, post_filter_type)
+    vocoder_type = vocoder_type or str(attrs['vocoder_type'])
+    vuv_threshold = float(attrs['vuv_threshold']) if vuv_threshold is None else vuv_threshold
+    model_dir = model_dir or str(attrs['model_dir'])
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    else:
+        device = torch.device(device)
+
+    feature_type = str(attrs['feature_type'])
+    vocoder, vocoder_in_scaler, vocoder_config = None, None, None
+    if vocoder_type != 'world':
+        vocoder, vocoder_in_scaler, vocoder_config = load_vocoder_only(model_dir, device)
+        if vocoder is None and vocoder_type != 'auto':
+            raise FileNotFoundError(f'Vocoder model does not exist in {model_dir}.')
+    # nnsvs.gen.predict_waveform は 'auto' を受け付けないので、ここで決める
+    if vocoder_type == 'auto':
+        vocoder_type = resolve_vocoder_type(vocoder, feature_type)
+    if logger is not None:
+        logger.info('Re-vocoding %s segments with %s', len(segments), vocoder_type)
+
+    wavs = []
+    for multistream_features in segments:
+        wav = predict_waveform(
+            device=device,
+            multistream_features=multistream_features,
+            vocoder=vocoder,
+            vocoder_config=vocoder_config,
+            vocoder_in_scaler=vocoder_in_scaler,
+            sample_rate=int(attrs['sample_rate']),
+            frame_period=float(attrs['frame_period']),
+            use_world_codec=bool(attrs['use_world_codec']),
+            feature_type=feature_type,
+            vocoder_type=vocoder_type,
+            vuv_threshold=vuv_threshold,
+        )
+        wavs.append(wav.astype(np.float32, copy=False))
+    sample_rate = int(attrs['sample_rate'])
+    wav = np.concatenate(wavs, axis=0).reshape(-1)
+    # ENUNU.svs() と同じ後処理をする (enunu.py と同じく正規化はしない)
+    return postprocess_waveform(wav, sample_rate, dtype=np.float32), sample_rate
+
+
+def main(
+    path_feature_store,
+    path_wav,
+    vocoder_type=None,
+    vuv_threshold=None,
+    post_filter_type=None,
+    model_dir=None,
+    device=None,
+    verbose=100,
+):
+    logger = getLogger(verbose)
+    wav, sample_rate = revocode(
+        path_feature_store,
+        vocoder_type=vocoder_type,
+        vuv_threshold=vuv_threshold,
+        post_filter_type=post_filter_type,
+        model_dir=model_dir,
+        device=device,
+        logger=logger,
+    )
+    # ENUNU本体と同じように、学習データのビット深度に合わせて float32 の音量にする
+    wav = adjust_wav_gain_for_float32(wav, inplace=True)
+    wavfile.write(path_wav, rate=sample_rate, data=wav)
+    logger.info('Saved %s', path_wav)
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args(sys.argv[1:])
+    main(
+        args.feature_store,
+        args.out_wav,
+        vocoder_type=args.vocoder_type,
+        vuv_threshold=args.vuv_threshold,
+        post_filter_type=args.post_filter,
+        model_dir=args.model_dir,
+        device=args.device,
+        verbose=args.verbose,
+    )
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+歌詞→音素の変換テーブルを探して読み取る。
+
+テーブルは内容のハッシュ値をキーにして pickle 形式でキャッシュフォルダに保存しておき、
+2回目以降はテキストを解析せずに読み込む。
+モデルフォルダからテーブルを探した結果もフォルダの更新時刻と一緒に保存しておく。
+"""
+
+import json
+import logging
+import pickle
+from glob import glob
+from os import replace
+from os.path import abspath, basename, exists, getmtime, join
+from tempfile import mkstemp
+
+import utaupy
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの形式を変えたときに古いキャッシュを使わないようにするための番号
+TABLE_CACHE_VERSION = 1
+TABLE_CACHE_MAX_ENTRIES = 64
+
+# 同じプロセス内で読み込んだテーブル (ハッシュ値 → テーブル)
+_loaded_tables: dict[str, dict] = {}
+
+
+def _write_atomic(path: str, data: bytes):
+    """書き込み途中のファイルを他のプロセスが読まないように、一時ファイル経由で保存する。"""
+    fd, path_temp = mkstemp(dir=cache.get_cache_dir('tables'), suffix='.tmp')
+    with open(fd, 'wb') as f:
+        f.write(data)
+    replace(path_temp, path)
+
+
+def find_table(model_dir: str) -> str:
+    """歌詞→音素の変換テーブルを探す。
+
+    探した結果はモデルフォルダの更新時刻とともに保存しておき、
+    フォルダが変更されていなければ探し直さない。
+    """
+    model_dir = abspath(model_dir)
+    path_index = join(cache.get_cache_dir('tables'), 'index.json')
+    index = {}
+    if exists(path_index):
+        try:
+            with open(path_index, encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+    mtime = getmtime(model_dir)
+    entry = index.get(model_dir)
+    if entry is not None and entry['mtime'] == mtime and exists(entry['path']):
+        logger.info('Using %s', basename(entry['path']))
+        return entry['path']
+
+    table_files = sorted(glob(join(model_dir, '*.table')))
+    if len(table_files) == 0:
+        raise FileNotFoundError(f'Table file does not exist in {model_dir}.')
+    if len(table_files) > 1:
+        logger.warning('Multiple table files are found. : %s', table_files)
+    logger.info('Using %s', basename(table_files[0]))
+    index[model_dir] = {'mtime': mtime, 'path': table_files[0]}
+    _write_atomic(path_index, json.dumps(index, ensure_ascii=False, indent=2).encode('utf-8'))
+    return table_files[0]
+
+
+def load_table(path_table: str) -> dict:
+    """変換テーブルを読み取る。
+
+    テーブルの内容のハッシュ値をキーにして、解析済みのテーブルを
+    同じプロセス内ではメモリに、プロセスをまたぐ場合は pickle ファイルにキャッシュする。
+    """
+    table_hash = cache.hash_strings(str(TABLE_CACHE_VERSION), cache.hash_file(path_table))
+    if table_hash in _loaded_tables:
+        return _loaded_tables[table_hash]
+
+    path_pickle = join(cache.get_cache_dir('tables'), f'{table_hash}.pickle')
+    table = None
+    if exists(path_pickle):
+        try:
+            with open(path_pickle, 'rb') as f:
+                table = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logger.warning('Failed to load compiled table: %s', path_pickle)
+    if table is None:
+        table = utaupy.table.load(path_table, encoding='utf-8')
+        _write_atomic(path_pickle, pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL))
+        cache.prune(cache.get_cache_dir('tables'), TABLE_CACHE_MAX_ENTRIES)
+    _loaded_tables[table_hash] = table
+    return table
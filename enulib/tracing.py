@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+ENUNUの各処理にかかった時間を記録して、Chrome trace 形式のJSONで出力する。
+
+出力したファイルは chrome://tracing や Perfetto (https://ui.perfetto.dev) で表示できる。
+メモリ計測を有効にすると、処理区間ごとのピークメモリ (RSS と tracemalloc) も記録する。
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+# Windows にはない
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MB = 1024 * 1024
+
+
+def get_rss() -> tuple[int | None, int | None]:
+    """現在のRSSと、プロセス開始からの最大RSSをバイト単位で返す。
+
+    psutil があればそれを使い、なければ /proc/self/status を読む。
+    最大RSSは psutil では Windows でしか取れないので、取れなかった場合は getrusage を使う。
+    どれも使えない環境では取得できなかった値を None にする。
+    """
+    rss, peak = None, None
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # Windows では peak_wset で最大値を取得できる
+        rss, peak = info.rss, getattr(info, 'peak_wset', None)
+    elif sys.platform.startswith('linux'):
+        with open('/proc/self/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) * 1024
+    if peak is None and resource is not None:
+        # ru_maxrss は macOS ではバイト、Linux などでは KiB
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss if sys.platform == 'darwin' else maxrss * 1024
+    return rss, peak
+
+
+class Tracer:
+    """処理区間(span)の開始時刻と所要時間を記録するクラス。
+
+    無効化されているときは何も記録しないので、計測しない場合の負荷はほぼない。
+    """
+
+    def __init__(self, enabled: bool = False, memory: bool = False):
+        self.enabled = enabled
+        self.memory = memory
+        self.events: list[dict] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        # 計測中の区間ごとの tracemalloc のピーク値
+        self._open_peaks: dict[int, int] = {}
+        self._token = count()
+
+    def start_memory_profiling(self):
+        """メモリ計測を開始する。"""
+        self.memory = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _enter_memory(self) -> tuple[int, int, int | None]:
+        """区間開始時のメモリ使用量を記録する。
+
+        tracemalloc のピークはプロセス全体で1つしかないので、
+        リセットする前に計測中のすべての区間へ反映しておく。
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            for token, value in self._open_peaks.items():
+                self._open_peaks[token] = max(value, peak)
+            token = next(self._token)
+            self._open_peaks[token] = current
+            tracemalloc.reset_peak()
+        return token, current, get_rss()[1]
+
+    def _exit_memory(self, token: int, start_current: int, start_hwm: int | None) -> dict:
+        """区間終了時のメモリ使用量を記録して、args 用の辞書を返す。"""
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            span_peak = max(self._open_peaks.pop(token), peak)
+            for other, value in self._open_peaks.items():
+                self._open_peaks[other] = max(value, span_peak)
+        rss, hwm = get_rss()
+        result = {
+            'tracemalloc_peak_mb': round(span_peak / MB, 3),
+            'tracemalloc_delta_mb': round((current - start_current) / MB, 3),
+        }
+        if rss is not None:
+            result['rss_mb'] = round(rss / MB, 3)
+        if hwm is not None:
+            result['peak_rss_mb'] = round(hwm / MB, 3)
+            # この区間でプロセスの最大RSSがどれだけ増えたか
+            if start_hwm is not None:
+                result['peak_rss_growth_mb'] = round((hwm - start_hwm) / MB, 3)
+        return result
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """with文の中の処理時間を記録する。
+
+        with文で受け取った辞書に値を追加すると、その区間の args として記録される。
+        (例: フレーム数のように処理後にしかわからない値)
+        """
+        if not self.enabled:
+            yield args
+            return
+        memory = self.memory
+        if memory:
+            token, start_current, start_hwm = self._enter_memory()
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            events = [
+                {
+                    'name': name,
+                    'cat': 'enunu',
+                    'ph': 'X',
+                    'ts': (start - self._origin) * 1e6,
+                    'dur': (end - start) * 1e6,
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'args': args,
+                }
+            ]
+            if memory:
+                memory_args = self._exit_memory(token, start_current, start_hwm)
+                args.update(memory_args)
+                # Perfetto でメモリ使用量のグラフを表示するためのカウンター
+                events.append(
+                    {
+                        'name': 'memory',
+                        'cat': 'enunu',
+                        'ph': 'C',
+                        'ts': (end - self._origin) * 1e6,
+                        'pid': os.getpid(),
+                        'args': {
+                            k: v
+                            for k, v in memory_args.items()
+                            if k in ('rss_mb', 'tracemalloc_peak_mb')
+                        },
+                    }
+                )
+            with self._lock:
+                self.events.extend(events)
+
+    def summary(self) -> list[tuple[str, int, float]]:
+        """区間名ごとの呼び出し回数と合計時間(秒)を、合計時間の長い順に返す。"""
+        counts: dict[str, int] = defaultdict(int)
+        totals: dict[str, float] = defaultdict(float)
+        with self._lock:
+            for event in self.events:
+                if event['ph'] != 'X':
+                    continue
+                counts[event['name']] += 1
+                totals[event['name']] += event['dur'] / 1e6
+        return sorted(
+            ((name, counts[name], totals[name]) for name in totals),
+            key=lambda x: x[2],
+            reverse=True,
+        )
+
+    def memory_summary(self) -> dict[str, dict[str, float]]:
+        """区間名ごとの tracemalloc のピークと最大RSS(MB)の最大値を返す。"""
+        result: dict[str, dict[str, float]] = defaultdict(dict)
+        with self._lock:
+            for event in self.events:
+                if event['ph'] != 'X':
+                    continue
+                for key in ('tracemalloc_peak_mb', 'peak_rss_mb', 'peak_rss_growth_mb'):
+                    if key in event['args']:
+                        value = event['args'][key]
+                        result[event['name']][key] = max(
+                            result[event['name']].get(key, value), value
+                        )
+        return dict(result)
+
+    def dump(self, path: str):
+        """Chrome trace 形式のJSONファイルを出力する。"""
+        with self._lock:
+            data = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+
+
+# ENUNU全体で共有するトレーサー
+TRACER = Tracer()
+
+
+def enable(memory: bool = False):
+    """計測を有効にする。memory=True のときはメモリ使用量も計測する。"""
+    TRACER.enabled = True
+    if memory:
+        TRACER.start_memory_profiling()
+
+
+def is_enabled() -> bool:
+    """計測が有効かどうかを返す。"""
+    return TRACER.enabled
+
+
+def span(name: str, **args):
+    """共有トレーサーで処理区間を計測する。"""
+    return TRACER.span(name, **args)
+
+
+def traced(name: str):
+    """関数全体を処理区間として計測するデコレータ。"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def dump(path: str):
+    """共有トレーサーの記録を Chrome trace 形式で出力する。"""
+    TRACER.dump(path)
+
+
+def summary() -> list[tuple[str, int, float]]:
+    """共有トレーサーの区間ごとの集計結果を返す。"""
+    return TRACER.summary()
+
+
+def log_summary(logger):
+    """区間ごとの集計結果をログに出力する。"""
+    memory_summary = TRACER.memory_summary()
+    for name, n_calls, total in TRACER.summary():
+        if name not in memory_summary:
+            logger.info('%-24s %4d calls %9.3f sec', name, n_calls, total)
+            continue
+        memory = memory_summary[name]
+        logger.info(
+            '%-24s %4d calls %9.3f sec | tracemalloc peak %9.1f MB | peak RSS %s MB (+%s MB)',
+            name,
+            n_calls,
+            total,
+            memory.get('tracemalloc_peak_mb', 0.0),
+            memory.get('peak_rss_mb', '-'),
+            memory.get('peak_rss_growth_mb', '-'),
+        )
@@ -6,33 +6,57 @@ TMPファイル(UTAUプラグインに渡されるUST似のファイル) を
 """
 import utaupy
 
+from .table import load_table
 
-def utauplugin2score(path_plugin_in, path_table, path_full_out, strict_sinsy_style=False):
+
+def utauplugin2score(
+    path_plugin_in, path_table, path_full_out, strict_sinsy_style=False, table=None
+):
     """
     UTAUプラグイン用のファイルをフルラベルファイルに変換する。
+
+    table に読み取り済みの変換テーブルを渡すと、path_table は読まない。
     """
     # プラグイン用一時ファイルを読み取る
     plugin = utaupy.utauplugin.load(path_plugin_in)
-    # 変換テーブルを読み取る
-    table = utaupy.table.load(path_table, encoding='utf-8')
+    # 変換テーブルを読み取る (解析済みのものがキャッシュにあればそれを使う)
+    if table is None:
+        table = load_table(path_table)
+    plugin2score(plugin, table, path_full_out, strict_sinsy_style)
+
 
+def plugin2score(plugin, table, path_full_out, strict_sinsy_style=False):
+    """
+    読み取り済みのUTAUプラグイン用のオブジェクトをフルラベルファイルに変換する。
+
+    変換のために書き換えた歌詞とフラグは、変換後にもとに戻す。
+    """
     # 2ノート以上選択されているかチェックする
     if len(plugin.notes) < 2:
         raise Exception(
             'ENUNU requires at least 2 notes. / ENUNUを使うときは2ノート以上選択してください。'
         )
 
-    # 歌詞が無いか空白のノートを休符にする。
-    for note in plugin.notes:
-        if note.lyric.strip(' 　') == '':
-            note.lyric = 'R'
-        # フルラベルの区切り文字と干渉しないように符号を置換する
-        if note.flags != '':
-            note.flags = note.flags.replace('-', 'n')
-            note.flags = note.flags.replace('+', 'p')
-    # classを変更
-    ust = plugin.as_ust()
-    # フルラベル用のclassに変換
-    song = utaupy.utils.ustobj2songobj(ust, table)
+    # 変換後に戻せるように歌詞とフラグを控えておく
+    original_values = [(note.lyric, note.flags) for note in plugin.notes]
+    try:
+        # 歌詞が無いか空白のノートを休符にする。
+        for note in plugin.notes:
+            if note.lyric.strip(' 　') == '':
+                note.lyric = 'R'
+            # フルラベルの区切り文字と干渉しないように符号を置換する
+            if note.flags != '':
+                note.flags = note.flags.replace('-', 'n')
+                note.flags = note.flags.replace('+', 'p')
+        # classを変更
+        ust = plugin.as_ust()
+        # フルラベル用のclassに変換
+        song = utaupy.utils.ustobj2songobj(ust, table)
+    finally:
+        for note, (lyric, flags) in zip(plugin.notes, original_values):
+            if note.lyric != lyric:
+                note.lyric = lyric
+            if note.flags != flags:
+                note.flags = flags
     # ファイル出力
     song.write(path_full_out, strict_sinsy_style)
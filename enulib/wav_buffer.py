@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+合成したセグメントの波形を順番に書き込む、曲全体の float32 のバッファ。
+
+セグメントの波形をリストに溜めて最後に結合すると、曲全体の長さのコピーが何度もできてしまう。
+あらかじめラベルのフレーム数から見積もった長さのバッファを確保しておき、
+各セグメントの波形をその位置に直接書き込む。見積もりより長くなった場合だけ確保し直す。
+
+非常に長い曲では、バッファを一時ファイルにメモリマップして、RAMの使用量を抑えられる。
+"""
+
+import logging
+from tempfile import TemporaryFile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 見積もりより長くなったときに確保し直す長さの倍率
+GROWTH_FACTOR = 1.25
+
+
+def estimate_n_samples(segments, frame_shift: int, hop_length: int) -> int:
+    """セグメントのラベルから、合成する波形の長さ (サンプル数) を見積もる。
+
+    Args:
+        segments (list[nnmnkwii.io.hts.HTSLabelFile]): セグメントごとのラベル
+        frame_shift (int): フレームシフト (100ns単位)
+        hop_length (int): 1フレームあたりのサンプル数
+    """
+    n_frames = sum(
+        # 丸め誤差のぶん1フレーム余分に確保する
+        -(-(int(seg.end_times[-1]) - int(seg.start_times[0])) // frame_shift) + 1
+        for seg in segments
+        if len(seg) > 0
+    )
+    return n_frames * hop_length
+
+
+class WaveformBuffer:
+    """波形を順番に書き込む float32 のバッファ。
+
+    Args:
+        n_samples (int): 確保する長さ (サンプル数) の見積もり
+        use_memmap (bool): 一時ファイルにメモリマップしたバッファを使うかどうか
+    """
+
+    def __init__(self, n_samples: int, use_memmap: bool = False):
+        self.use_memmap = use_memmap
+        self.n_samples = 0
+        self.data = self._allocate(max(n_samples, 1))
+
+    def _allocate(self, n_samples: int) -> np.ndarray:
+        """長さ n_samples のバッファを確保する。"""
+        if self.use_memmap:
+            # 名前のない一時ファイルなので、バッファが使われなくなると自動で削除される
+            with TemporaryFile(prefix='enunu-wav-') as f:
+                return np.memmap(f, dtype=np.float32, mode='w+', shape=(n_samples,))
+        # np.zeros は書き込むまで実際のメモリを使わない
+        return np.zeros(n_samples, dtype=np.float32)
+
+    def append(self, wav: np.ndarray) -> np.ndarray:
+        """波形を末尾に書き込んで、バッファ上のその部分を返す。
+
+        float64 の波形も、float32 の中間配列を作らずにそのまま書き込む。
+        """
+        wav = wav.reshape(-1)
+        end = self.n_samples + len(wav)
+        if end > len(self.data):
+            new_size = max(end, int(len(self.data) * GROWTH_FACTOR))
+            logger.info('Waveform is longer than estimated. Growing to %s samples', new_size)
+            data = self._allocate(new_size)
+            data[: self.n_samples] = self.data[: self.n_samples]
+            self.data = data
+        segment = self.data[self.n_samples : end]
+        segment[:] = wav
+        self.n_samples = end
+        return segment
+
+    @property
+    def wav(self) -> np.ndarray:
+        """書き込んだ部分の波形 (コピーではなくバッファの一部)"""
+        return self.data[: self.n_samples]
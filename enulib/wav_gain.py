@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021-2025 oatsu
+"""
+学習データのビット深度に合わせて、合成した波形の音量を float32 の範囲にする。
+
+NNSVS のモデルは学習データの音量のまま波形を出力するので、
+16bit や 32bit の整数の音量で学習したモデルの出力は float32 の範囲 [-1, 1] を超える。
+"""
+
+import numpy as np
+
+# ビット深度ごとの最大値
+BIT_DEPTH_SCALES = {'int32': 2147483647, 'int16': 32767}
+
+
+def estimate_bit_depth(wav: np.ndarray) -> str:
+    """
+    wavformのビット深度を判定する。
+    16bitか32bit
+    16bitの最大値: 32767
+    32bitの最大値: 2147483647
+    """
+    # 音量の最大値を取得 (np.abs は波形全体のコピーを作るので使わない)
+    max_gain = max(np.nanmax(wav), -np.nanmin(wav))
+    # 学習データのビット深度を推定(8388608=2^24)
+    if max_gain > 8388608:
+        return 'int32'
+    if max_gain > 8:
+        return 'int16'
+    return 'float'
+
+
+def adjust_wav_gain_for_float32(wav: np.ndarray, inplace: bool = False):
+    """
+    wavformのビット深度を判定して、float32で適切な音量で出力する。
+    16bitか32bit
+    16bitの最大値: 32767
+    32bitの最大値: 2147483647
+    ビット深度を指定してファイル出力(32bit float)
+
+    inplace が True で波形が浮動小数点数の場合は、コピーを作らずに wav の音量を直接変える。
+    """
+    # 学習データのビット深度を推定する
+    scale = BIT_DEPTH_SCALES.get(estimate_bit_depth(wav))
+    # float
+    if scale is None:
+        return wav
+    # int32 / int16 -> float
+    if inplace and wav.dtype.kind == 'f':
+        wav /= scale
+        return wav
+    return wav / scale
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+UST の複製やラベル、音響特徴量のCSVなどの中間ファイルを置く作業フォルダ。
+
+UST の隣の {songname}_enutemp は同期フォルダや遅いドライブにあることが多いので、
+RAM上のフォルダ (/dev/shm など) に中間ファイルを置けるようにする。
+RAM上に置いた中間ファイルは、指定されたときか処理に失敗したときだけ、
+同じファイル名のまま {songname}_enutemp に保存する。
+RAM上のフォルダが見つからない場合 (Windows など) は {songname}_enutemp をそのまま使う。
+
+使用例:
+    with Workspace(temp_dir, in_ram=True) as temp_dir:
+        ...
+"""
+
+import logging
+import shutil
+from os import W_OK, access, environ, makedirs
+from os.path import abspath, isdir
+from tempfile import mkdtemp
+
+logger = logging.getLogger(__name__)
+
+# RAM上の一時フォルダの候補。環境変数 ENUNU_RAM_DIR で指定もできる。
+RAM_DIR_CANDIDATES = ('/dev/shm',)
+
+
+def get_ram_dir() -> str | None:
+    """RAM上の一時フォルダを返す。見つからない場合は None を返す。"""
+    candidates = [environ.get('ENUNU_RAM_DIR'), *RAM_DIR_CANDIDATES]
+    for path in candidates:
+        if path and isdir(path) and access(path, W_OK):
+            return path
+    return None
+
+
+class Workspace:
+    """中間ファイルを置く作業フォルダ。
+
+    Args:
+        persist_dir (str): 中間ファイルを保存するフォルダ ({songname}_enutemp)
+        in_ram (bool): RAM上のフォルダを作業フォルダにするかどうか。
+            RAM上のフォルダが見つからない場合は persist_dir を使う。
+        keep (bool): 処理に成功した場合も中間ファイルを persist_dir に保存するかどうか
+    """
+
+    def __init__(self, persist_dir: str, in_ram: bool = False, keep: bool = False):
+        self.persist_dir = abspath(persist_dir)
+        self.in_ram = in_ram
+        self.keep = keep
+        self.path = None
+
+    def open(self) -> str:
+        """作業フォルダを作って、そのパスを返す。"""
+        ram_dir = get_ram_dir() if self.in_ram else None
+        if ram_dir is not None:
+            self.path = mkdtemp(prefix='enunu-', dir=ram_dir)
+            logger.info('Using RAM workspace: %s', self.path)
+        else:
+            makedirs(self.persist_dir, exist_ok=True)
+            self.path = self.persist_dir
+        return self.path
+
+    def persist(self):
+        """中間ファイルを同じファイル名のまま persist_dir に保存する。"""
+        if self.path is None or self.path == self.persist_dir:
+            return
+        shutil.copytree(self.path, self.persist_dir, dirs_exist_ok=True)
+        logger.info('Saved intermediate files to %s', self.persist_dir)
+
+    def close(self, failed: bool = False):
+        """作業フォルダを閉じる。RAM上のフォルダは削除する。
+
+        Args:
+            failed (bool): 処理に失敗したかどうか。失敗した場合は中間ファイルを保存する。
+        """
+        if self.path is None or self.path == self.persist_dir:
+            return
+        try:
+            if self.keep or failed:
+                self.persist()
+        finally:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+    def __enter__(self) -> str:
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(failed=exc_type is not None)
@@ -6,23 +6,29 @@
 """
 
 import colored_traceback.auto  # noqa: F401
+import copy
 
 from importlib.util import find_spec
+import json
 import logging
 import shutil
 import sys
+import threading
 import time
 import tkinter
 from argparse import ArgumentParser
+from contextlib import nullcontext
 from datetime import datetime
-from glob import glob
-from os import chdir, listdir, makedirs, rename, startfile
+from os import chdir, listdir, makedirs, rename, replace, startfile
 from os.path import (
     abspath,
     basename,
     dirname,
     exists,
     expanduser,
+    getmtime,
+    getsize,
+    isfile,
     join,
     relpath,
     splitext,
@@ -32,6 +38,7 @@ from shutil import move
 from tempfile import TemporaryDirectory, mkdtemp
 from tkinter.filedialog import asksaveasfilename
 from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 import utaupy
 import yaml
@@ -42,6 +49,7 @@ from tqdm.auto import tqdm
 # スクリプトのディレクトリをsys.pathに追加
 sys.path.append(dirname(__file__))
 import enulib
+from enulib.wav_gain import BIT_DEPTH_SCALES, adjust_wav_gain_for_float32, estimate_bit_depth
 
 # scikit-learn で警告が出るのを無視
 # import warnings
@@ -57,6 +65,54 @@ logger = logging.getLogger('enunu')
 
 
 SEGMENTED_SYNTHESIS = True
+# 休符で区切れない長いフレーズを分割して推論するときのチャンク長と前後の文脈長 (フレーム数)
+# 5ms シフトの場合 6000 フレームで 30 秒。None にすると分割しない。
+# 分割すると出力が分割しない場合と変わる (誤差は未測定) ので、既定では分割しない。
+CHUNK_FRAMES = None
+CHUNK_OVERLAP_FRAMES = 200
+# 入力が同じときに拡張機能を実行せずに前回の結果を使うかどうか
+# (ENUNU_CACHEABLE = True を宣言した拡張機能のみ)
+EXTENSION_CACHE = True
+# 中間ファイルをRAM上の一時フォルダ (/dev/shm や環境変数 ENUNU_RAM_DIR) に置くかどうか
+# True のときは、失敗したときか KEEP_TEMP_FILES が True のときだけ {songname}_enutemp に保存する。
+# RAM上のフォルダが見つからない場合 (Windows など) は、True でも {songname}_enutemp を使う。
+RAM_WORKSPACE = False
+KEEP_TEMP_FILES = False
+# 前回の合成結果から楽譜が変わった部分だけを合成し直すかどうか (USTが保存されている場合のみ)
+REGION_RENDER = False
+# 下書きモード: WORLDボコーダを使い、ポストフィルタと省略可能な拡張機能を使わずに速く合成する。
+# プラグイン用の一時ファイルの [#SETTING] に EnunuDraft=True と書いても有効になる。
+DRAFT_MODE = False
+# セグメントごとの後処理済みの音響特徴量をキャッシュして、
+# f0 だけの編集ではボコーダだけやり直すかどうか
+FEATURE_CACHE = True
+FEATURE_CACHE_MAX_ENTRIES = 256
+# 音響モデルの推論をまとめて実行するセグメント数。1 にするとセグメントごとに推論する。
+# 最初のバッチで1セグメントずつの推論と結果を比べて、一致しないモデルでは自動で無効にする。
+ACOUSTIC_BATCH_SIZE = 4
+# 音響モデル、音響特徴量の編集、ボコーダをセグメントごとに流れ作業で並行して実行するかどうか
+# と、段の間で待たせておけるセグメント数
+PIPELINED_SYNTHESIS = True
+PIPELINE_QUEUE_SIZE = 2
+# 合成する波形がこの長さ (秒) を超えると見積もられる場合は、
+# 出力のバッファを一時ファイルにメモリマップする
+OUTPUT_MEMMAP_MIN_SEC = 1800
+# 複数の音源で同時に合成するときに使ってよいメモリの目安 (MB)
+MULTI_VOICE_MEMORY_BUDGET_MB = 8192
+# 音源1つあたりのメモリ使用量の見積もり: モデルファイルの合計サイズ × 係数 + 固定量 (MB)
+ENGINE_MEMORY_FACTOR = 3
+ENGINE_MEMORY_BASE_MB = 512
+# 下書きモードの合成の設定
+DRAFT_SVS_KWARGS = {
+    'vocoder_type': 'world',
+    'post_filter_type': 'none',
+    'trajectory_smoothing': False,
+}
+
+# --pcm_out - で実行された場合は、PyTorch のインストールのメッセージやログがPCMに混ざらないように、
+# 何かを書き出す前に標準出力を取り上げる。
+if __name__ == '__main__' and enulib.pcm_stream.stdout_requested(sys.argv[1:]):
+    enulib.pcm_stream.take_stdout()
 
 # torch をimportする。インストールされていない場合は新規インストールする ------
 if find_spec('torch') is None:
@@ -74,15 +130,21 @@ import torch  # noqa: E402
 
 # nnsvs 関連を import する ---------------------------------------------------
 import nnsvs  # noqa: E402
+from nnsvs.logger import getLogger as get_nnsvs_logger  # noqa: E402
 from nnsvs.svs import SPSVS  # noqa: E402
-from enulib import enunu2nnsvs  # noqa: E402
+from omegaconf import OmegaConf  # noqa: E402
+from enulib import batching, enunu2nnsvs  # noqa: E402, F401
 
 
 def get_project_path(path_utauplugin):
     """
     キャッシュパスとプロジェクトパスを取得する。
+    読み取り済みのUTAUプラグイン用のオブジェクトも渡せる。
     """
-    plugin = utaupy.utauplugin.load(path_utauplugin)
+    if isinstance(path_utauplugin, str):
+        plugin = utaupy.utauplugin.load(path_utauplugin)
+    else:
+        plugin = path_utauplugin
     setting = plugin.setting
     # ustのパス
     path_ust = setting.get('Project')
@@ -94,23 +156,6 @@ def get_project_path(path_utauplugin):
     return path_ust, voice_dir, cache_dir
 
 
-def estimate_bit_depth(wav: np.ndarray) -> str:
-    """
-    wavformのビット深度を判定する。
-    16bitか32bit
-    16bitの最大値: 32767
-    32bitの最大値: 2147483647
-    """
-    # 音量の最大値を取得
-    max_gain = np.nanmax(np.abs(wav))
-    # 学習データのビット深度を推定(8388608=2^24)
-    if max_gain > 8388608:
-        return 'int32'
-    if max_gain > 8:
-        return 'int16'
-    return 'float'
-
-
 def wrapped_enunu2nnsvs(voice_dir, out_dir):
     """ENUNU用のディレクトリ構造のモデルをNNSVS用に再構築する。"""
     # torch.save() の出力パスに日本語が含まれているとセーブできないので、一時フォルダを作ってそこに保存してから移動する。
@@ -138,38 +183,108 @@ def packed_model_exists(voice_dir: str) -> bool:
     return all(map(exists, [join(voice_dir, p) for p in required_files]))
 
 
-def find_table(model_dir: str) -> str:
-    """歌詞→音素の変換テーブルを探す"""
-    table_files = glob(join(model_dir, '*.table'))
-    if len(table_files) == 0:
-        raise FileNotFoundError(f'Table file does not exist in {model_dir}.')
-    if len(table_files) > 1:
-        logger.warning('Multiple table files are found. : %s', table_files)
-    logger.info('Using %s', basename(table_files[0]))
-    return table_files[0]
-
+def find_model_dir(voice_dir: str) -> str:
+    """音源フォルダから NNSVS / ENUNU モデルのフォルダを探す。
 
-def adjust_wav_gain_for_float32(wav: np.ndarray):
+    ENUNU<1.0.0 向けのモデルの場合は NNSVS 用に変換する。
     """
-    wavformのビット深度を判定して、float32で適切な音量で出力する。
-    16bitか32bit
-    16bitの最大値: 32767
-    32bitの最大値: 2147483647
-    ビット深度を指定してファイル出力(32bit float)
+    # model フォルダ
+    if packed_model_exists(join(voice_dir, 'model')):
+        model_dir = join(voice_dir, 'model')
+    # 直置き
+    elif packed_model_exists(voice_dir):
+        model_dir = voice_dir
+    # ENUNU<1.0.0 向けのディレクトリ構成
+    elif exists(join(voice_dir, 'enuconfig.yaml')):
+        logger.info('Regacy ENUNU model is selected. Converting it for the compatibility...')
+        model_dir = join(voice_dir, 'model')
+        makedirs(model_dir, exist_ok=True)
+        print('----------------------------------------------')
+        wrapped_enunu2nnsvs(voice_dir, model_dir)
+        print('\n----------------------------------------------')
+        logger.info('Converted.')
 
-    """
-    # 音量の最大値を取得
-    max_gain = np.nanmax(np.abs(wav))
+    # configファイルがあるか調べて、なければ例外処理
+    else:
+        raise Exception('UTAU音源選択でENUNU用モデルを指定してください。')
+    assert model_dir
+    return model_dir
+
+
+def load_legacy_extensions(engine, voice_dir: str):
+    """enuconfigが存在する場合、そこに記載されている拡張機能のパスをconfigに追加する"""
+    if exists(join(voice_dir, 'enuconfig.yaml')):
+        with open(join(voice_dir, 'enuconfig.yaml'), encoding='utf-8') as f:
+            enuconfig = yaml.safe_load(f)
+        engine.config['extensions'] = enuconfig.get('extensions')
+
+
+def load_models_in_background(engine) -> Future:
+    """engine.load_models() を別スレッドで始めて、終わりを待つための Future を返す。
 
-    # 学習データのビット深度を推定(8388608=2^24)
-    # int32 -> float
-    if max_gain > 8388608:
-        return wav / 2147483647
-    # int16 -> float
-    if max_gain > 8:
-        return wav / 32767
-    # float
-    return wav
+    スレッドは daemon にしてあるので、途中の処理でエラーが起きて main() を抜けたときは、
+    モデルの読み込みが終わるのを待たずにインタプリタが終了する (読み込みは途中で打ち切られる)。
+    ThreadPoolExecutor のワーカーは終了時に待たれてしまうので使わない。
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            engine.load_models()
+        except BaseException as e:  # noqa: BLE001
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+    threading.Thread(target=run, name='enunu-load', daemon=True).start()
+    return future
+
+
+def raise_if_failed(future: Future):
+    """別スレッドの処理がすでに失敗していたら、その例外をこのスレッドで送出する。"""
+    if future.done() and not future.cancelled() and future.exception() is not None:
+        future.result()
+
+
+def get_svs_kwargs(draft: bool = False) -> dict:
+    """プラグインとして合成するときに ENUNU.svs() に渡す引数を返す。"""
+    svs_kwargs = {
+        'dtype': np.float32,
+        'vocoder_type': 'auto',
+        'post_filter_type': 'gv',
+        'force_fix_vuv': True,
+        'segmented_synthesis': SEGMENTED_SYNTHESIS,
+        'chunk_frames': CHUNK_FRAMES,
+        'chunk_overlap_frames': CHUNK_OVERLAP_FRAMES,
+        'batch_size': ACOUSTIC_BATCH_SIZE,
+        'pipeline': PIPELINED_SYNTHESIS,
+    }
+    if draft:
+        svs_kwargs.update(DRAFT_SVS_KWARGS)
+    return svs_kwargs
+
+
+def report_rtf(model_dir: str, draft: bool, rtf: float):
+    """下書きモードと通常の合成の実時間係数をモデルごとに記録して、並べてログに出す。"""
+    path_json = join(enulib.cache.get_cache_dir(), 'rtf.json')
+    records = {}
+    if exists(path_json):
+        try:
+            with open(path_json, encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            records = {}
+    record = records.setdefault(abspath(model_dir), {})
+    record['draft' if draft else 'full'] = rtf
+    with open(path_json, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    logger.info(
+        'Real-time factor: draft %s / full %s',
+        f'{record["draft"]:.3f}' if 'draft' in record else '-',
+        f'{record["full"]:.3f}' if 'full' in record else '-',
+    )
 
 
 class ENUNU(SPSVS):
@@ -178,6 +293,9 @@ class ENUNU(SPSVS):
     Args:
         model_dir (str): NNSVSのモデルがあるフォルダ
         device (str): 'cuda' or 'cpu'
+        load_models (bool): False のときは設定ファイルだけを読み込む。
+            拡張機能でUSTやラベルを編集することはできるので、
+            その間に load_models() でモデルを読み込む。
     """
 
     def __init__(
@@ -185,6 +303,7 @@ class ENUNU(SPSVS):
         model_dir: str,
         device=None,
         verbose=0,
+        load_models=True,
         **kwargs,
     ):
         # automatic device select
@@ -195,8 +314,17 @@ class ENUNU(SPSVS):
                 else torch.device('cpu')
             )
         # initialize
-        super().__init__(model_dir, device=device, verbose=verbose, **kwargs)
-        # self.voice_dir = None
+        if load_models:
+            super().__init__(model_dir, device=device, verbose=verbose, **kwargs)
+        else:
+            self.config = OmegaConf.load(join(model_dir, 'config.yaml'))
+            self.logger = get_nnsvs_logger(verbose)
+            self.device = device
+        self.models_loaded = load_models
+        self._model_kwargs = {'verbose': verbose, **kwargs}
+        self.model_dir = abspath(model_dir)
+        # 音源フォルダ (None のときはカレントディレクトリ)
+        self.voice_dir = None
         # self.path_plugin = None
         self.path_ust = None
         self.path_table = None
@@ -210,6 +338,40 @@ class ENUNU(SPSVS):
         self.path_bap = None
         self.path_feedback = None
         # self.path_wav = None
+        # 合成するUSTのオブジェクトと、path_ust のファイルが古いかどうか
+        self.ust = None
+        self.ust_file_is_stale = False
+        # 同時に実行する拡張機能の最大数 (None のときはCPUのコア数)
+        self.max_extension_workers = None
+        # 拡張機能の実行結果のキャッシュを使うかどうか
+        self.use_extension_cache = False
+        # ENUNU_OPTIONAL = True を宣言している拡張機能を省略するかどうか (下書きモード)
+        self.skip_optional_extensions = False
+        # GPUで推論するときに半精度にするかどうか (下書きモード)
+        self.reduced_precision = False
+        # 直前の svs() の実時間係数と、タイミング補正後 (拡張機能での編集後) のラベル
+        self.last_rtf = None
+        self.last_timing_labels = None
+        # セグメントごとの後処理済みの音響特徴量をキャッシュするかどうか
+        self.use_feature_cache = False
+        self._model_fingerprint = None
+
+    def load_models(self):
+        """load_models=False で作ったエンジンにモデルを読み込む。
+
+        UST やラベルの編集と並行して別のスレッドで呼べるように、別のインスタンスに読み込んでから
+        属性をまとめて移す。
+        拡張機能の設定 (load_legacy_extensions で追加したものを含む) は引き継ぐ。
+        """
+        if self.models_loaded:
+            return
+        with enulib.tracing.span('load_model'):
+            loaded = SPSVS(self.model_dir, device=self.device, **self._model_kwargs)
+        state = vars(loaded)
+        if 'extensions' in self.config:
+            state['config']['extensions'] = self.config.extensions
+        self.__dict__.update(state)
+        self.models_loaded = True
 
     def set_paths(self, temp_dir, songname, path_feedback=None):
         """ファイル入出力のPATHを設定する"""
@@ -226,6 +388,21 @@ class ENUNU(SPSVS):
         if path_feedback is not None:
             self.path_feedback = path_feedback
 
+    def set_ust(self, ust: utaupy.ust.Ust, written: bool = False):
+        """合成するUSTのオブジェクトを設定する。
+
+        ファイルへの書き出しは、拡張機能がファイルを必要とするときまで行わない。
+        written=True のときは path_ust がすでにこのオブジェクトと同じ内容であるものとする。
+        """
+        self.ust = ust
+        self.ust_file_is_stale = not written
+
+    def write_ust_if_needed(self):
+        """path_ust のファイルが古い場合だけ、USTのオブジェクトを書き出す。"""
+        if self.ust is not None and self.ust_file_is_stale:
+            self.ust.write(self.path_ust)
+            self.ust_file_is_stale = False
+
     def get_extension_path_list(self, key) -> list[str]:
         """
         拡張機能のパスのリストを取得する。
@@ -244,15 +421,68 @@ class ENUNU(SPSVS):
         if extension_list == '':
             return []
         if isinstance(extension_list, str):
-            return [extension_list]
+            extension_list = [extension_list]
         if isinstance(extension_list, Iterable):
-            return list(extension_list)
+            # 音源フォルダが設定されている場合は、ここで %v などのエイリアスを置換しておく
+            # (複数の音源を同時に合成するとカレントディレクトリを音源フォルダにできないため)
+            if self.voice_dir is not None:
+                extension_list = [
+                    enulib.extensions.parse_extension_path(path, self.voice_dir)
+                    for path in extension_list
+                ]
+            return self.filter_optional_extensions(list(extension_list))
         # 空文字列でもNULLでもリストでも文字列でもない場合
         raise TypeError(
             'Extension path must be null or strings or list, '
             f'not {type(extension_list)} for {extension_list}'
         )
 
+    def filter_optional_extensions(self, extension_list: list[str]) -> list[str]:
+        """下書きモードのときは、省略可能な拡張機能を除く。"""
+        if not self.skip_optional_extensions:
+            return extension_list
+        result = []
+        for path_extension in extension_list:
+            if enulib.extensions.is_optional_extension(path_extension):
+                self.logger.info('Skipping optional extension in draft mode: %s', path_extension)
+            else:
+                result.append(path_extension)
+        return result
+
+    def inference_context(self):
+        """推論に使うコンテキストマネージャを返す。
+
+        reduced_precision が True でGPUを使う場合は、自動混合精度 (float16) で推論する。
+        CPUでは速くならないことが多いので通常の精度のままにする。
+        """
+        if self.reduced_precision and torch.device(self.device).type == 'cuda':
+            return torch.autocast(device_type='cuda', dtype=torch.float16)
+        return nullcontext()
+
+    def run_extensions(self, extension_list, runner, linked_artifacts=(), **kwargs):
+        """拡張機能を、読み書きするファイルが衝突しないものどうしは並列に実行する。
+
+        runner(path_extension, extension_io) で拡張機能を1つ実行する。
+        kwargs は拡張機能に渡すファイルのパスで、読み書きの衝突の判定に使う。
+        """
+        # 拡張機能にUSTファイルを渡す場合は、最新の内容を書き出しておく
+        if kwargs.get('ust') is not None:
+            self.write_ust_if_needed()
+        enulib.extensions.run_extensions(
+            extension_list,
+            runner,
+            artifacts=[key for key, value in kwargs.items() if value is not None],
+            linked_artifacts=linked_artifacts,
+            max_workers=self.max_extension_workers,
+        )
+
+    def call_extension(self, path_extension, extension_io, **kwargs):
+        """拡張機能を1つ実行する。キャッシュが有効な場合は前回の実行結果を使う。"""
+        if self.use_extension_cache:
+            enulib.extensions.run_extension_cached(path_extension, extension_io, **kwargs)
+        else:
+            enulib.extensions.run_extension(path_extension, **kwargs)
+
     def edit_ust(self, ust: utaupy.ust.Ust, key='ust_editor') -> utaupy.ust.Ust:
         """
         合成前に、外部ツールでUSTを編集する。
@@ -260,23 +490,31 @@ class ENUNU(SPSVS):
         """
         # UST加工ツールのパスを取得
         extension_list = self.get_extension_path_list(key)
+        if ust is not self.ust:
+            self.set_ust(ust)
         # UST加工ツールが指定されていない時はSkip
         if len(extension_list) == 0:
             return ust
 
-        # 念のためustファイルを最新データで上書きする
-        ust.write(self.path_ust)
-        # 外部ツールで ust を編集
-        for path_extension in extension_list:
-            self.logger.info('Editing UST with %s', path_extension)
-            enulib.extensions.run_extension(
-                path_extension,
-                ust=self.path_ust,
-                table=self.path_table,
-                feedback=self.path_feedback,
-            )
-        # 編集後のustファイルを読み取る
-        ust = utaupy.ust.load(self.path_ust)
+        with enulib.tracing.span('edit_ust', extensions=len(extension_list)):
+            kwargs = {
+                'ust': self.path_ust,
+                'table': self.path_table,
+                'feedback': self.path_feedback,
+            }
+
+            def run(path_extension, extension_io):
+                self.logger.info('Editing UST with %s', path_extension)
+                self.call_extension(path_extension, extension_io, **kwargs)
+
+            # 外部ツールで ust を編集
+            self.run_extensions(extension_list, run, **kwargs)
+            # 編集後のustファイルを読み取る (プラグイン用のファイルはその形式のまま読む)
+            if isinstance(ust, utaupy.utauplugin.UtauPlugin):
+                ust = utaupy.utauplugin.load(self.path_ust)
+            else:
+                ust = utaupy.ust.load(self.path_ust)
+            self.set_ust(ust, written=True)
         return ust
 
     def edit_score(self, score_labels, key='score_editor'):
@@ -288,17 +526,21 @@ class ENUNU(SPSVS):
         # LAB加工ツールが指定されていない時はSkip
         if len(extension_list) == 0:
             return score_labels
-        # 外部ツールでラベルを編集
-        for path_extension in extension_list:
-            self.logger.info('Editing LAB (score) with %s', path_extension)
-            enulib.extensions.run_extension(
-                path_extension,
-                ust=self.path_ust,
-                table=self.path_table,
-                feedback=self.path_feedback,
-                full_score=self.path_full_score,
-            )
-        score_labels = hts.load(self.path_full_score).round_()
+        with enulib.tracing.span('edit_score', extensions=len(extension_list)):
+            kwargs = {
+                'ust': self.path_ust,
+                'table': self.path_table,
+                'feedback': self.path_feedback,
+                'full_score': self.path_full_score,
+            }
+
+            def run(path_extension, extension_io):
+                self.logger.info('Editing LAB (score) with %s', path_extension)
+                self.call_extension(path_extension, extension_io, **kwargs)
+
+            # 外部ツールでラベルを編集
+            self.run_extensions(extension_list, run, **kwargs)
+            score_labels = hts.load(self.path_full_score).round_()
         return score_labels
 
     def edit_timing(self, duration_modified_labels, key='timing_editor'):
@@ -311,39 +553,51 @@ class ENUNU(SPSVS):
         if len(extension_list) == 0:
             return duration_modified_labels
 
-        # 複数ツールのすべてについて処理実施する
-        for path_extension in extension_list:
-            tqdm.write(f'Editing timing with {path_extension}')
-            # 変更前のモノラベルを読んでおく
-            with open(self.path_mono_timing, encoding='utf-8') as f:
-                str_mono_old = f.read()
-            enulib.extensions.run_extension(
-                path_extension,
-                ust=self.path_ust,
-                table=self.path_table,
-                feedback=self.path_feedback,
-                full_score=self.path_full_score,
-                mono_score=self.path_mono_score,
-                full_timing=self.path_full_timing,
-                mono_timing=self.path_mono_timing,
+        with enulib.tracing.span('edit_timing', extensions=len(extension_list)):
+            kwargs = {
+                'ust': self.path_ust,
+                'table': self.path_table,
+                'feedback': self.path_feedback,
+                'full_score': self.path_full_score,
+                'mono_score': self.path_mono_score,
+                'full_timing': self.path_full_timing,
+                'mono_timing': self.path_mono_timing,
+            }
+
+            def run(path_extension, extension_io):
+                tqdm.write(f'Editing timing with {path_extension}')
+                # タイミングを書き換えない拡張機能の場合はラベルの同期をしない
+                if not extension_io.writes & {'full_timing', 'mono_timing'}:
+                    self.call_extension(path_extension, extension_io, **kwargs)
+                    return
+                # 変更前のモノラベルを読んでおく
+                with open(self.path_mono_timing, encoding='utf-8') as f:
+                    str_mono_old = f.read()
+                self.call_extension(path_extension, extension_io, **kwargs)
+                # 変更後のモノラベルを読む
+                with open(self.path_mono_timing, encoding='utf-8') as f:
+                    str_mono_new = f.read()
+                # モノラベルの時刻が変わっていたらフルラベルに転写して、
+                # そうでなければフルラベルの時刻をモノラベルに転写する。
+                # NOTE: 歌詞は編集していないという前提で処理する。
+                if enulib.extensions.str_has_been_changed(str_mono_old, str_mono_new):
+                    enulib.extensions.merge_mono_time_change_to_full(
+                        self.path_mono_timing, self.path_full_timing
+                    )
+                else:
+                    enulib.extensions.merge_full_time_change_to_mono(
+                        self.path_full_timing, self.path_mono_timing
+                    )
+
+            # 複数ツールのすべてについて処理実施する
+            # モノラベルとフルラベルは同期されるので、
+            # 片方を書き換える場合は両方書き換えるとみなす。
+            self.run_extensions(
+                extension_list, run, linked_artifacts=[('full_timing', 'mono_timing')], **kwargs
             )
-            # 変更後のモノラベルを読む
-            with open(self.path_mono_timing, encoding='utf-8') as f:
-                str_mono_new = f.read()
-            # モノラベルの時刻が変わっていたらフルラベルに転写して、
-            # そうでなければフルラベルの時刻をモノラベルに転写する。
-            # NOTE: 歌詞は編集していないという前提で処理する。
-            if enulib.extensions.str_has_been_changed(str_mono_old, str_mono_new):
-                enulib.extensions.merge_mono_time_change_to_full(
-                    self.path_mono_timing, self.path_full_timing
-                )
-            else:
-                enulib.extensions.merge_full_time_change_to_mono(
-                    self.path_full_timing, self.path_mono_timing
-                )
 
-        # 編集後のfull_timing を読み取る
-        duration_modified_labels = hts.load(self.path_full_timing).round_()
+            # 編集後のfull_timing を読み取る
+            duration_modified_labels = hts.load(self.path_full_timing).round_()
         return duration_modified_labels
 
     def edit_acoustic(self, multistream_features, feature_type, key='acoustic_editor'):
@@ -374,59 +628,285 @@ class ENUNU(SPSVS):
             )
             return multistream_features
 
-        # ツールが指定されている場合はCSV書き出し
-        if feature_type == 'world':
-            mgc, lf0, vuv, bap = multistream_features
-            f0 = np.exp(lf0)
-            np.savetxt(self.path_mgc, mgc, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_f0, f0, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_vuv, vuv, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_bap, bap, fmt='%.16f', delimiter=',')
-        elif feature_type == 'melf0':
-            mgc, lf0, vuv = multistream_features
-            f0 = np.exp(lf0)
-            # CSV書き出し
-            np.savetxt(self.path_mgc, mgc, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_f0, f0, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_vuv, vuv, fmt='%.16f', delimiter=',')
-
-        # 複数ツールのすべてについて処理実施する
-        for path_extension in extension_list:
-            tqdm.write(f'Editing acoustic features with {path_extension}')
-            enulib.extensions.run_extension(
-                path_extension,
-                ust=self.path_ust,
-                table=self.path_table,
-                feedback=self.path_feedback,
-                full_score=self.path_full_score,
-                mono_score=self.path_mono_score,
-                full_timing=self.path_full_timing,
-                mono_timing=self.path_mono_timing,
-                mgc=self.path_mgc,
-                f0=self.path_f0,
-                vuv=self.path_vuv,
-                bap=self.path_bap,
-            )
+        with enulib.tracing.span(
+            'edit_acoustic', frames=len(multistream_features[0]), extensions=len(extension_list)
+        ):
+            # ツールが指定されている場合はCSV書き出し
+            if feature_type == 'world':
+                mgc, lf0, vuv, bap = multistream_features
+                f0 = np.exp(lf0)
+                np.savetxt(self.path_mgc, mgc, fmt='%.16f', delimiter=',')
+                np.savetxt(self.path_f0, f0, fmt='%.16f', delimiter=',')
+                np.savetxt(self.path_vuv, vuv, fmt='%.16f', delimiter=',')
+                np.savetxt(self.path_bap, bap, fmt='%.16f', delimiter=',')
+            elif feature_type == 'melf0':
+                mgc, lf0, vuv = multistream_features
+                f0 = np.exp(lf0)
+                # CSV書き出し
+                np.savetxt(self.path_mgc, mgc, fmt='%.16f', delimiter=',')
+                np.savetxt(self.path_f0, f0, fmt='%.16f', delimiter=',')
+                np.savetxt(self.path_vuv, vuv, fmt='%.16f', delimiter=',')
+
+            kwargs = {
+                'ust': self.path_ust,
+                'table': self.path_table,
+                'feedback': self.path_feedback,
+                'full_score': self.path_full_score,
+                'mono_score': self.path_mono_score,
+                'full_timing': self.path_full_timing,
+                'mono_timing': self.path_mono_timing,
+                'mgc': self.path_mgc,
+                'f0': self.path_f0,
+                'vuv': self.path_vuv,
+                'bap': self.path_bap,
+            }
+
+            def run(path_extension, extension_io):
+                tqdm.write(f'Editing acoustic features with {path_extension}')
+                self.call_extension(path_extension, extension_io, **kwargs)
+
+            # 複数ツールのすべてについて処理実施する
+            self.run_extensions(extension_list, run, **kwargs)
 
-        # 編集が終わったらCSV読み取り
-        if feature_type == 'world':
-            mgc = np.loadtxt(self.path_mgc, delimiter=',', dtype=np.float64)
-            lf0 = np.log(np.loadtxt(self.path_f0, delimiter=',', dtype=np.float64)).reshape(-1, 1)
-            vuv = np.loadtxt(self.path_vuv, delimiter=',', dtype=np.float64).reshape(-1, 1)
-            bap = np.loadtxt(self.path_bap, delimiter=',', dtype=np.float64)
-            # 統合
-            multistream_features = (mgc, lf0, vuv, bap)
-        elif feature_type == 'melf0':
             # 編集が終わったらCSV読み取り
-            mgc = np.loadtxt(self.path_mgc, delimiter=',', dtype=np.float64)
-            lf0 = np.log(np.loadtxt(self.path_f0, delimiter=',', dtype=np.float64)).reshape(-1, 1)
-            vuv = np.loadtxt(self.path_vuv, delimiter=',', dtype=np.float64).reshape(-1, 1)
-            # 統合
-            multistream_features = (mgc, lf0, vuv)
-        else:
-            raise Exception('Unexpected Error')
+            if feature_type == 'world':
+                mgc = np.loadtxt(self.path_mgc, delimiter=',', dtype=np.float64)
+                lf0 = np.log(
+                    np.loadtxt(self.path_f0, delimiter=',', dtype=np.float64)
+                ).reshape(-1, 1)
+                vuv = np.loadtxt(self.path_vuv, delimiter=',', dtype=np.float64).reshape(-1, 1)
+                bap = np.loadtxt(self.path_bap, delimiter=',', dtype=np.float64)
+                # 統合
+                multistream_features = (mgc, lf0, vuv, bap)
+            elif feature_type == 'melf0':
+                # 編集が終わったらCSV読み取り
+                mgc = np.loadtxt(self.path_mgc, delimiter=',', dtype=np.float64)
+                lf0 = np.log(
+                    np.loadtxt(self.path_f0, delimiter=',', dtype=np.float64)
+                ).reshape(-1, 1)
+                vuv = np.loadtxt(self.path_vuv, delimiter=',', dtype=np.float64).reshape(-1, 1)
+                # 統合
+                multistream_features = (mgc, lf0, vuv)
+            else:
+                raise Exception('Unexpected Error')
         return multistream_features
 
+    def predict_timing(self, labels):
+        """音素の発声タイミングを推定する。処理時間を計測するためにオーバーライドしている。"""
+        with enulib.tracing.span('predict_timing', phonemes=len(labels)):
+            with self.inference_context():
+                return super().predict_timing(labels)
+
+    def predict_acoustic(self, duration_modified_labels, f0_shift_in_cent=0):
+        """音響特徴量を推定する。処理時間を計測するためにオーバーライドしている。"""
+        with enulib.tracing.span('predict_acoustic') as trace_args:
+            with self.inference_context():
+                acoustic_features = super().predict_acoustic(
+                    duration_modified_labels, f0_shift_in_cent=f0_shift_in_cent
+                )
+            trace_args['frames'] = len(acoustic_features)
+        return acoustic_features
+
+    def predict_waveform(self, multistream_features, vocoder_type='world', vuv_threshold=0.5):
+        """音響特徴量から波形を生成する。処理時間を計測するためにオーバーライドしている。"""
+        with enulib.tracing.span(
+            'predict_waveform', frames=len(multistream_features[0]), vocoder_type=vocoder_type
+        ) as trace_args:
+            with self.inference_context():
+                wav = super().predict_waveform(
+                    multistream_features, vocoder_type=vocoder_type, vuv_threshold=vuv_threshold
+                )
+            trace_args['samples'] = len(wav)
+        return wav
+
+    def get_model_fingerprint(self) -> str:
+        """モデルフォルダ内のファイルの名前とサイズと更新時刻から、モデルを識別する文字列を作る。"""
+        if self._model_fingerprint is None:
+            entries = []
+            for name in sorted(listdir(self.model_dir)):
+                path = join(self.model_dir, name)
+                if isfile(path):
+                    entries.append(f'{name}:{getsize(path)}:{getmtime(path)}')
+            self._model_fingerprint = enulib.cache.hash_strings(*entries)
+        return self._model_fingerprint
+
+    def get_feature_cache_key(self, labels, **params) -> str:
+        """セグメントの後処理済み音響特徴量のキャッシュのキーを返す。
+
+        タイミング補正後のラベルと、音響モデルと後処理の設定が同じなら同じキーになる。
+        """
+        return enulib.cache.hash_strings(
+            self.get_model_fingerprint(),
+            str(labels),
+            str(labels.frame_shift),
+            *(f'{key}={value!r}' for key, value in sorted(params.items())),
+        )
+
+    def feature_cache_exists(self, key: str) -> bool:
+        """後処理済みの音響特徴量のキャッシュがあるかどうかを返す。"""
+        return exists(join(enulib.cache.get_cache_dir('features'), f'{key}.npz'))
+
+    def load_cached_features(self, key: str | None):
+        """キャッシュから後処理済みの音響特徴量を読み取る。なければ None を返す。"""
+        if key is None:
+            return None
+        path = join(enulib.cache.get_cache_dir('features'), f'{key}.npz')
+        if not exists(path):
+            return None
+        try:
+            with np.load(path) as npz:
+                return tuple(npz[f'arr_{idx}'] for idx in range(len(npz.files)))
+        except (OSError, ValueError):
+            self.logger.warning('Failed to load cached features: %s', path)
+            return None
+
+    def save_cached_features(self, key: str | None, multistream_features):
+        """後処理済みの音響特徴量をキャッシュに保存する。"""
+        if key is None or not all(isinstance(x, np.ndarray) for x in multistream_features):
+            return
+        cache_dir = enulib.cache.get_cache_dir('features')
+        # 読み込み途中のファイルを上書きしないように、一時ファイルに書いてから置き換える
+        path_temp = join(cache_dir, f'{key}.npz.tmp')
+        with open(path_temp, 'wb') as f:
+            np.savez(f, *multistream_features)
+        replace(path_temp, join(cache_dir, f'{key}.npz'))
+        enulib.cache.prune(cache_dir, FEATURE_CACHE_MAX_ENTRIES)
+
+    def predict_acoustic_batch(
+        self,
+        segments: list,
+        f0_shift_in_cent=0,
+        chunk_frames=None,
+        chunk_overlap_frames=CHUNK_OVERLAP_FRAMES,
+        cancel_event=None,
+    ) -> list:
+        """複数のセグメントの音響特徴量を、音響モデルのミニバッチにまとめて推定する。
+
+        セグメントごとのスレッドで predict_acoustic_chunked を呼び、
+        音響モデルの推論だけを enulib.batching.BatchedModel でまとめる。
+        cancel_event は各セグメントの推論を始める前に確認する。
+        まとめて推論している途中ではキャンセルを確認しない。
+        """
+        if not isinstance(self.acoustic_model, enulib.batching.BatchedModel):
+            self.acoustic_model = enulib.batching.BatchedModel(
+                self.acoustic_model, name='acoustic_model'
+            )
+        batched_model = self.acoustic_model
+        if len(segments) == 1 or not batched_model.enabled:
+            features = []
+            for segment in segments:
+                enulib.render_queue.check_cancelled(cancel_event)
+                features.append(
+                    self.predict_acoustic_chunked(
+                        segment, f0_shift_in_cent, chunk_frames, chunk_overlap_frames
+                    )
+                )
+            return features
+
+        def run(segment):
+            try:
+                enulib.render_queue.check_cancelled(cancel_event)
+                return self.predict_acoustic_chunked(
+                    segment, f0_shift_in_cent, chunk_frames, chunk_overlap_frames
+                )
+            finally:
+                batched_model.remove_worker()
+
+        with enulib.tracing.span('predict_acoustic_batch', segments=len(segments)):
+            batched_model.add_workers(len(segments))
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                return list(executor.map(run, segments))
+
+    def slice_labels(self, labels, first: int, last: int):
+        """ラベルの first 番目から last 番目の直前までの音素を取り出す。"""
+        sliced = hts.HTSLabelFile(frame_shift=labels.frame_shift)
+        for start, end, context in zip(
+            labels.start_times[first:last],
+            labels.end_times[first:last],
+            labels.contexts[first:last],
+        ):
+            sliced.append((start, end, context), strict=False)
+        return sliced
+
+    def predict_acoustic_chunked(
+        self,
+        duration_modified_labels,
+        f0_shift_in_cent=0,
+        chunk_frames=None,
+        chunk_overlap_frames=CHUNK_OVERLAP_FRAMES,
+    ):
+        """長いセグメントを音素境界で分割して音響特徴量を推定する。
+
+        チャンクの前後には chunk_overlap_frames 以上の文脈を付けて推論し、
+        境界で特徴量をクロスフェードする。誤差の目安は enulib.chunking を参照。
+        """
+        if chunk_frames is None:
+            return self.predict_acoustic(duration_modified_labels, f0_shift_in_cent)
+        frame_shift = duration_modified_labels.frame_shift
+        phoneme_frames = [
+            int((end - start) / frame_shift)
+            for start, end in zip(
+                duration_modified_labels.start_times, duration_modified_labels.end_times
+            )
+        ]
+        chunks = enulib.chunking.plan_label_chunks(
+            phoneme_frames, chunk_frames, chunk_overlap_frames
+        )
+        if len(chunks) == 1:
+            return self.predict_acoustic(duration_modified_labels, f0_shift_in_cent)
+
+        self.logger.info('Splitting acoustic inference into %s chunks', len(chunks))
+        pieces = []
+        for chunk in chunks:
+            features = self.predict_acoustic(
+                self.slice_labels(duration_modified_labels, chunk.first, chunk.last),
+                f0_shift_in_cent,
+            )
+            # フレーム数の計算がモデル側と合わない場合は分割せずに推論する
+            if len(features) != chunk.end - chunk.start:
+                self.logger.warning(
+                    'Unexpected number of frames in a chunk (%s != %s). '
+                    'Falling back to unchunked inference.',
+                    len(features),
+                    chunk.end - chunk.start,
+                )
+                return self.predict_acoustic(duration_modified_labels, f0_shift_in_cent)
+            pieces.append(features)
+        return enulib.chunking.crossfade_chunks(pieces, chunks, chunk_overlap_frames // 2)
+
+    def predict_waveform_chunked(
+        self,
+        multistream_features,
+        vocoder_type='world',
+        vuv_threshold=0.5,
+        chunk_frames=None,
+        chunk_overlap_frames=CHUNK_OVERLAP_FRAMES,
+    ):
+        """長いセグメントをフレーム単位で分割して波形を生成する。
+
+        チャンクの前後には chunk_overlap_frames の文脈を付けて生成し、
+        境界で波形をクロスフェードする。
+        """
+        n_frames = len(multistream_features[0])
+        if chunk_frames is None or n_frames <= chunk_frames:
+            return self.predict_waveform(
+                multistream_features, vocoder_type=vocoder_type, vuv_threshold=vuv_threshold
+            )
+        chunks = enulib.chunking.plan_frame_chunks(n_frames, chunk_frames, chunk_overlap_frames)
+        self.logger.info('Splitting vocoder inference into %s chunks', len(chunks))
+        hop_size = int(self.sample_rate * self.config.frame_period / 1000)
+        pieces = [
+            self.predict_waveform(
+                tuple(stream[chunk.start : chunk.end] for stream in multistream_features),
+                vocoder_type=vocoder_type,
+                vuv_threshold=vuv_threshold,
+            )
+            for chunk in chunks
+        ]
+        return enulib.chunking.crossfade_chunks(
+            pieces, chunks, chunk_overlap_frames // 2, scale=hop_size
+        )
+
     def svs(
         self,
         labels,
@@ -444,6 +924,15 @@ class ENUNU(SPSVS):
         loudness_norm=False,
         target_loudness=-20,
         segmented_synthesis=False,
+        chunk_frames=None,
+        chunk_overlap_frames=CHUNK_OVERLAP_FRAMES,
+        on_segment=None,
+        cancel_event=None,
+        feature_store=None,
+        feature_store_post_filters=(),
+        batch_size=1,
+        pipeline=False,
+        memmap_min_sec=OUTPUT_MEMMAP_MIN_SEC,
         **kwargs,
     ):
         """Synthesize waveform from HTS labels.
@@ -466,6 +955,31 @@ class ENUNU(SPSVS):
             loudness_norm (bool): Whether to normalize the waveform by loudness.
             target_loudness (float): Target loudness in dB.
             segmneted_synthesis (bool): Whether to use segmented synthesis.
+            chunk_frames (int): Split segments longer than this number of frames into
+                overlapping chunks for the acoustic model and vocoder. ``None`` disables it.
+            chunk_overlap_frames (int): Number of context frames added to each side of
+                a chunk. Chunks are crossfaded over half of this length.
+            on_segment (callable): Called with the post-processed waveform of each segment
+                as soon as it is synthesized. Cannot be used with peak or loudness
+                normalization because they depend on the whole waveform.
+            cancel_event (threading.Event): If set, synthesis stops with
+                ``enulib.render_queue.RenderCancelled``. It is checked before each stage
+                (acoustic prediction, acoustic editing and vocoding) of each segment, so
+                a running stage finishes first. When ``batch_size`` > 1, acoustic
+                prediction of up to ``batch_size`` segments runs as one mini-batch and
+                is not interrupted.
+            feature_store (str): Path of an HDF5 file to save the acoustic features of
+                each segment to. It can be re-vocoded with ``enulib.revocode``.
+            feature_store_post_filters (Iterable[str]): Other post-filter types whose
+                spectral features are also saved to ``feature_store``.
+            batch_size (int): Number of segments whose acoustic features are predicted
+                in one mini-batch. Results match the unbatched path; batching is
+                disabled automatically for models that are affected by padding.
+            pipeline (bool): Run acoustic prediction, acoustic editing and vocoding of
+                different segments concurrently in per-stage threads connected by bounded
+                queues. Segments are still processed in order by every stage.
+            memmap_min_sec (float): If the waveform is estimated to be longer than this,
+                the output buffer is memory-mapped to a temporary file. ``None`` disables it.
         """
         start_time = time.time()
         vocoder_type = vocoder_type.lower()
@@ -473,8 +987,11 @@ class ENUNU(SPSVS):
             raise ValueError(f'Unknown vocoder type: {vocoder_type}')
         if post_filter_type not in ['merlin', 'nnsvs', 'gv', 'none']:
             raise ValueError(f'Unknown post-filter type: {post_filter_type}')
+        if on_segment is not None and (peak_norm or loudness_norm):
+            raise ValueError('on_segment cannot be used with peak_norm or loudness_norm')
 
         # Predict timinigs
+        enulib.render_queue.check_cancelled(cancel_event)
         duration_modified_labels = self.predict_timing(labels)
 
         # NOTE: ここにタイミング補正のための割り込み処理を追加-----------
@@ -489,6 +1006,7 @@ class ENUNU(SPSVS):
             f.write(str(duration_modified_labels))
         # 外部で加工した結果でタイミング情報を置換
         duration_modified_labels = self.edit_timing(duration_modified_labels)
+        self.last_timing_labels = duration_modified_labels
         # ---------------------------------------------------------------
 
         # NOTE: segmented synthesis is not well tested. There MUST be better ways
@@ -509,85 +1027,271 @@ class ENUNU(SPSVS):
 
         # Run acoustic model and vocoder
         hts_frame_shift = int(self.config.frame_period * 1e4)
-        wavs = []
+        # 曲全体の波形を書き込むバッファを、ラベルのフレーム数から見積もった長さで確保しておく
+        n_samples = enulib.wav_buffer.estimate_n_samples(
+            duration_modified_labels_segs,
+            frame_shift=hts_frame_shift,
+            hop_length=int(self.sample_rate * self.config.frame_period / 1000),
+        )
+        use_memmap = memmap_min_sec is not None and n_samples > memmap_min_sec * self.sample_rate
+        if use_memmap:
+            self.logger.info('Using a memory-mapped output buffer (%s samples)', n_samples)
+        output = enulib.wav_buffer.WaveformBuffer(n_samples, use_memmap=use_memmap)
+        store_writer = None
+        if feature_store is not None:
+            # h5py は特徴量を保存するときだけ必要なので、ここでimportする
+            from enulib.feature_store import FeatureStoreWriter  # noqa: PLC0415
+
+            store_writer = FeatureStoreWriter(
+                feature_store,
+                self.feature_type,
+                sample_rate=self.sample_rate,
+                frame_period=self.config.frame_period,
+                use_world_codec=bool(self.config.get('use_world_codec', False)),
+                post_filter_type=post_filter_type,
+                vocoder_type=vocoder_type,
+                vuv_threshold=vuv_threshold,
+                model_dir=self.model_dir,
+            )
         self.logger.info('Number of segments: %s', len(duration_modified_labels_segs))
-        with logging_redirect_tqdm(loggers=[self.logger]):
-            for duration_modified_labels_seg in tqdm(
-                duration_modified_labels_segs,
-                colour='blue',
-                desc='[segment]',
-                total=len(duration_modified_labels_segs),
-            ):
-                duration_modified_labels_seg.frame_shift = hts_frame_shift
-
-                # Predict acoustic features
-                # NOTE: if non-zero pre_f0_shift_in_cent is specified, the input pitch
-                # will be shifted before running the acoustic model
-                acoustic_features = self.predict_acoustic(
+        for duration_modified_labels_seg in duration_modified_labels_segs:
+            duration_modified_labels_seg.frame_shift = hts_frame_shift
+        feature_keys = [None] * len(duration_modified_labels_segs)
+        if self.use_feature_cache:
+            feature_keys = [
+                self.get_feature_cache_key(
                     duration_modified_labels_seg,
-                    f0_shift_in_cent=style_shift * 100,
-                )
-
-                # Post-processing for acoustic features
-                # NOTE: if non-zero post_f0_shift_in_cent is specified, the output pitch
-                # will be shifted as a part of post-processing
-                multistream_features = self.postprocess_acoustic(
-                    acoustic_features=acoustic_features,
-                    duration_modified_labels=duration_modified_labels_seg,
+                    style_shift=style_shift,
+                    post_filter_type=post_filter_type,
                     trajectory_smoothing=trajectory_smoothing,
                     trajectory_smoothing_cutoff=trajectory_smoothing_cutoff,
                     trajectory_smoothing_cutoff_f0=trajectory_smoothing_cutoff_f0,
                     force_fix_vuv=force_fix_vuv,
                     fill_silence_to_rest=fill_silence_to_rest,
-                    f0_shift_in_cent=-style_shift * 100,
+                    chunk_frames=chunk_frames,
+                    chunk_overlap_frames=chunk_overlap_frames,
+                    reduced_precision=self.reduced_precision,
                 )
-
+                for duration_modified_labels_seg in duration_modified_labels_segs
+            ]
+        # ほかのポストフィルタの特徴量も保存する場合は、キャッシュにはそれがないので毎回推定する
+        store_variant_types = [
+            variant_post_filter
+            for variant_post_filter in feature_store_post_filters
+            if store_writer is not None and variant_post_filter != post_filter_type
+        ]
+        read_feature_cache = len(store_variant_types) == 0
+        # ミニバッチでまとめて推定した、まだ使っていない音響特徴量 (セグメント番号 → 特徴量)
+        batched_acoustic_features = {}
+
+        def acoustic_stage(idx):
+            """セグメントの後処理済みの音響特徴量を求める。"""
+            # キャンセルされていたら次のセグメントに進まずに止める
+            enulib.render_queue.check_cancelled(cancel_event)
+            duration_modified_labels_seg = duration_modified_labels_segs[idx]
+            with enulib.tracing.span(
+                'acoustic_stage', index=idx, phonemes=len(duration_modified_labels_seg)
+            ):
+                # タイミングと音響モデルの設定が前回と同じセグメントは、
+                # キャッシュした後処理済みの音響特徴量を使って f0 の編集とボコーダだけやり直す
+                feature_key = feature_keys[idx]
+                multistream_features = (
+                    self.load_cached_features(feature_key) if read_feature_cache else None
+                )
+                store_variants = {}
+                if multistream_features is not None:
+                    self.logger.info('Using cached acoustic features for segment %s', idx)
+                    return idx, multistream_features, store_variants
+                # Predict acoustic features
+                # NOTE: if non-zero pre_f0_shift_in_cent is specified, the input pitch
+                # will be shifted before running the acoustic model
+                if batch_size > 1 and idx not in batched_acoustic_features:
+                    # キャッシュにないセグメントを batch_size 個まとめて推定する
+                    batch_indices = [
+                        i
+                        for i in range(idx, len(duration_modified_labels_segs))
+                        if i == idx
+                        or feature_keys[i] is None
+                        or not read_feature_cache
+                        or not self.feature_cache_exists(feature_keys[i])
+                    ][:batch_size]
+                    batched_acoustic_features.update(
+                        zip(
+                            batch_indices,
+                            self.predict_acoustic_batch(
+                                [duration_modified_labels_segs[i] for i in batch_indices],
+                                f0_shift_in_cent=style_shift * 100,
+                                chunk_frames=chunk_frames,
+                                chunk_overlap_frames=chunk_overlap_frames,
+                                cancel_event=cancel_event,
+                            ),
+                        )
+                    )
+                if idx in batched_acoustic_features:
+                    acoustic_features = batched_acoustic_features.pop(idx)
+                else:
+                    acoustic_features = self.predict_acoustic_chunked(
+                        duration_modified_labels_seg,
+                        f0_shift_in_cent=style_shift * 100,
+                        chunk_frames=chunk_frames,
+                        chunk_overlap_frames=chunk_overlap_frames,
+                    )
+
+                enulib.render_queue.check_cancelled(cancel_event)
+                # Post-processing for acoustic features
+                # NOTE: if non-zero post_f0_shift_in_cent is specified, the output pitch
+                # will be shifted as a part of post-processing
+                postprocess_kwargs = {
+                    'acoustic_features': acoustic_features,
+                    'duration_modified_labels': duration_modified_labels_seg,
+                    'trajectory_smoothing': trajectory_smoothing,
+                    'trajectory_smoothing_cutoff': trajectory_smoothing_cutoff,
+                    'trajectory_smoothing_cutoff_f0': trajectory_smoothing_cutoff_f0,
+                    'force_fix_vuv': force_fix_vuv,
+                    'fill_silence_to_rest': fill_silence_to_rest,
+                    'f0_shift_in_cent': -style_shift * 100,
+                }
+                with enulib.tracing.span('postprocess_acoustic', frames=len(acoustic_features)):
+                    multistream_features = self.postprocess_acoustic(
+                        post_filter_type=post_filter_type, **postprocess_kwargs
+                    )
+                # ほかのポストフィルタを使った場合の特徴量も保存する
+                for variant_post_filter in store_variant_types:
+                    store_variants[variant_post_filter] = self.postprocess_acoustic(
+                        post_filter_type=variant_post_filter, **postprocess_kwargs
+                    )
+                # 後処理前の特徴量はもう使わないので解放する
+                del acoustic_features, postprocess_kwargs
+                self.save_cached_features(feature_key, multistream_features)
+            return idx, multistream_features, store_variants
+
+        def edit_stage(args):
+            """拡張機能で音響特徴量を編集する。(一時ファイルを共有するので1セグメントずつ)"""
+            idx, multistream_features, store_variants = args
+            del args
+            enulib.render_queue.check_cancelled(cancel_event)
+            with enulib.tracing.span('edit_stage', index=idx):
                 # NOTE: ここにピッチ補正のための割り込み処理を追加-----------
                 multistream_features = self.edit_acoustic(
                     multistream_features, feature_type=self.feature_type
                 )
-
-                # Generate waveform by vocoder
-                wav = self.predict_waveform(
-                    multistream_features=multistream_features,
+                if store_writer is not None:
+                    store_writer.add_segment(multistream_features, store_variants)
+            return idx, multistream_features
+
+        def vocode_stage(args):
+            """ボコーダで波形を生成する。"""
+            idx, multistream_features = args
+            del args
+            # Generate waveform by vocoder
+            enulib.render_queue.check_cancelled(cancel_event)
+            with enulib.tracing.span('vocode_stage', index=idx):
+                wav = self.predict_waveform_chunked(
+                    multistream_features,
                     vocoder_type=vocoder_type,
                     vuv_threshold=vuv_threshold,
+                    chunk_frames=chunk_frames,
+                    chunk_overlap_frames=chunk_overlap_frames,
                 )
+                # 波形を生成したら音響特徴量はすぐに解放する
+                del multistream_features
+                # float64 で返ってくる波形を、曲全体の float32 のバッファに直接書き込む
+                wav = output.append(wav)
+                # 合成が終わったセグメントから順に書き出す
+                if on_segment is not None:
+                    on_segment(self.postprocess_waveform(wav, dtype=dtype))
+            progress.update(1)
+
+        # 音響モデル、音響特徴量の編集、ボコーダを段ごとのスレッドで流れ作業にして、
+        # セグメント N をボコーダで合成している間にセグメント N+1 の音響特徴量を推定する
+        # キャンセルされたときや途中の段で失敗したときも、特徴量のファイルは閉じておく
+        try:
+            with (
+                logging_redirect_tqdm(loggers=[self.logger]),
+                tqdm(
+                    total=len(duration_modified_labels_segs), colour='blue', desc='[segment]'
+                ) as progress,
+            ):
+                enulib.pipeline.run_pipeline(
+                    range(len(duration_modified_labels_segs)),
+                    [acoustic_stage, edit_stage, vocode_stage],
+                    queue_size=PIPELINE_QUEUE_SIZE,
+                    threaded=pipeline,
+                )
+        finally:
+            if store_writer is not None:
+                store_writer.close()
 
-                wavs.append(wav)
-
-        # Concatenate segmented waveforms
-        wav = np.concatenate(wavs, axis=0).reshape(-1)
+        # セグメントの波形はバッファ上で既につながっている
+        wav = output.wav
 
         # Post-processing for the output waveform
-        wav = self.postprocess_waveform(
-            wav,
-            dtype=dtype,
-            peak_norm=peak_norm,
-            loudness_norm=loudness_norm,
-            target_loudness=target_loudness,
-        )
+        with enulib.tracing.span('postprocess_waveform', samples=len(wav)):
+            postprocess_kwargs = {
+                'peak_norm': peak_norm,
+                'loudness_norm': loudness_norm,
+                'target_loudness': target_loudness,
+            }
+            if dtype is not None and np.dtype(dtype) == np.float32:
+                # float32 で出力する場合は、
+                # 後処理した波形をバッファに書き戻して型変換のコピーを省く
+                wav[:] = self.postprocess_waveform(wav, dtype=None, **postprocess_kwargs)
+            else:
+                wav = self.postprocess_waveform(wav, dtype=dtype, **postprocess_kwargs)
         self.logger.info(f'Total time: {time.time() - start_time:.3f} sec')
         RT = (time.time() - start_time) / (len(wav) / self.sample_rate)
         self.logger.info(f'Total real-time factor: {RT:.3f}')
+        self.last_rtf = RT
         return wav, self.sample_rate
 
 
-def main(path_plugin: str, path_wav: str | None = None, play_wav: bool = False) -> str:
+@enulib.tracing.traced('main')
+def main(
+    path_plugin: str,
+    path_wav: str | None = None,
+    play_wav: bool = False,
+    pcm_out: str | None = None,
+    pcm_format: str = 'float32',
+    keep_temp: bool = KEEP_TEMP_FILES,
+    region: bool = REGION_RENDER,
+    draft: bool = DRAFT_MODE,
+    feature_store: str | None = None,
+    feature_store_post_filters: Iterable[str] = (),
+) -> str:
     """
     UTAUプラグインのファイルから音声を生成する
+
+    pcm_out を指定すると、合成が終わったセグメントから順に生のPCMを書き出す。
+    ('-' のときは標準出力) このとき path_wav を指定しなければWAVファイルは保存しない。
+    keep_temp が True のときは、RAM上に置いた中間ファイルを {songname}_enutemp に保存する。
+    region が True のときは、前回の合成結果から楽譜が変わった部分だけを合成し直す。
+    draft が True のときは、音質を下げて速く合成する。(下書きモード)
+    feature_store を指定すると、合成に使った音響特徴量をHDF5ファイルに保存する。
+    (enulib.revocode でボコーダだけを使って合成し直せる)
     """
     # 引用符を削除
     path_plugin = path_plugin.strip('"\'')
     if path_wav is not None:
         path_wav = path_wav.strip('"\'')
+    # 標準出力にPCMを書き出す場合は、ログなどが混ざらないように最初に標準出力を取り上げる。
+    # ヘッダーはサンプリング周波数が分かってから PcmStreamWriter が書き出す。
+    if pcm_out == '-':
+        enulib.pcm_stream.take_stdout()
+    # 作業フォルダを音源フォルダに変更する前に、相対パスを絶対パスにしておく
+    elif pcm_out is not None:
+        pcm_out = abspath(pcm_out)
+    if feature_store is not None:
+        feature_store = abspath(feature_store.strip('"\''))
 
     # USTの形式のファイルでなければエラー
     if not (path_plugin.endswith('.tmp') or path_plugin.endswith('.ust')):
         raise ValueError('Input file must be UST or TMP(plugin).')
     # UTAUの一時ファイルに書いてある設定を読み取る
     logger.info('reading settings in TMP')
-    path_ust, voice_dir, _ = get_project_path(path_plugin)
+    # プラグイン用の一時ファイルはここで1回だけ読み取って、以降はこのオブジェクトを使う
+    with enulib.tracing.span('load_plugin'):
+        plugin = utaupy.utauplugin.load(path_plugin)
+    path_ust, voice_dir, _ = get_project_path(plugin)
 
     # 日付時刻を取得
     str_now = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -595,8 +1299,9 @@ def main(path_plugin: str, path_wav: str | None = None, play_wav: bool = False)
     # wav出力パスが指定されていない(プラグインとして実行している)場合
     if path_wav is None:
         # tkinterの親Windowを表示させないようにする
-        root = tkinter.Tk()
-        root.withdraw()
+        if pcm_out is None:
+            root = tkinter.Tk()
+            root.withdraw()
         # 入出力パスを設定する
         if path_ust is not None:
             songname = splitext(basename(path_ust))[0]
@@ -617,115 +1322,364 @@ def main(path_plugin: str, path_wav: str | None = None, play_wav: bool = False)
         path_wav = abspath(path_wav)
 
     ## NNSVS / ENUNU モデルを探す
-    # model フォルダ
-    if packed_model_exists(join(voice_dir, 'model')):
-        model_dir = join(voice_dir, 'model')
-    # 直置き
-    elif packed_model_exists(voice_dir):
-        model_dir = voice_dir
-    # ENUNU<1.0.0 向けのディレクトリ構成
-    elif exists(join(voice_dir, 'enuconfig.yaml')):
-        logger.info('Regacy ENUNU model is selected. Converting it for the compatibility...')
-        model_dir = join(voice_dir, 'model')
-        makedirs(model_dir, exist_ok=True)
-        print('----------------------------------------------')
-        wrapped_enunu2nnsvs(voice_dir, model_dir)
-        print('\n----------------------------------------------')
-        logger.info('Converted.')
-
-    # configファイルがあるか調べて、なければ例外処理
-    else:
-        raise Exception('UTAU音源選択でENUNU用モデルを指定してください。')
-    assert model_dir
+    model_dir = find_model_dir(voice_dir)
 
     # カレントディレクトリを音源フォルダに変更する
     chdir(voice_dir)
 
     # 一時フォルダを作成する
-    makedirs(temp_dir, exist_ok=True)
+    # (RAM上に作った場合は終了時に削除し、失敗した場合は中間ファイルを保存する)
+    workspace = enulib.workspace.Workspace(temp_dir, in_ram=RAM_WORKSPACE, keep=keep_temp)
+    with workspace as temp_dir:
+        # 設定ファイルだけを読み込んだエンジンを作る。モデルはあとで別スレッドで読み込む。
+        engine = ENUNU(model_dir, load_models=False)
+        engine.set_paths(temp_dir=temp_dir, songname=songname, path_feedback=path_plugin)
+        engine.use_extension_cache = EXTENSION_CACHE
+        engine.use_feature_cache = FEATURE_CACHE
+        # 下書きモードにする
+        if str(plugin.setting.get('EnunuDraft', '')).lower() in ('1', 'true', 'yes'):
+            draft = True
+        if draft:
+            logger.info('Draft mode is enabled.')
+        engine.skip_optional_extensions = draft
+        engine.reduced_precision = draft
+
+        # NOTE: 後方互換のため
+        load_legacy_extensions(engine, voice_dir)
+
+        # モデルを読み取る。UST の編集やラベルへの変換と並行するので、待つのは合成の直前にする。
+        # 読み込みに失敗した場合は、前処理の区切りごとに確かめて早めにエラーにする。
+        logger.info('Loading models')
+        model_loading = load_models_in_background(engine)
+        try:
+            # Tableファイルを一時フォルダに複製
+            logger.info(f'{datetime.now()} : copying Table')
+            path_table = enulib.table.find_table(model_dir)
+            shutil.copy2(path_table, engine.path_table)
+            # 解析済みの変換テーブルを読み取る
+            table = enulib.table.load_table(path_table)
+
+            # USTを編集する
+            # 一時フォルダへのUSTの書き出しは、拡張機能がファイルを必要とするときだけ行う
+            plugin = engine.edit_ust(plugin)
+            raise_if_failed(model_loading)
+
+            # UST → LAB の変換をする
+            logging.info('Converting UST -> LAB')
+            with enulib.tracing.span('utauplugin2score'):
+                enulib.utauplugin2score.plugin2score(
+                    plugin,
+                    table,
+                    engine.path_full_score,
+                    strict_sinsy_style=False,
+                )
 
-    # モデルを読み取る
-    logger.info('Loading models')
-    engine = ENUNU(model_dir)
-    engine.set_paths(temp_dir=temp_dir, songname=songname, path_feedback=path_plugin)
+            # フルラベルファイルを読み取る
+            logging.info('Loading LAB')
+            with enulib.tracing.span('load_labels'):
+                labels = hts.load(engine.path_full_score)
+
+            # LABファイルを編集する。
+            labels = engine.edit_score(labels)
+            raise_if_failed(model_loading)
+        except BaseException:
+            # 前処理で失敗した場合は、モデルの読み込みを待たずに抜ける。
+            # 読み込み中のスレッドは daemon なので、インタプリタの終了を妨げない。
+            if not model_loading.cancel() and not model_loading.done():
+                logger.info('Model loading is abandoned because preprocessing failed.')
+            raise
+
+        # モデルの読み込みが終わるのを待つ
+        with enulib.tracing.span('wait_model'):
+            model_loading.result()
+
+        # 音声を生成する
+        # NOTE: engine.svs を分解してタイミング補正を行えるように改造中。
+        logging.info('Generating WAV')
+        pcm_writer = None
+        on_segment = None
+        if pcm_out is not None:
+            pcm_writer = enulib.pcm_stream.PcmStreamWriter(
+                pcm_out, sample_rate=engine.sample_rate, pcm_format=pcm_format
+            )
+            # 音量の基準は最初の無音でないセグメントで判定して、以降のセグメントにも使う
+            bit_depth = None
+
+            def on_segment(wav_segment):
+                nonlocal bit_depth
+                if bit_depth is None and np.any(wav_segment):
+                    bit_depth = estimate_bit_depth(wav_segment)
+                scale = BIT_DEPTH_SCALES.get(bit_depth, 1)
+                pcm_writer.write(wav_segment / scale)
+
+        svs_kwargs = get_svs_kwargs(draft)
+        # 部分的な合成は、曲を識別できて、波形をまとめて書き出す場合だけ使う
+        song_id = path_ust if path_ust is not None else path_wav
+        if region and (song_id is None or pcm_writer is not None or feature_store is not None):
+            logger.info(
+                'Region rendering is disabled for unsaved UST, PCM output or feature store.'
+            )
+            region = False
+        # UST、タイミング、音響特徴量を編集する拡張機能には曲全体のファイルが渡るので使えない
+        if region and enulib.region_render.get_region_blocking_extensions(engine):
+            logger.info('Region rendering is disabled for ust, timing and acoustic editors.')
+            region = False
+        try:
+            with enulib.tracing.span('svs', phonemes=len(labels)):
+                if region:
+                    region_key = enulib.region_render.get_cache_key(
+                        abspath(model_dir),
+                        engine.get_model_fingerprint(),
+                        abspath(song_id),
+                        enulib.region_render.get_ust_state(plugin),
+                        enulib.region_render.get_extension_state(
+                            engine.get_extension_path_list('score_editor')
+                        ),
+                        repr(sorted(svs_kwargs.items())),
+                    )
+                    wav_data, sample_rate = enulib.region_render.render(
+                        engine, labels, region_key, **svs_kwargs
+                    )
+                else:
+                    wav_data, sample_rate = engine.svs(
+                        labels,
+                        on_segment=on_segment,
+                        feature_store=feature_store,
+                        feature_store_post_filters=feature_store_post_filters,
+                        **svs_kwargs,
+                    )
+        finally:
+            if pcm_writer is not None:
+                pcm_writer.close()
+        # 部分的な合成の実時間係数は合成し直した区間の長さに対するものなので、
+        # 曲の記録には残さない。
+        # (曲全体を合成した場合は、最後の svs() のタイミング補正後のラベルが曲全体の長さになる)
+        if region and engine.last_rtf is not None and len(engine.last_timing_labels) < len(labels):
+            logger.info('Region real-time factor: %.3f', engine.last_rtf)
+        elif engine.last_rtf is not None:
+            report_rtf(model_dir, draft, engine.last_rtf)
+
+        # PCMを書き出すだけの場合はWAVファイルを保存しない
+        if pcm_writer is not None and path_wav is None:
+            logger.info('Streamed %s samples to %s', pcm_writer.n_samples, pcm_out)
+            return pcm_out
+
+        # wav出力のフォーマットを確認する (svs() の出力バッファの音量をそのまま変える)
+        wav_data = adjust_wav_gain_for_float32(wav_data, inplace=True)
+
+        # WAV出力先が未定の場合
+        if path_wav is None:
+            print(
+                '表示されているエクスプローラーの画面から、WAVファイルに名前を付けて保存してください。'
+            )
+            if out_dir is not None:
+                initialdir = out_dir
+            else:
+                initialdir = expanduser(join('~', 'Desktop'))
+            # wavファイルの保存先を指定
+            path_wav = asksaveasfilename(
+                initialdir=initialdir,
+                initialfile=f'{songname}.wav',
+                filetypes=[('Wave sound file', '.wav'), ('All files', '*')],
+                defaultextension='.wav',
+            )
+        assert path_wav != '', 'ファイル名が入力されていません'
 
-    # NOTE: 後方互換のため
-    # enuconfigが存在する場合、そこに記載されている拡張機能のパスをconfigに追加する
-    if exists(join(voice_dir, 'enuconfig.yaml')):
-        with open(join(voice_dir, 'enuconfig.yaml'), encoding='utf-8') as f:
-            enuconfig = yaml.safe_load(f)
-        engine.config['extensions'] = enuconfig.get('extensions')
-        del enuconfig
-
-    # USTを一時フォルダに複製
-    logger.info(f'{datetime.now()} : copying UST')
-    shutil.copy2(path_plugin, engine.path_ust)
-    # Tableファイルを一時フォルダに複製
-    logger.info(f'{datetime.now()} : copying Table')
-    shutil.copy2(find_table(model_dir), engine.path_table)
-
-    # USTファイルを編集する
-    ust = utaupy.ust.load(engine.path_ust)
-    ust = engine.edit_ust(ust)
-    ust.write(engine.path_ust)
-
-    # UST → LAB の変換をする
-    logging.info('Converting UST -> LAB')
-    enulib.utauplugin2score.utauplugin2score(
-        engine.path_ust,
-        engine.path_table,
-        engine.path_full_score,
-        strict_sinsy_style=False,
-    )
+        # wav出力
+        with enulib.tracing.span('write_wav', samples=len(wav_data)):
+            wavfile.write(path_wav, rate=sample_rate, data=wav_data)
 
-    # フルラベルファイルを読み取る
-    logging.info('Loading LAB')
-    labels = hts.load(engine.path_full_score)
+        # 音声を再生する。
+        if exists(path_wav) and play_wav is True:
+            startfile(path_wav)  # noqa: S606
 
-    # LABファイルを編集する。
-    labels = engine.edit_score(labels)
+        return path_wav
 
-    # 音声を生成する
-    # NOTE: engine.svs を分解してタイミング補正を行えるように改造中。
-    logging.info('Generating WAV')
-    wav_data, sample_rate = engine.svs(
-        labels,
-        dtype=np.float32,
-        vocoder_type='auto',
-        post_filter_type='gv',
-        force_fix_vuv=True,
-        segmented_synthesis=SEGMENTED_SYNTHESIS,
-    )
 
-    # wav出力のフォーマットを確認する
-    wav_data = adjust_wav_gain_for_float32(wav_data)
+class MemoryBudget:
+    """同時に実行する処理のメモリ使用量の見積もりの合計を、上限以下に抑えるためのクラス。
 
-    # WAV出力先が未定の場合
-    if path_wav is None:
-        print(
-            '表示されているエクスプローラーの画面から、WAVファイルに名前を付けて保存してください。'
-        )
-        if out_dir is not None:
-            initialdir = out_dir
-        else:
-            initialdir = expanduser(join('~', 'Desktop'))
-        # wavファイルの保存先を指定
-        path_wav = asksaveasfilename(
-            initialdir=initialdir,
-            initialfile=f'{songname}.wav',
-            filetypes=[('Wave sound file', '.wav'), ('All files', '*')],
-            defaultextension='.wav',
-        )
-    assert path_wav != '', 'ファイル名が入力されていません'
+    上限より大きい処理も、ほかの処理がすべて終わっていれば実行する。
+    """
+
+    def __init__(self, limit_mb: float):
+        self.limit_mb = limit_mb
+        self.used_mb = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount_mb: float):
+        with self._condition:
+            while self.used_mb > 0 and self.used_mb + amount_mb > self.limit_mb:
+                self._condition.wait()
+            self.used_mb += amount_mb
+
+    def release(self, amount_mb: float):
+        with self._condition:
+            self.used_mb -= amount_mb
+            self._condition.notify_all()
+
+
+def estimate_engine_memory_mb(model_dir: str) -> float:
+    """音源1つを読み込んで合成するときのメモリ使用量 (MB) を見積もる。"""
+    model_bytes = sum(
+        getsize(join(model_dir, name))
+        for name in listdir(model_dir)
+        if isfile(join(model_dir, name))
+    )
+    return model_bytes / 1024 / 1024 * ENGINE_MEMORY_FACTOR + ENGINE_MEMORY_BASE_MB
 
-    # wav出力
-    wavfile.write(path_wav, rate=sample_rate, data=wav_data)
 
-    # 音声を再生する。
-    if exists(path_wav) and play_wav is True:
-        startfile(path_wav)  # noqa: S606
+def get_voice_names(voice_dirs: list[str]) -> dict[str, str]:
+    """出力ファイル名に使う音源の名前を、音源フォルダの絶対パスごとに返す。
 
-    return path_wav
+    フォルダ名が同じ音源が複数ある場合は、フォルダの絶対パスのハッシュ値の先頭を付けて区別する。
+    """
+    paths = [abspath(voice_dir) for voice_dir in voice_dirs]
+    counts: dict[str, int] = {}
+    for path in paths:
+        counts[basename(path)] = counts.get(basename(path), 0) + 1
+    return {
+        path: basename(path)
+        if counts[basename(path)] == 1
+        else f'{basename(path)}_{enulib.cache.hash_strings(path)[:8]}'
+        for path in paths
+    }
+
+
+def render_voicebanks(
+    path_plugin: str,
+    voice_dirs: list[str],
+    out_dir: str | None = None,
+    memory_budget_mb: float = MULTI_VOICE_MEMORY_BUDGET_MB,
+    draft: bool = DRAFT_MODE,
+) -> dict[str, str]:
+    """1つのUSTを複数の音源で合成して、音源ごとにWAVファイルを出力する。
+
+    UST の読み取りと、変換テーブルが同じ音源どうしのラベルへの変換は1回だけ行う。
+    音源ごとのモデルの読み込みと合成は、メモリ使用量の見積もりの合計が
+    memory_budget_mb 以下になる範囲で並列に行う。
+
+    同じ音源フォルダが複数回指定された場合は1回だけ合成する。
+
+    Returns:
+        dict[str, str]: 音源フォルダ → 出力したWAVファイルのパス
+    """
+    path_plugin = path_plugin.strip('"\'')
+    # 同じフォルダを指すものを除く
+    unique_dirs: dict[str, str] = {}
+    for voice_dir in voice_dirs:
+        unique_dirs.setdefault(abspath(voice_dir), voice_dir)
+    voice_dirs = list(unique_dirs.values())
+    voice_names = get_voice_names(voice_dirs)
+    with enulib.tracing.span('load_plugin'):
+        plugin = utaupy.utauplugin.load(path_plugin)
+    path_ust, _, _ = get_project_path(plugin)
+    base = path_ust if path_ust is not None else path_plugin
+    songname = splitext(basename(base))[0]
+    if out_dir is None:
+        out_dir = dirname(abspath(base))
+    svs_kwargs = get_svs_kwargs(draft)
+    budget = MemoryBudget(memory_budget_mb)
+
+    # 変換テーブルごとの変換済みのフルラベル
+    shared_scores: dict[str, hts.HTSLabelFile] = {}
+    shared_lock = threading.Lock()
+    timings: dict[str, dict[str, float]] = {}
+
+    def convert_score(engine, voice_name, table):
+        """USTをフルラベルに変換する。UST加工ツールがない音源どうしでは変換結果を共有する。"""
+        # plugin2score は変換中に歌詞とフラグを書き換えるので、共有のUSTはロックして使う
+        with shared_lock:
+            ust = copy.deepcopy(plugin)
+        if len(engine.get_extension_path_list('ust_editor')) > 0:
+            ust = engine.edit_ust(ust)
+            enulib.utauplugin2score.plugin2score(ust, table, engine.path_full_score)
+            return hts.load(engine.path_full_score)
+        engine.set_ust(ust)
+        table_hash = enulib.cache.hash_file(engine.path_table)
+        with shared_lock:
+            if table_hash not in shared_scores:
+                logger.info('Converting UST -> LAB for %s', voice_name)
+                enulib.utauplugin2score.plugin2score(plugin, table, engine.path_full_score)
+                shared_scores[table_hash] = hts.load(engine.path_full_score)
+                return copy.deepcopy(shared_scores[table_hash])
+            labels = copy.deepcopy(shared_scores[table_hash])
+        # 拡張機能が読めるように、共有したフルラベルを音源ごとの一時フォルダに書き出す
+        with open(engine.path_full_score, 'w', encoding='utf-8') as f:
+            f.write(str(labels))
+        return labels
+
+    def render_one(voice_dir):
+        voice_name = voice_names[abspath(voice_dir)]
+        timing = timings.setdefault(voice_name, {})
+        model_dir = find_model_dir(voice_dir)
+        memory_mb = min(estimate_engine_memory_mb(model_dir), memory_budget_mb)
+        budget.acquire(memory_mb)
+        try:
+            workspace = enulib.workspace.Workspace(
+                join(out_dir, f'{songname}_{voice_name}_enutemp'), in_ram=RAM_WORKSPACE
+            )
+            with workspace as temp_dir:
+                t = time.time()
+                with enulib.tracing.span('load_model', voice=voice_name):
+                    engine = ENUNU(model_dir)
+                timing['load_model'] = time.time() - t
+                engine.voice_dir = abspath(voice_dir)
+                engine.set_paths(temp_dir=temp_dir, songname=songname, path_feedback=path_plugin)
+                engine.use_extension_cache = EXTENSION_CACHE
+                engine.use_feature_cache = FEATURE_CACHE
+                engine.skip_optional_extensions = draft
+                engine.reduced_precision = draft
+                load_legacy_extensions(engine, voice_dir)
+
+                t = time.time()
+                path_table = enulib.table.find_table(model_dir)
+                shutil.copy2(path_table, engine.path_table)
+                labels = convert_score(engine, voice_name, enulib.table.load_table(path_table))
+                labels = engine.edit_score(labels)
+                timing['preprocess'] = time.time() - t
+
+                t = time.time()
+                with enulib.tracing.span('svs', voice=voice_name, phonemes=len(labels)):
+                    wav_data, sample_rate = engine.svs(labels, **svs_kwargs)
+                timing['svs'] = time.time() - t
+                timing['rtf'] = engine.last_rtf
+
+                path_wav = join(out_dir, f'{songname}_{voice_name}.wav')
+                wavfile.write(
+                    path_wav, rate=sample_rate, data=adjust_wav_gain_for_float32(wav_data)
+                )
+                del engine, wav_data
+            return path_wav
+        finally:
+            budget.release(memory_mb)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=len(voice_dirs)) as executor:
+        results = dict(zip(voice_dirs, executor.map(render_one, voice_dirs)))
+    total = time.time() - start_time
+
+    # 音源ごとの処理時間をまとめて出力する
+    for voice_name, timing in timings.items():
+        logger.info(
+            '%-24s load %7.2f s | preprocess %7.2f s | svs %7.2f s | RTF %s',
+            voice_name,
+            timing.get('load_model', 0.0),
+            timing.get('preprocess', 0.0),
+            timing.get('svs', 0.0),
+            f'{timing["rtf"]:.3f}' if timing.get('rtf') is not None else '-',
+        )
+    logger.info('Total: %.2f s for %s voicebanks', total, len(voice_dirs))
+    path_summary = join(out_dir, f'{songname}_voicebanks.json')
+    with open(path_summary, 'w', encoding='utf-8') as f:
+        json.dump(
+            {'total_sec': total, 'voicebanks': timings, 'wavs': results},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    logger.info('Timing summary: %s', path_summary)
+    return results
 
 
 if __name__ == '__main__':
@@ -739,6 +1693,109 @@ if __name__ == '__main__':
         parser.add_argument('ust', type=str, help='Input file path (UST or TMP)')
         parser.add_argument('--wav', type=str, required=False, help='Output file path (WAV)')
         parser.add_argument('--play', action='store_true', help='Play WAV after rendering or not')
+        parser.add_argument(
+            '--pcm_out',
+            type=str,
+            required=False,
+            help='Stream raw PCM with a header to this path or pipe ("-" for stdout)',
+        )
+        parser.add_argument(
+            '--pcm_format',
+            type=str,
+            choices=sorted(enulib.pcm_stream.PCM_FORMATS),
+            default='float32',
+            help='Sample format of --pcm_out',
+        )
+        parser.add_argument(
+            '--draft',
+            action='store_true',
+            help='Render quickly with WORLD, no post-filter and no optional extensions',
+        )
+        parser.add_argument(
+            '--feature_store',
+            type=str,
+            required=False,
+            help='Save acoustic features of each segment to this HDF5 file for re-vocoding',
+        )
+        parser.add_argument(
+            '--feature_store_post_filters',
+            type=str,
+            nargs='*',
+            default=[],
+            choices=['merlin', 'nnsvs', 'gv', 'none'],
+            help='Other post-filters whose spectral features are also saved',
+        )
+        parser.add_argument(
+            '--voicebanks',
+            type=str,
+            nargs='+',
+            required=False,
+            help='Render the UST on each of these voicebank folders concurrently',
+        )
+        parser.add_argument(
+            '--out_dir',
+            type=str,
+            required=False,
+            help='Output folder of WAV files for --voicebanks (default: next to the UST)',
+        )
+        parser.add_argument(
+            '--memory_budget',
+            type=float,
+            default=MULTI_VOICE_MEMORY_BUDGET_MB,
+            help='Memory budget in MB for concurrent rendering with --voicebanks',
+        )
+        parser.add_argument(
+            '--region',
+            action='store_true',
+            help='Re-render only the notes changed since the previous render of the same UST',
+        )
+        parser.add_argument(
+            '--keep_temp',
+            action='store_true',
+            help='Save intermediate files to {songname}_enutemp even if rendering succeeds',
+        )
+        parser.add_argument(
+            '--trace', type=str, required=False, help='Output file path of trace (Chrome JSON)'
+        )
+        parser.add_argument(
+            '--profile_memory',
+            action='store_true',
+            help='Report peak RSS and tracemalloc usage for each stage',
+        )
         args = parser.parse_args()
+        # main() は作業フォルダを音源フォルダに変更するので、相対パスは先に絶対パスにしておく
+        if args.trace is not None:
+            args.trace = abspath(args.trace)
+        # 処理時間とメモリ使用量の計測を有効にする
+        if args.trace is not None or args.profile_memory:
+            enulib.tracing.enable(memory=args.profile_memory)
         # 実行
-        main(args.ust, path_wav=args.wav, play_wav=args.play)
+        try:
+            if args.voicebanks:
+                render_voicebanks(
+                    args.ust,
+                    args.voicebanks,
+                    out_dir=args.out_dir,
+                    memory_budget_mb=args.memory_budget,
+                    draft=args.draft or DRAFT_MODE,
+                )
+            else:
+                main(
+                    args.ust,
+                    path_wav=args.wav,
+                    play_wav=args.play,
+                    pcm_out=args.pcm_out,
+                    pcm_format=args.pcm_format,
+                    keep_temp=args.keep_temp or KEEP_TEMP_FILES,
+                    region=args.region or REGION_RENDER,
+                    draft=args.draft or DRAFT_MODE,
+                    feature_store=args.feature_store,
+                    feature_store_post_filters=args.feature_store_post_filters,
+                )
+        finally:
+            # 計測結果を出力する
+            if enulib.tracing.is_enabled():
+                enulib.tracing.log_summary(logger)
+            if args.trace is not None:
+                enulib.tracing.dump(args.trace)
+                logger.info('Trace file: %s', args.trace)
@@ -8,6 +8,11 @@ from os import getcwd
 from pprint import pprint
 from sys import argv
 
+ENUNU_READS = []
+ENUNU_WRITES = []
+# 引数を表示するのが目的なので、実行結果をキャッシュしない
+ENUNU_CACHEABLE = False
+
 
 def main():
     print('dummy.py--------------------')
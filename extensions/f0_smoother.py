@@ -7,7 +7,12 @@ f0の極端に急峻な変化をなめらかにする拡張機能。
 from argparse import ArgumentParser
 from copy import copy
 from math import cos, log10, pi
-from pprint import pprint
+
+ENUNU_READS = ['f0']
+ENUNU_WRITES = ['f0']
+ENUNU_CACHEABLE = True
+# ピッチの見た目を整えるだけなので、下書きモードでは省略してよい
+ENUNU_OPTIONAL = True
 
 SMOOTHEN_WIDTH = 6  # 3から9くらいが良さそう。
 DETECT_THRESHOLD = 0.6
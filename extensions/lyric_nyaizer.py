@@ -7,6 +7,10 @@ USTの全部の歌詞を ny a にする。
 from argparse import ArgumentParser
 import utaupy
 
+ENUNU_READS = ['ust']
+ENUNU_WRITES = ['ust']
+ENUNU_CACHEABLE = True
+
 
 def main():
     """全体の処理をする"""
@@ -8,6 +8,10 @@ from argparse import ArgumentParser
 
 import utaupy
 
+ENUNU_READS = ['full_score']
+ENUNU_WRITES = ['full_score']
+ENUNU_CACHEABLE = True
+
 
 def main():
     """全体の処理をする
@@ -12,10 +12,13 @@ import re
 from argparse import ArgumentParser
 from copy import copy
 from math import log2
-from pprint import pprint
 
 import utaupy
 
+ENUNU_READS = ['ust', 'f0', 'full_timing']
+ENUNU_WRITES = ['ust', 'f0']
+ENUNU_CACHEABLE = True
+
 STYLE_SHIFT_FLAG_PATTERN = re.compile(r'S(\d+|\+\d+|-\d+)')
 
 
@@ -9,6 +9,10 @@ from argparse import ArgumentParser
 import utaupy
 from tqdm import tqdm
 
+ENUNU_READS = ['mono_timing']
+ENUNU_WRITES = ['mono_timing']
+ENUNU_CACHEABLE = True
+
 
 def repair_label(path_label, time_unit=50000):
     """発声開始時刻が直前のノートの発声開始時刻より早くなっている音素を直す。"""
@@ -11,6 +11,10 @@ from argparse import ArgumentParser
 import colored_traceback.always  # noqa: F401
 import utaupy
 
+ENUNU_READS = ['ust', 'full_timing']
+ENUNU_WRITES = ['full_timing']
+ENUNU_CACHEABLE = True
+
 
 def get_velocities(ust):
     """USTを読み取って子音速度のリストを返す。"""
@@ -43,6 +43,11 @@ from os.path import dirname, join
 import utaupy  # utaupy>=1.21.0 is required
 from utaupy.ust import Ust
 
+ENUNU_READS = ['ust', 'f0']
+ENUNU_WRITES = ['ust', 'f0']
+# 拡張機能のフォルダに一時ファイルを書き出して次の段階で使うので、実行結果をキャッシュしない
+ENUNU_CACHEABLE = False
+
 MODE_SWITCH_KEY = '$EnunuVibratoApplier'
 
 
@@ -16,6 +16,9 @@ from tqdm.contrib import tzip
 import utaupy
 from pprint import pprint
 
+ENUNU_READS = ['ust']
+ENUNU_WRITES = ['ust']
+
 VOICECOLOR_DICT = {
     '通常': 'Normal',
     '強': 'Loud',
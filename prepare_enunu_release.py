@@ -5,14 +5,22 @@ ENUNUのリリース準備をする
 """
 
 import shutil
+import statistics
 import subprocess
+import time
 from glob import glob
 from os import chdir, makedirs
-from os.path import basename, dirname, exists, isdir, join
+from os.path import abspath, basename, dirname, exists, isdir, join
 from shutil import make_archive
 
 REMOVE_LIST = ['__pycache__', '.mypy']
 PYTHON_DIR = 'python-3.12.10-embed-amd64'
+# 起動時間の計測で実行するコード (torch は配布物に含めないので import しない)
+STARTUP_BENCHMARK_IMPORTS = 'enulib, utaupy, numpy, scipy.io.wavfile, yaml'
+# 同梱の embeddable Python は ._pth ファイルで sys.path を決めるので、-c でもカレントディレクトリが
+# sys.path に入らない。enulib を import できるように、リリースフォルダを先に追加する。
+STARTUP_BENCHMARK_CODE = f"import sys; sys.path.insert(0, '.'); import {STARTUP_BENCHMARK_IMPORTS}"
+STARTUP_BENCHMARK_RUNS = 5
 
 
 def pip_uninstall_torch(python_exe: str):
@@ -80,6 +88,45 @@ def remove_cache_files(path_dir, remove_list):
         shutil.rmtree(cache_dir)
 
 
+def compile_bytecode(python_exe: str, paths: list[str], invalidation_mode: str) -> bool:
+    """
+    同梱のPythonでバイトコードを事前にコンパイルする。
+
+    利用者の初回起動時や、拡張機能のサブプロセスが import するときにコンパイルしなくて済む。
+    zip の展開で更新日時が変わっても使えるように、ハッシュで検証する形式にする。
+    - checked-hash: 読み込むたびにソースのハッシュと比べる。(利用者が編集しうる enulib など)
+    - unchecked-hash: ソースと比べない。(pip で入れ直さない限り変わらない site-packages)
+    """
+    args = [
+        python_exe,
+        '-m',
+        'compileall',
+        '-q',
+        '-j',
+        '0',
+        '--invalidation-mode',
+        invalidation_mode,
+        *paths,
+    ]
+    # site-packages にはコンパイルできないテンプレートなどが含まれていることがあるので、
+    # 失敗しても止めずに結果だけ返す
+    return subprocess.run(args, check=False).returncode == 0  # noqa: S603
+
+
+def measure_startup(python_exe: str, cwd: str, extra_args=(), runs=STARTUP_BENCHMARK_RUNS):
+    """
+    STARTUP_BENCHMARK_CODE を実行するのにかかる時間 (秒) の中央値を返す。
+    """
+    times = []
+    for _ in range(runs):
+        t_start = time.perf_counter()
+        subprocess.run(  # noqa: S603
+            [python_exe, *extra_args, '-c', STARTUP_BENCHMARK_CODE], cwd=cwd, check=True
+        )
+        times.append(time.perf_counter() - t_start)
+    return statistics.median(times)
+
+
 def copy_python_dir(python_dir, enunu_release_dir):
     """
     配布のほうにPythonをコピーする
@@ -182,6 +229,25 @@ def main():
     print('Removing cache')
     remove_cache_files(enunu_release_dir, REMOVE_LIST)
 
+    # バイトコードなしの起動時間を計測する (-B: 計測中に __pycache__ を作らない)
+    release_python_exe = abspath(join(enunu_release_dir, python_exe))
+    print('Measuring startup time without bytecode')
+    startup_without = measure_startup(release_python_exe, enunu_release_dir, extra_args=['-B'])
+
+    # 同梱するソースとパッケージのバイトコードを作る
+    print('Compiling bytecode')
+    compile_bytecode(
+        release_python_exe,
+        [join(enunu_release_dir, 'enulib'), join(enunu_release_dir, 'extensions')],
+        'checked-hash',
+    )
+    site_packages = join(enunu_release_dir, python_dir, 'Lib', 'site-packages')
+    if not compile_bytecode(release_python_exe, [site_packages], 'unchecked-hash'):
+        print('  Some files in site-packages could not be compiled. They are left as they are.')
+
+    print('Measuring startup time with bytecode')
+    startup_with = measure_startup(release_python_exe, enunu_release_dir)
+
     # enunu.bat をリリースフォルダに作成
     print('Creating enunu.bat')
     create_enunu_bat(join(enunu_release_dir, 'enunu.bat'), python_exe, version)
@@ -199,6 +265,14 @@ def main():
     make_archive(dirname(enunu_release_dir), format='zip', root_dir=dirname(enunu_release_dir))
 
     print('\n----------------------------------------------')
+    print(
+        f'Startup time (import {STARTUP_BENCHMARK_IMPORTS}, '
+        f'median of {STARTUP_BENCHMARK_RUNS} runs)'
+    )
+    print(f'  without bytecode: {startup_without:.3f} s')
+    print(f'  with bytecode   : {startup_with:.3f} s')
+
+    print('\n----------------------------------------------')
 
 
 if __name__ == '__main__':
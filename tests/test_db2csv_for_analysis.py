@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+utils/db2csv_for_analysis のフルラベルのCSVの形式が、
+utaupy.utils.hts2csv と同じであることを確かめるテスト。
+"""
+
+import importlib.util
+from os.path import dirname, join
+
+import pytest
+
+pytest.importorskip('pandas')
+utaupy = pytest.importorskip('utaupy')
+
+SCRIPT_DIR = join(dirname(dirname(__file__)), 'utils', 'db2csv_for_analysis')
+PATH_TABLE = join(SCRIPT_DIR, 'kana2phonemes_etk_001.table')
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location(
+        'db2csv_for_analysis', join(SCRIPT_DIR, 'db2csv_for_analysis.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def path_ust(tmp_path):
+    ust = utaupy.ust.Ust()
+    ust.setting['Tempo'] = 120
+    for lyric, notenum, length in (
+        ('R', 60, 480),
+        ('か', 60, 480),
+        ('き', 62, 240),
+        ('R', 60, 240),
+        ('R', 60, 480),
+        ('さ', 64, 960),
+        ('R', 60, 480),
+    ):
+        note = utaupy.ust.Note()
+        note.lyric = lyric
+        note.notenum = notenum
+        note.length = length
+        ust.notes.append(note)
+    path = str(tmp_path / 'song.ust')
+    ust.write(path)
+    return path
+
+
+def test_header_matches_hts2csv(tmp_path, path_ust):
+    db2csv = load_script()
+    path_full = str(tmp_path / 'song.full')
+    path_csv = str(tmp_path / 'song.csv')
+    utaupy.utils.ust2hts(path_ust, path_full, PATH_TABLE, strict_sinsy_style=False)
+    utaupy.utils.hts2csv(path_full, path_csv)
+    with open(path_csv, encoding='utf-8') as f:
+        header = f.readline().rstrip('\n')
+    assert db2csv.FULL_CSV_HEADER == header
+
+
+def test_rows_match_hts2csv(tmp_path, path_ust):
+    """休符を結合したフルラベルを書き出して hts2csv で変換した結果と、行ごとに比べる。"""
+    db2csv = load_script()
+    table = utaupy.table.load(PATH_TABLE, encoding='utf-8')
+    rows = db2csv.ust_to_csv_rows(path_ust, table)
+
+    path_full = str(tmp_path / 'song.full')
+    path_merged = str(tmp_path / 'song_merged.full')
+    path_csv = str(tmp_path / 'song.csv')
+    utaupy.utils.ust2hts(path_ust, path_full, PATH_TABLE, strict_sinsy_style=False)
+    song = db2csv.merge_rests_full_song(utaupy.hts.load(path_full).song)
+    song.write(path_merged, strict_sinsy_style=False)
+    utaupy.utils.hts2csv(path_merged, path_csv)
+    with open(path_csv, encoding='utf-8') as f:
+        expected = f.read().splitlines()[1:]
+    assert rows == expected
+    assert all(len(row.split(',')) == len(db2csv.FULL_CSV_HEADER.split(',')) for row in rows)
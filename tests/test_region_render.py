@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+enulib.region_render の部分的な合成を、曲全体を合成した結果と比べるテスト。
+
+モデルの代わりに、音素ごとに決まった長さと波形を返すエンジンを使う。
+休符は無音なので、休符の中でつないだ波形は曲全体を合成した波形と一致するはず。
+"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('utaupy')
+
+from enulib import cache, region_render  # noqa: E402
+
+SAMPLE_RATE = 10000
+# 10ms (100ns単位)
+UNIT = 100000
+# タイミング補正で音素の長さに掛ける倍率。楽譜の時刻と補正後の時刻がずれるようにする。
+TIMING_SCALES = {'pau': 0.8, 'sil': 0.8, 'a': 1.1, 'i': 1.1}
+FREQUENCIES = {'k': 300, 's': 500, 't': 700, 'n': 900, 'a': 440, 'i': 660}
+
+
+class FakeLabels:
+    """HTSLabelFile の代わり"""
+
+    def __init__(self, start_times, end_times, contexts):
+        self.start_times = list(start_times)
+        self.end_times = list(end_times)
+        self.contexts = list(contexts)
+
+    def __len__(self):
+        return len(self.contexts)
+
+
+class FakeEngine:
+    """音素ごとに決まった長さと波形で合成するエンジン"""
+
+    def __init__(self):
+        self.rendered_lengths = []
+        self.last_timing_labels = None
+
+    def slice_labels(self, labels, first, last):
+        return FakeLabels(
+            labels.start_times[first:last],
+            labels.end_times[first:last],
+            labels.contexts[first:last],
+        )
+
+    def svs(self, labels, **_):
+        self.rendered_lengths.append(len(labels))
+        starts, ends, pieces = [], [], []
+        t = labels.start_times[0]
+        for start, end, context in zip(labels.start_times, labels.end_times, labels.contexts):
+            phoneme = region_render.get_phoneme(context)
+            duration = int(round((end - start) * TIMING_SCALES.get(phoneme, 1.0)))
+            starts.append(t)
+            ends.append(t + duration)
+            t += duration
+            n_samples = duration * SAMPLE_RATE // 10**7
+            if phoneme in region_render.REST_PHONEMES:
+                pieces.append(np.zeros(n_samples, dtype=np.float32))
+            else:
+                n = np.arange(n_samples)
+                wave = np.sin(2 * np.pi * FREQUENCIES[phoneme] * n / SAMPLE_RATE)
+                pieces.append(wave.astype(np.float32))
+        self.last_timing_labels = FakeLabels(starts, ends, labels.contexts)
+        return np.concatenate(pieces), SAMPLE_RATE
+
+
+def make_labels(phrases):
+    """[(音素, 長さ), ...] のフレーズのリストを、休符で区切ったラベルにする。"""
+    phonemes = [('sil', 20)]
+    for idx, phrase in enumerate(phrases):
+        if idx > 0:
+            phonemes.append(('pau', 30))
+        phonemes += phrase
+    phonemes.append(('sil', 20))
+    starts, ends, contexts = [], [], []
+    t = 0
+    for phoneme, length in phonemes:
+        starts.append(t)
+        ends.append(t + length * UNIT)
+        contexts.append(f'xx^xx-{phoneme}+xx')
+        t += length * UNIT
+    return FakeLabels(starts, ends, contexts)
+
+
+PHRASES = [
+    [('k', 5), ('a', 40)],
+    [('s', 5), ('a', 30), ('t', 5), ('a', 30)],
+    [('n', 5), ('a', 50)],
+    [('t', 5), ('a', 20), ('k', 5), ('i', 40)],
+    [('s', 5), ('i', 30)],
+    [('k', 5), ('a', 60)],
+]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+
+
+def assert_matches_full_render(phrases, engine, key):
+    labels = make_labels(phrases)
+    wav, sample_rate = region_render.render(engine, labels, key)
+    expected, _ = FakeEngine().svs(labels)
+    assert sample_rate == SAMPLE_RATE
+    assert len(wav) == len(expected)
+    np.testing.assert_allclose(wav, expected, atol=1e-6)
+
+
+def test_first_render_is_full():
+    engine = FakeEngine()
+    assert_matches_full_render(PHRASES, engine, 'song')
+    assert engine.rendered_lengths == [len(make_labels(PHRASES))]
+
+
+def test_unchanged_score_uses_cache():
+    engine = FakeEngine()
+    assert_matches_full_render(PHRASES, engine, 'song')
+    assert_matches_full_render(PHRASES, engine, 'song')
+    assert len(engine.rendered_lengths) == 1
+
+
+def test_changed_phoneme_is_spliced():
+    engine = FakeEngine()
+    assert_matches_full_render(PHRASES, engine, 'song')
+    phrases = [list(phrase) for phrase in PHRASES]
+    phrases[2] = [('n', 5), ('i', 50)]
+    assert_matches_full_render(phrases, engine, 'song')
+    # 変更したフレーズと前後の休符だけを合成する
+    assert engine.rendered_lengths[-1] == len(phrases[2]) + 2
+
+
+def test_longer_note_shifts_following_phrases():
+    engine = FakeEngine()
+    assert_matches_full_render(PHRASES, engine, 'song')
+    phrases = [list(phrase) for phrase in PHRASES]
+    phrases[1] = [('s', 5), ('a', 30), ('t', 5), ('a', 55)]
+    assert_matches_full_render(phrases, engine, 'song')
+    assert engine.rendered_lengths[-1] == len(phrases[1]) + 2
+    # 2回目の部分的な合成も、1回目でつないだ結果のタイミングを使ってつなぐ
+    phrases[4] = [('t', 5), ('i', 30)]
+    assert_matches_full_render(phrases, engine, 'song')
+    assert engine.rendered_lengths[-1] == len(phrases[4]) + 2
+
+
+def test_added_phoneme_is_spliced():
+    engine = FakeEngine()
+    assert_matches_full_render(PHRASES, engine, 'song')
+    phrases = [list(phrase) for phrase in PHRASES]
+    phrases[3] = [('t', 5), ('a', 20), ('k', 5), ('i', 20), ('n', 5), ('a', 20)]
+    assert_matches_full_render(phrases, engine, 'song')
+    assert engine.rendered_lengths[-1] == len(phrases[3]) + 2
+
+
+def test_changed_first_phrase():
+    engine = FakeEngine()
+    assert_matches_full_render(PHRASES, engine, 'song')
+    phrases = [list(phrase) for phrase in PHRASES]
+    phrases[0] = [('t', 5), ('i', 45)]
+    assert_matches_full_render(phrases, engine, 'song')
+    assert engine.rendered_lengths[-1] < len(make_labels(phrases))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+enulib.render_queue のジョブの共有と完了の通知のテスト。
+
+モデルの代わりに、呼ばれた回数を数えるだけのエンジンを使う。
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from enulib import render_queue  # noqa: E402
+
+TIMEOUT = 5
+
+
+class FakeEngine:
+    """呼ばれた順番の番号を結果として返すエンジン"""
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def svs(self, labels, cancel_event=None, **kwargs):
+        self.n_calls += 1
+        return self.n_calls, 10000
+
+
+def test_shared_job():
+    """実行待ちの同じジョブは1回の計算を共有する。"""
+    engine = FakeEngine()
+    queue = render_queue.RenderQueue(engine)
+    gate = threading.Event()
+    original_svs = engine.svs
+    engine.svs = lambda *args, **kwargs: gate.wait() and original_svs(*args, **kwargs)
+    try:
+        handle_1 = queue.submit('labels')
+        handle_2 = queue.submit('labels')
+        gate.set()
+        assert handle_1.result(TIMEOUT) == handle_2.result(TIMEOUT) == (1, 10000)
+        assert engine.n_calls == 1
+    finally:
+        queue.shutdown()
+
+
+def test_submit_while_finishing(monkeypatch):
+    """計算が終わって待っているジョブに知らせている間に同じジョブを追加しても、結果を受け取れる。"""
+    engine = FakeEngine()
+    queue = render_queue.RenderQueue(engine)
+    late_handles = []
+    original_finish = render_queue._Computation.finish
+
+    def finish(self, result=None, exception=None):
+        # 最初の計算の完了を知らせる途中で、別のスレッドから同じジョブを追加する
+        if not late_handles:
+            thread = threading.Thread(
+                target=lambda: late_handles.append(queue.submit('labels'))
+            )
+            thread.start()
+            thread.join(0.2)
+            late_handles.append(None)
+        original_finish(self, result=result, exception=exception)
+
+    monkeypatch.setattr(render_queue._Computation, 'finish', finish)
+    try:
+        handle_1 = queue.submit('labels')
+        assert handle_1.result(TIMEOUT) == (1, 10000)
+        for _ in range(100):
+            if len(late_handles) == 2:
+                break
+            threading.Event().wait(0.05)
+        late_handle = next(x for x in late_handles if x is not None)
+        # 終わった計算に合流せず、新しく計算し直す
+        assert late_handle.result(TIMEOUT) == (2, 10000)
+    finally:
+        queue.shutdown()
@@ -2,18 +2,77 @@
 # Copyright (c) 2021 oatsu
 """
 ENUNU用の歌唱データベースの音素データを、分析しやすい形式のCSVファイルにまとめる。
+
+曲ごとの処理はメモリ上で行い、複数のプロセスで並列に処理した結果を
+曲名の順に結果のCSVファイルに書き込んでいく。(一時ファイルは作らない)
+
+入力ファイルのハッシュを {result}_manifest.json に記録しておき、
+次回からは追加・変更された曲だけを処理して、その曲の行だけを差し替える。
+
+--format parquet / npz を指定すると、CSVの代わりに型付きの列形式のファイルに保存する。
+音素や文脈の文字列の列はカテゴリ型 (npz ではコードとカテゴリの配列) にする。
+あわせて、音素ごとの長さの分布 ({result}_duration_stats.csv) と、
+楽譜に対するアライメントの時刻のずれ ({result}_timing_stats.csv) も集計する。
+
+使用例:
+    python db2csv_for_analysis.py path/to/db_root --jobs 8
 """
 
+import hashlib
+import json
+import re
+import sys
+from argparse import ArgumentParser
 from glob import glob
-from os import makedirs
-from os.path import basename, dirname, join, splitext
-from shutil import copy2
+from multiprocessing import Pool
+from os import cpu_count, replace, stat
+from os.path import basename, dirname, exists, join, splitext
 
+import numpy as np
 import pandas
 import utaupy
 from tqdm import tqdm
 
 DEFAULT_TABLE_PATH = join(dirname(__file__), 'kana2phonemes_etk_001.table')
+DEFAULT_RESULT_PATH = join(dirname(__file__), 'result.csv')
+
+# 結果のCSVファイルの列名
+MONO_CSV_HEADER = 'start(align), end(align), phoneme(align)'
+FULL_CSV_HEADER = ','.join(
+    ['start', 'end']
+    + [
+        f'{name}{i + 1}'
+        for name, n in (
+            ('p', 16),
+            ('a', 5),
+            ('b', 5),
+            ('c', 5),
+            ('d', 9),
+            ('e', 60),
+            ('f', 9),
+            ('g', 2),
+            ('h', 2),
+            ('i', 2),
+            ('j', 3),
+        )
+        for i in range(n)
+    ]
+)
+# フルラベルの1行をCSVの1行にするときの区切り文字
+# FULL_CSV_HEADER とあわせて utaupy.utils.hts2csv と同じにする。
+# (tests/test_db2csv_for_analysis.py で確認)
+FULL_LABEL_DELIMITERS = re.compile(f"[{re.escape(' =+-~!@#$%^&;_|[]')}]")
+
+# 集計する分位点
+STATS_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+# HTSラベルの時刻の単位 (100ns) を秒にする係数
+TIME_UNIT_SEC = 1e-7
+
+# マニフェストの形式や曲ごとの処理内容を変えたときに、前回の結果を使わないようにするための番号
+MANIFEST_VERSION = 1
+
+# ワーカープロセスごとに読み込んだ変換テーブル
+_worker_table = None
 
 
 def compare_mono_and_full(path_mono, path_full) -> None:
@@ -32,12 +91,11 @@ def compare_mono_and_full(path_mono, path_full) -> None:
         )
 
 
-def merge_rests_mono(path_mono_lab_in, path_mono_lab_out):
+def merge_rests_mono_label(label):
     """
-    モノラベルの休符を結合する。
+    モノラベルのオブジェクトの休符を結合した、新しいモノラベルのオブジェクトを返す。
     休符はすべてpauにする。
     """
-    label = utaupy.label.load(path_mono_lab_in)
     # 休符を全部pauにする
     for phoneme in label:
         if phoneme.symbol == 'sil':
@@ -54,20 +112,13 @@ def merge_rests_mono(path_mono_lab_in, path_mono_lab_out):
             prev_phoneme = phoneme
     # 発声終了時刻を再計算(わずかにずれる可能性があるため)
     new_label.reload()
-    # 上書き保存
-    new_label.write(path_mono_lab_out)
+    return new_label
 
 
-def merge_rests_full(path_hts_in, path_hts_out):
+def merge_rests_full_song(song):
     """
-    フルラベル用
-
-    Songオブジェクト内で休符 (sil, pau) が連続するときに結合する。
-    転調したり拍子やテンポが変わっていない場合のみ結合する。
-
-    [sil][m][a][pau][sil][pau][k][a] -> [pau][m][a][pau][k][a] にする
+    Songオブジェクトの休符を結合した、新しいSongオブジェクトを返す。
     """
-    song = utaupy.hts.load(path_hts_in).song
     new_song = utaupy.hts.Song()
 
     for phoneme in song.all_phonemes:
@@ -98,104 +149,395 @@ def merge_rests_full(path_hts_in, path_hts_out):
             prev_note = note
     # データを補完
     new_song.autofill()
-    new_song.write(path_hts_out, strict_sinsy_style=False)
-
-
-def mono2csv(path_mono_lab, path_csv):
-    """
-    モノラベルをcsvに変換して保存する。
-    """
-    with open(path_mono_lab, encoding='utf-8') as f:
-        s = f.read()
-    # 区切り文字をコンマにする
-    s = s.replace(' ', ',')
-    # カラム名の行を追加
-    s = 'start(align), end(align), phoneme(align)\n' + s
-    # 確実に改行で終わるようにする
-    s = s.strip('\n') + '\n'
-    # csvファイル出力
-    with open(path_csv, 'w', encoding='utf-8') as f:
-        f.write(s)
-
-
-def unify_csv_files(mono_csv_files: list[str], full_csv_files: list[str], path_csv_out):
-    """
-    複数のCSVファイルを1ファイルに統合する。
-    """
-    mono_csv_files = sorted(mono_csv_files)
-    full_csv_files = sorted(full_csv_files)
-    lines_concat: list[str] = []
-
-    header = 'songname'
-    with open(mono_csv_files[0], encoding='utf-8') as f_mono:
-        header += ',' + f_mono.read().splitlines()[0]
-    with open(full_csv_files[0], encoding='utf-8') as f_full:
-        header += ',' + f_full.read().splitlines()[0]
-    lines_concat.append(header)
-
-    for path_mono_csv, path_full_csv in zip(tqdm(mono_csv_files), full_csv_files):
-        songname = splitext(basename(path_mono_csv))[0]
-        # CSVを読み取る
-        with open(path_mono_csv, encoding='utf-8') as f:
-            lines_mono = f.read().splitlines()[1:]
-        with open(path_full_csv, encoding='utf-8') as f:
-            lines_full = f.read().splitlines()[1:]
-        # 音素数が一致するかチェック
-        if len(lines_mono) != len(lines_full):
-            raise ValueError(f'モノラベルとフルラベルの音素数が一致しません。({songname})')
-        lines_concat += [
-            f'{songname},{line_mono},{line_full}'
-            for line_mono, line_full in zip(lines_mono, lines_full)
-        ]
-
-    s = '\n'.join(lines_concat).replace('xx', '')
-    with open(path_csv_out, 'w', encoding='utf-8') as f:
-        f.write(s)
-
-
-def main():
-    db_root = input('db_root: ').strip('"')
+    return new_song
+
+
+def song_to_full_lines(song, strict_sinsy_style: bool = False) -> list[str]:
+    """
+    Songオブジェクトを、ファイルに書き出すときと同じフルラベルの行のリストにする。
+    (utaupy.hts.Song.write の文字列だけを作る版)
+    """
+    full_label = utaupy.hts.HTSFullLabel()
+    full_label.song = song
+    full_label.fill_contexts_from_songobj()
+    full_label = utaupy.hts.adjust_break_contexts(full_label)
+    full_label = utaupy.hts.adjust_pau_contexts(full_label, strict=strict_sinsy_style)
+    return [str(line) for line in full_label]
+
+
+def mono_to_csv_rows(path_lab) -> list[str]:
+    """
+    LABファイル (mono_align) を読み取って休符を結合し、CSVの行のリストにする。
+    """
+    label = merge_rests_mono_label(utaupy.label.load(path_lab))
+    return [f'{phoneme.start},{phoneme.end},{phoneme.symbol}' for phoneme in label]
+
+
+def ust_to_csv_rows(path_ust, table) -> list[str]:
+    """
+    USTファイルをフルラベル (full_score) にして休符を結合し、CSVの行のリストにする。
+    """
+    ust = utaupy.ust.load(path_ust)
+    # ust2hts でいったん書き出して読み直すのと同じ結果になるように、行のリストを経由する
+    lines = song_to_full_lines(utaupy.utils.ustobj2songobj(ust, table))
+    song = merge_rests_full_song(utaupy.hts.load(lines).song)
+    return full_lines_to_csv_rows(song_to_full_lines(song))
+
+
+def full_lines_to_csv_rows(lines: list[str]) -> list[str]:
+    """
+    フルラベルの行のリストを、utaupy.utils.hts2csv と同じ形式のCSVの行のリストにする。
+    (列名は FULL_CSV_HEADER)
+    """
+    return [','.join(FULL_LABEL_DELIMITERS.split(re.sub('/.:', '@', line))) for line in lines]
+
+
+def _init_worker(path_table):
+    """ワーカープロセスで変換テーブルを1回だけ読み込む。"""
+    global _worker_table  # noqa: PLW0603
+    _worker_table = utaupy.table.load(path_table, encoding='utf-8')
+
+
+def song_to_csv_rows(song: tuple[str, str, str]) -> list[str]:
+    """
+    1曲分のLABファイルとUSTファイルを、結果のCSVファイルの行のリストにする。
+
+    Args:
+        song (tuple): (曲名, LABファイルのパス, USTファイルのパス)
+    """
+    songname, path_lab, path_ust = song
+    lines_mono = mono_to_csv_rows(path_lab)
+    lines_full = ust_to_csv_rows(path_ust, _worker_table)
+    # 音素数が一致するかチェック
+    if len(lines_mono) != len(lines_full):
+        raise ValueError(f'モノラベルとフルラベルの音素数が一致しません。({songname})')
+    return [
+        f'{songname},{line_mono},{line_full}'.replace('xx', '')
+        for line_mono, line_full in zip(lines_mono, lines_full)
+    ]
+
+
+def find_songs(db_root) -> list[tuple[str, str, str]]:
+    """
+    歌唱DBから、LABファイルとUSTファイルがそろっている曲を曲名の順に探す。
+
+    Returns:
+        list[tuple]: (曲名, LABファイルのパス, USTファイルのパス) のリスト
+    """
     ust_files = glob(join(db_root, '**', '*.ust'), recursive=True)
     lab_files = glob(join(db_root, '**', '*.lab'), recursive=True)
-    path_table = DEFAULT_TABLE_PATH
-
-    temp_dir = join(dirname(__file__), 'temp')
-    path_result_csv = join(dirname(__file__), 'result.csv')
-
-    makedirs(temp_dir, exist_ok=True)
-
-    # LABファイルをCSVファイルにする
-    mono_csv_files = []
-    for path_lab in tqdm(lab_files):
-        songname = splitext(basename(path_lab))[0]
-        path_mono_lab = join(temp_dir, f'{songname}_mono_align.lab')
-        path_mono_csv = join(temp_dir, f'{songname}_mono_align.csv')
-        # 一時フォルダにLABファイルを複製
-        copy2(path_lab, path_mono_lab)
-        merge_rests_mono(path_mono_lab, path_mono_lab)
-        # CSVファイルに変換
-        mono2csv(path_mono_lab, path_mono_csv)
-        # CSVファイル一覧に追加
-        mono_csv_files.append(path_mono_csv)
-
-    # USTファイルをCSVファイルにする
-    full_csv_files = []
-    for path_ust in tqdm(ust_files):
-        songname = splitext(basename(path_ust))[0]
-        path_full_lab = join(temp_dir, f'{songname}_full_score.lab')
-        path_full_csv = join(temp_dir, f'{songname}_full_score.csv')
-        utaupy.utils.ust2hts(path_ust, path_full_lab, path_table, strict_sinsy_style=False)
-        merge_rests_full(path_full_lab, path_full_lab)
-        utaupy.utils.hts2csv(path_full_lab, path_full_csv)
-        # CSVファイル一覧に追加
-        full_csv_files.append(path_full_csv)
-
-    unify_csv_files(mono_csv_files, full_csv_files, path_result_csv)
-    df = pandas.read_csv(path_result_csv)
+    d_ust = {splitext(basename(path))[0]: path for path in ust_files}
+    d_lab = {splitext(basename(path))[0]: path for path in lab_files}
+    for songname in sorted(d_ust.keys() ^ d_lab.keys()):
+        print(f'LABファイルかUSTファイルが見つからないのでスキップします: {songname}')
+    return [
+        (songname, d_lab[songname], d_ust[songname])
+        for songname in sorted(d_ust.keys() & d_lab.keys())
+    ]
+
+
+def hash_file(path) -> str:
+    """ファイルの内容のハッシュ値を返す。"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_file_state(path, old_state: dict | None = None) -> dict:
+    """
+    ファイルのパス、更新日時、サイズ、ハッシュ値を返す。
+    更新日時とサイズが前回と同じ場合は、ファイルを読まずに前回のハッシュ値を使う。
+    """
+    st = stat(path)
+    state = {'path': path, 'mtime': st.st_mtime, 'size': st.st_size}
+    if old_state is not None and all(old_state.get(key) == state[key] for key in state):
+        state['hash'] = old_state['hash']
+    else:
+        state['hash'] = hash_file(path)
+    return state
+
+
+def load_manifest(path_manifest, table_hash: str) -> dict:
+    """
+    前回のマニフェストを読み取る。ない場合や、変換テーブルなどが変わった場合は空にする。
+    """
+    if not exists(path_manifest):
+        return {}
+    try:
+        with open(path_manifest, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        print('マニフェストを読み取れないので、すべての曲を処理します。')
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('table') != table_hash:
+        print('変換テーブルか処理内容が変わったので、すべての曲を処理します。')
+        return {}
+    return manifest
+
+
+def read_cached_rows(path_csv, manifest: dict, songnames) -> dict[str, list[str]]:
+    """
+    前回の結果のCSVファイルから、songnames の曲の行を読み取る。
+
+    行は前回のマニフェストの曲の順に並んでいて、曲ごとの行数はマニフェストに記録されている。
+    """
+    songnames = set(songnames)
+    cached_rows = {}
+    with open(path_csv, encoding='utf-8') as f:
+        # ヘッダー
+        f.readline()
+        for songname, entry in manifest['songs'].items():
+            rows = [f.readline().rstrip('\n') for _ in range(entry['n_rows'])]
+            if songname in songnames:
+                cached_rows[songname] = rows
+    return cached_rows
+
+
+def write_result_csv(
+    songs: list, path_table, path_csv_out, jobs: int = 1, cached_rows: dict | None = None
+) -> dict[str, int]:
+    """
+    曲ごとの処理を jobs 個のプロセスで並列に行い、曲名の順に結果のCSVファイルに書き込む。
+
+    Args:
+        cached_rows (dict): 曲名 → 前回の結果の行のリスト。ここにある曲は処理しない。
+
+    Returns:
+        dict: 曲名 → 書き込んだ行数
+    """
+    cached_rows = cached_rows or {}
+    targets = [song for song in songs if song[0] not in cached_rows]
+    if jobs > 1 and len(targets) > 1:
+        pool = Pool(min(jobs, len(targets)), initializer=_init_worker, initargs=(path_table,))
+        results = pool.imap(song_to_csv_rows, targets)
+    else:
+        pool = None
+        _init_worker(path_table)
+        results = map(song_to_csv_rows, targets)
+    n_rows = {}
+    try:
+        # 書き込みの途中で失敗しても前回の結果が残るように、一時ファイルに書いてから置き換える
+        with open(f'{path_csv_out}.tmp', 'w', encoding='utf-8', newline='\n') as f:
+            f.write(f'songname,{MONO_CSV_HEADER},{FULL_CSV_HEADER}')
+            for songname, _, _ in tqdm(songs):
+                rows = cached_rows[songname] if songname in cached_rows else next(results)
+                for row in rows:
+                    f.write('\n' + row)
+                n_rows[songname] = len(rows)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    replace(f'{path_csv_out}.tmp', path_csv_out)
+    return n_rows
+
+
+def update_result_csv(
+    songs: list, path_table, path_csv_out, path_manifest, jobs: int = 1, force: bool = False
+) -> bool:
+    """
+    追加・変更された曲だけを処理して、結果のCSVファイルとマニフェストを更新する。
+
+    Returns:
+        bool: 結果のCSVファイルを更新したかどうか
+    """
+    table_hash = hash_file(path_table)
+    manifest = {}
+    if not force and exists(path_csv_out):
+        manifest = load_manifest(path_manifest, table_hash)
+    old_songs = manifest.get('songs', {})
+    new_songs = {}
+    unchanged = []
+    for songname, path_lab, path_ust in songs:
+        old_entry = old_songs.get(songname, {})
+        entry = {
+            'lab': get_file_state(path_lab, old_entry.get('lab')),
+            'ust': get_file_state(path_ust, old_entry.get('ust')),
+        }
+        if old_entry and all(
+            entry[key]['hash'] == old_entry[key]['hash'] for key in ('lab', 'ust')
+        ):
+            unchanged.append(songname)
+        new_songs[songname] = entry
+    n_removed = len(old_songs.keys() - new_songs.keys())
+    print(
+        f'曲数: {len(songs)} (変更なし: {len(unchanged)}, '
+        f'追加・変更: {len(songs) - len(unchanged)}, 削除: {n_removed})'
+    )
+    if len(unchanged) == len(songs) and n_removed == 0:
+        # 更新日時だけが変わった場合のために、マニフェストは書き直す
+        for songname, entry in new_songs.items():
+            entry['n_rows'] = old_songs[songname]['n_rows']
+        write_manifest(path_manifest, table_hash, new_songs)
+        return False
+
+    cached_rows = read_cached_rows(path_csv_out, manifest, unchanged) if unchanged else {}
+    n_rows = write_result_csv(songs, path_table, path_csv_out, jobs, cached_rows=cached_rows)
+    for songname, entry in new_songs.items():
+        entry['n_rows'] = n_rows[songname]
+    write_manifest(path_manifest, table_hash, new_songs)
+    return True
+
+
+def write_manifest(path_manifest, table_hash: str, songs: dict):
+    """マニフェストを保存する。曲の順番は結果のCSVファイルの行の順番と同じにすること。"""
+    with open(f'{path_manifest}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(
+            {'version': MANIFEST_VERSION, 'table': table_hash, 'songs': songs},
+            f,
+            ensure_ascii=False,
+            indent=1,
+        )
+    replace(f'{path_manifest}.tmp', path_manifest)
+
+
+def to_analysis_dataframe(df):
+    """
+    結果のデータフレームを分析用の型にする。
+
+    - 列名の前後の空白を削除する。
+    - 文字列の列をカテゴリ型にする。
+    - 音素の長さ (アライメントと楽譜) と、楽譜に対する発声開始時刻のずれ (timelag) の列を追加する。
+      単位はほかの時刻の列と同じ 100ns。
+    """
+    df = df.rename(columns=str.strip)
+    for column in df.columns:
+        if not pandas.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype('category')
+    df['duration(align)'] = df['end(align)'] - df['start(align)']
+    df['duration(score)'] = df['end'] - df['start']
+    df['timelag'] = df['start(align)'] - df['start']
+    return df
+
+
+def _describe_by_phoneme(df, column) -> pandas.DataFrame:
+    """音素ごとに列の値の分布を集計する。単位は秒にする。"""
+    grouped = (df[column] * TIME_UNIT_SEC).groupby(df['phoneme(align)'], observed=True)
+    stats = grouped.agg(['count', 'mean', 'std', 'min', 'max'])
+    quantiles = grouped.quantile(list(STATS_QUANTILES)).unstack()
+    quantiles.columns = [f'q{int(q * 100):02d}' for q in quantiles.columns]
+    return stats.join(quantiles).sort_values('count', ascending=False)
+
+
+def phoneme_duration_stats(df) -> pandas.DataFrame:
+    """音素ごとのアライメントの長さ (秒) の分布を集計する。"""
+    return _describe_by_phoneme(df, 'duration(align)')
+
+
+def timing_offset_stats(df) -> pandas.DataFrame:
+    """音素ごとに、楽譜に対するアライメントの発声開始時刻のずれ (秒) の分布を集計する。"""
+    return _describe_by_phoneme(df, 'timelag')
+
+
+def write_npz(df, path_npz):
+    """
+    データフレームを列ごとの配列にして、圧縮したNPZファイルに保存する。
+    カテゴリ型の列は {列名} にコード、{列名}.categories にカテゴリの文字列を保存する。
+    """
+    arrays = {}
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pandas.CategoricalDtype):
+            arrays[column] = series.cat.codes.to_numpy()
+            arrays[f'{column}.categories'] = np.asarray(series.cat.categories, dtype=str)
+        else:
+            arrays[column] = series.to_numpy()
+    np.savez_compressed(path_npz, **arrays)
+
+
+def write_outputs(path_raw_csv, path_out, output_format, path_duration_stats, path_timing_stats):
+    """
+    全曲の行を結合したCSVから、結果のファイルと集計結果を保存する。
+    """
+    df = pandas.read_csv(path_raw_csv)
     df = df.dropna(how='all', axis=1)
     print(df)
-    df.to_csv(path_result_csv)
+    if output_format == 'csv':
+        df.to_csv(path_out)
+    df = to_analysis_dataframe(df)
+    if output_format == 'parquet':
+        try:
+            df.to_parquet(path_out, index=False)
+        except ImportError as e:
+            raise ImportError(
+                'Parquet形式で保存するには pyarrow が必要です。--format npz を使うこともできます。'
+            ) from e
+    elif output_format == 'npz':
+        write_npz(df, path_out)
+    phoneme_duration_stats(df).to_csv(path_duration_stats)
+    timing_offset_stats(df).to_csv(path_timing_stats)
+
+
+def get_parser():
+    parser = ArgumentParser(description='Convert a singing database into a CSV for analysis')
+    parser.add_argument('db_root', type=str, nargs='?', help='Singing database directory')
+    parser.add_argument(
+        '--table', type=str, default=DEFAULT_TABLE_PATH, help='Kana-to-phonemes table'
+    )
+    parser.add_argument(
+        '--out',
+        type=str,
+        default=DEFAULT_RESULT_PATH,
+        help='Output path (the extension is replaced according to --format)',
+    )
+    parser.add_argument(
+        '--format',
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet', 'npz'],
+        help='Output format (parquet requires pyarrow)',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=cpu_count() or 1,
+        help='Number of worker processes (1: process songs in this process)',
+    )
+    parser.add_argument(
+        '--full', action='store_true', help='Reprocess all songs ignoring the manifest'
+    )
+    return parser
+
+
+def main(
+    db_root=None,
+    path_table=DEFAULT_TABLE_PATH,
+    path_result_csv=DEFAULT_RESULT_PATH,
+    jobs=1,
+    force=False,
+    output_format='csv',
+):
+    if db_root is None:
+        db_root = input('db_root: ')
+    db_root = db_root.strip('"')
+    songs = find_songs(db_root)
+    if not songs:
+        raise ValueError(f'LABファイルとUSTファイルの組が見つかりません。({db_root})')
+
+    stem = splitext(path_result_csv)[0]
+    # 全曲の行を結合したCSV (列の削除などをする前のもの) と、そのマニフェスト
+    path_raw_csv = f'{stem}_raw.csv'
+    path_manifest = f'{stem}_manifest.json'
+    path_out = f'{stem}.{output_format}'
+    path_duration_stats = f'{stem}_duration_stats.csv'
+    path_timing_stats = f'{stem}_timing_stats.csv'
+    updated = update_result_csv(
+        songs, path_table, path_raw_csv, path_manifest, jobs=jobs, force=force
+    )
+    if not updated and all(
+        exists(path) for path in (path_out, path_duration_stats, path_timing_stats)
+    ):
+        print(f'変更された曲がないので、{basename(path_out)} はそのままにします。')
+        return
+
+    write_outputs(path_raw_csv, path_out, output_format, path_duration_stats, path_timing_stats)
 
 
 if __name__ == '__main__':
-    main()
+    args = get_parser().parse_args(sys.argv[1:])
+    main(
+        args.db_root,
+        args.table,
+        args.out,
+        jobs=args.jobs,
+        force=args.full,
+        output_format=args.format,
+    )